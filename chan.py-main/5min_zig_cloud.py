@@ -6,20 +6,19 @@ from lightweight_charts.widgets import StreamlitChart
 from Chan import CChan
 from ChanConfig import CChanConfig
 from Common.CEnum import AUTYPE, DATA_SRC, KL_TYPE
+from DataAPI.BulkAPI import CBulkAPI
 
 # ================= 配置 =================
 # 雅虎财经的代码格式：BTC-USD
 CODE_YF = "BTC-USD" 
-# 缠论计算用的代码（对应生成的CSV文件名）
-CODE_CSV = "BTC_YF_DATA" 
 TARGET_LV = KL_TYPE.K_5M
 # =======================================
 
 st.set_page_config(page_title="BTC 5分钟 (云端直连版)", layout="wide")
 
-def fetch_and_save_data():
+def fetch_data():
     """
-    从雅虎财经获取数据，并转换成 chan.py 能识别的 CSV 格式
+    从雅虎财经获取数据，整理成 DATA_SRC.BULK 能识别的 DataFrame，直接交给 chan.py，不再落盘成 CSV
     """
     try:
         # 1. 下载数据 (最近 5 天的 5 分钟数据)
@@ -27,14 +26,14 @@ def fetch_and_save_data():
         df = yf.download(CODE_YF, period="5d", interval="5m", progress=False)
         
         if df.empty:
-            return False
+            return None
 
         # 2. 格式清洗
         df = df.reset_index()
-        # 雅虎的时间是 UTC，我们转成字符串即可，chan.py 会处理
-        # 重命名列以符合 chan.py 的 CSV 读取标准
+        # 雅虎的时间是带时区的 UTC 时间，DATA_SRC.BULK 会按其中的当地时间处理
+        # 重命名列以符合 chan.py 的列名
         # 雅虎列名: Date, Open, High, Low, Close, Volume
-        # chan.py CSV需要: time, open, high, low, close, volume
+        # chan.py 需要: time, open, high, low, close, volume
         
         # 展平多层索引（如果存在）
         if isinstance(df.columns, pd.MultiIndex):
@@ -56,27 +55,21 @@ def fetch_and_save_data():
         # 过滤掉非交易时间可能的空值
         df = df.dropna(subset=needed_cols)
         
-        # 3. 保存为临时 CSV 文件
-        # chan.py 的 DATA_SRC.CSV 模式会读取 code + ".csv"
-        csv_filename = f"{CODE_CSV}.csv"
-        # 这里的路径通常是根目录，或者 Data 目录，我们直接存根目录并在 DataAPI 里兼容，
-        # 或者最简单的方法：chan.py 默认可能在特定目录找，但 main.py 示例是直接读取。
-        # 为了保险，我们保存到当前脚本同级目录
-        df[needed_cols].to_csv(csv_filename, index=False)
-        return True
+        return df[needed_cols]
         
     except Exception as e:
         st.error(f"雅虎数据获取失败: {e}")
-        return False
+        return None
 
 @st.cache_data(ttl=60) # 1分钟刷新一次
 def get_chan_data():
-    # 1. 先去下载最新数据存为 CSV
-    success = fetch_and_save_data()
-    if not success:
+    # 1. 下载最新数据，直接注册给 DATA_SRC.BULK
+    df = fetch_data()
+    if df is None:
         return None
+    CBulkAPI.set_data(CODE_YF, TARGET_LV, df)
 
-    # 2. 让 Chan.py 读取这个 CSV
+    # 2. 让 Chan.py 直接读取内存中的数据
     config = CChanConfig({
         "bi_strict": True,
         "bi_fx_check": "strict",
@@ -87,10 +80,10 @@ def get_chan_data():
     })
     
     try:
-        # DATA_SRC.CSV 模式下，code 参数对应文件名（不带.csv后缀）
+        # DATA_SRC.BULK 模式下，code 参数对应 CBulkAPI.set_data 注册时的代码
         chan = CChan(
-            code=CODE_CSV,          # 读取 BTC_YF_DATA.csv
-            data_src=DATA_SRC.CSV,  # 指定模式为 CSV
+            code=CODE_YF,
+            data_src=DATA_SRC.BULK,
             lv_list=[TARGET_LV],
             config=config,
             autype=AUTYPE.QFQ,
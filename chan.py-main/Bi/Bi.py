@@ -1,14 +1,19 @@
-from typing import List, Optional
+import math
+from typing import Iterable, List, Optional, Tuple
 
 from Common.cache import make_cache
 from Common.CEnum import BI_DIR, BI_TYPE, DATA_FIELD, FX_TYPE, MACD_ALGO
 from Common.ChanException import CChanException, ErrCode
 from KLine.KLine import CKLine
+from KLine.KLine_MetricIndex import CKLine_MetricIndex
 from KLine.KLine_Unit import CKLine_Unit
 
 
 class CBi:
-    def __init__(self, begin_klc: CKLine, end_klc: CKLine, idx: int, is_sure: bool):
+    __slots__ = ('__begin_klc', '__end_klc', '__dir', '__idx', '__type', '__is_sure', '__sure_end', '__seg_idx',
+                 'peak_history', 'parent_seg', 'bsp', 'next', 'pre', 'metric_index', '_memoize_cache')
+
+    def __init__(self, begin_klc: CKLine, end_klc: CKLine, idx: int, is_sure: bool, metric_index: Optional[CKLine_MetricIndex] = None):
         # self.__begin_klc = begin_klc
         # self.__end_klc = end_klc
         self.__dir = None
@@ -31,6 +36,7 @@ class CBi:
 
         self.next: Optional[CBi] = None
         self.pre: Optional[CBi] = None
+        self.metric_index = metric_index  # 所在级别K线的指标前缀和，为None时逐根K线扫描
     def clean_cache(self):
         self._memoize_cache = {}
 
@@ -151,13 +157,11 @@ class CBi:
     def _mid(self):
         return (self._high() + self._low()) / 2  # 笔的中位价
 
-    @make_cache
     def is_down(self):
-        return self.dir == BI_DIR.DOWN
+        return self.__dir == BI_DIR.DOWN
 
-    @make_cache
     def is_up(self):
-        return self.dir == BI_DIR.UP
+        return self.__dir == BI_DIR.UP
 
     def update_virtual_end(self, new_klc: CKLine):
         self.append_sure_end(self.end_klc)
@@ -205,11 +209,49 @@ class CBi:
         else:
             raise CChanException(f"unsupport macd_algo={macd_algo}, should be one of area/full_area/peak/diff/slope/amp", ErrCode.PARA_ERROR)
 
+    def iter_klu_metric(self, column: str, begin_idx: int, end_idx: int, reverse=False) -> Iterable[float]:
+        # 按klu.idx遍历[begin_idx, end_idx]范围内的指标值，列式存储模式下直接切片
+        store = self.begin_klc.lst[0].store
+        if store is not None:
+            arr = getattr(store, column)
+            if arr is None:
+                raise AttributeError(column)
+            _slice = arr[store.row(begin_idx):store.row(end_idx)+1]
+            return reversed(_slice) if reverse else _slice
+        if column == "macd":
+            getter = lambda klu: klu.macd.macd
+        else:
+            getter = lambda klu: getattr(klu, column)
+        if reverse:
+            return (getter(klu) for klc in self.klc_lst_re for klu in klc[::-1] if begin_idx <= klu.idx <= end_idx)
+        return (getter(klu) for klc in self.klc_lst for klu in klc.lst if begin_idx <= klu.idx <= end_idx)
+
+    def iter_klu_trade_metric(self, metric: str, begin_idx: int, end_idx: int) -> Iterable[Optional[float]]:
+        # 同iter_klu_metric，遍历成交量等交易信息，None表示缺失
+        store = self.begin_klc.lst[0].store
+        if store is not None:
+            return (None if math.isnan(value) else value for value in store.trade_info[metric][store.row(begin_idx):store.row(end_idx)+1])
+        return (klu.trade_info.metric[metric] for klc in self.klc_lst for klu in klc.lst if begin_idx <= klu.idx <= end_idx)
+
+    def klu_idx_range(self) -> Tuple[int, int]:
+        # 笔所覆盖的所有KLC内的K线范围
+        return self.begin_klc.lst[0].idx, self.end_klc.lst[-1].idx
+
+    def get_metric_index(self, end_idx: int) -> Optional[CKLine_MetricIndex]:
+        # 指标已经追加到end_idx时才能走区间查询
+        if self.metric_index is not None and self.metric_index.contains(end_idx):
+            return self.metric_index
+        return None
+
     @make_cache
     def Cal_Rsi(self):
-        rsi_lst: List[float] = []
-        for klc in self.klc_lst:
-            rsi_lst.extend(klu.rsi for klu in klc.lst)
+        begin_idx, end_idx = self.klu_idx_range()
+        metric_index = self.get_metric_index(end_idx)
+        if metric_index is not None and metric_index.rsi is not None:
+            if self.is_down():
+                return 10000.0/(metric_index.rsi_extremum(begin_idx, end_idx, is_max=False)+1e-7)
+            return metric_index.rsi_extremum(begin_idx, end_idx, is_max=True)
+        rsi_lst: List[float] = list(self.iter_klu_metric("rsi", *self.klu_idx_range()))
         return 10000.0/(min(rsi_lst)+1e-7) if self.is_down() else max(rsi_lst)
 
     @make_cache
@@ -217,24 +259,29 @@ class CBi:
         _s = 1e-7
         begin_klu = self.get_begin_klu()
         end_klu = self.get_end_klu()
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                if klu.idx < begin_klu.idx or klu.idx > end_klu.idx:
-                    continue
-                if (self.is_down() and klu.macd.macd < 0) or (self.is_up() and klu.macd.macd > 0):
-                    _s += abs(klu.macd.macd)
+        metric_index = self.get_metric_index(end_klu.idx)
+        if metric_index is not None and metric_index.macd is not None:
+            return _s + metric_index.macd_area(begin_klu.idx, end_klu.idx, is_positive=self.is_up())
+        for macd in self.iter_klu_metric("macd", begin_klu.idx, end_klu.idx):
+            if (self.is_down() and macd < 0) or (self.is_up() and macd > 0):
+                _s += abs(macd)
         return _s
 
     @make_cache
     def Cal_MACD_peak(self):
         peak = 1e-7
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                if abs(klu.macd.macd) > peak:
-                    if self.is_down() and klu.macd.macd < 0:
-                        peak = abs(klu.macd.macd)
-                    elif self.is_up() and klu.macd.macd > 0:
-                        peak = abs(klu.macd.macd)
+        begin_idx, end_idx = self.klu_idx_range()
+        metric_index = self.get_metric_index(end_idx)
+        if metric_index is not None and metric_index.macd is not None:
+            if self.is_down():
+                return max(peak, -metric_index.macd_extremum(begin_idx, end_idx, is_max=False))
+            return max(peak, metric_index.macd_extremum(begin_idx, end_idx, is_max=True))
+        for macd in self.iter_klu_metric("macd", *self.klu_idx_range()):
+            if abs(macd) > peak:
+                if self.is_down() and macd < 0:
+                    peak = abs(macd)
+                elif self.is_up() and macd > 0:
+                    peak = abs(macd)
         return peak
 
     def Cal_MACD_half(self, is_reverse):
@@ -247,36 +294,31 @@ class CBi:
     def Cal_MACD_half_obverse(self):
         _s = 1e-7
         begin_klu = self.get_begin_klu()
+        end_idx = self.klu_idx_range()[1]
+        metric_index = self.get_metric_index(end_idx)
+        if metric_index is not None and metric_index.macd is not None:
+            return _s + metric_index.macd_half_area(begin_klu.idx, end_idx)
         peak_macd = begin_klu.macd.macd
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                if klu.idx < begin_klu.idx:
-                    continue
-                if klu.macd.macd*peak_macd > 0:
-                    _s += abs(klu.macd.macd)
-                else:
-                    break
-            else:  # 没有被break，继续找写一个KLC
-                continue
-            break
+        for macd in self.iter_klu_metric("macd", begin_klu.idx, self.klu_idx_range()[1]):
+            if macd*peak_macd > 0:
+                _s += abs(macd)
+            else:
+                break
         return _s
 
     @make_cache
     def Cal_MACD_half_reverse(self):
         _s = 1e-7
         begin_klu = self.get_end_klu()
+        metric_index = self.get_metric_index(begin_klu.idx)
+        if metric_index is not None and metric_index.macd is not None:
+            return _s + metric_index.macd_half_area(begin_klu.idx, self.klu_idx_range()[0])
         peak_macd = begin_klu.macd.macd
-        for klc in self.klc_lst_re:
-            for klu in klc[::-1]:
-                if klu.idx > begin_klu.idx:
-                    continue
-                if klu.macd.macd*peak_macd > 0:
-                    _s += abs(klu.macd.macd)
-                else:
-                    break
-            else:  # 没有被break，继续找写一个KLC
-                continue
-            break
+        for macd in self.iter_klu_metric("macd", self.klu_idx_range()[0], begin_klu.idx, reverse=True):
+            if macd*peak_macd > 0:
+                _s += abs(macd)
+            else:
+                break
         return _s
 
     @make_cache
@@ -284,14 +326,16 @@ class CBi:
         """
         macd红绿柱最大值最小值之差
         """
+        begin_idx, end_idx = self.klu_idx_range()
+        metric_index = self.get_metric_index(end_idx)
+        if metric_index is not None and metric_index.macd is not None:
+            return metric_index.macd_extremum(begin_idx, end_idx, is_max=True) - metric_index.macd_extremum(begin_idx, end_idx, is_max=False)
         _max, _min = float("-inf"), float("inf")
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                macd = klu.macd.macd
-                if macd > _max:
-                    _max = macd
-                if macd < _min:
-                    _min = macd
+        for macd in self.iter_klu_metric("macd", *self.klu_idx_range()):
+            if macd > _max:
+                _max = macd
+            if macd < _min:
+                _min = macd
         return _max-_min
 
     @make_cache
@@ -314,12 +358,17 @@ class CBi:
 
     def Cal_MACD_trade_metric(self, metric: str, cal_avg=False) -> float:
         _s = 0
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                metric_res = klu.trade_info.metric[metric]
-                if metric_res is None:
-                    return 0.0
-                _s += metric_res
+        begin_idx, end_idx = self.klu_idx_range()
+        metric_index = self.get_metric_index(end_idx)
+        if metric_index is not None:
+            metric_sum = metric_index.trade_metric_sum(metric, begin_idx, end_idx)
+            if metric_sum is None:
+                return 0.0
+            return metric_sum / self.get_klu_cnt() if cal_avg else metric_sum
+        for metric_res in self.iter_klu_trade_metric(metric, begin_idx, end_idx):
+            if metric_res is None:
+                return 0.0
+            _s += metric_res
         return _s / self.get_klu_cnt() if cal_avg else _s
 
     # def set_klc_lst(self, lst):
@@ -1,7 +1,9 @@
 from typing import List, Optional, Union, overload
 
 from Common.CEnum import FX_TYPE, KLINE_DIR
+from Common.TrimmedList import trim_list
 from KLine.KLine import CKLine
+from KLine.KLine_MetricIndex import CKLine_MetricIndex
 
 from .Bi import CBi
 from .BiConfig import CBiConfig
@@ -14,6 +16,9 @@ class CBiList:
         self.config = bi_conf
 
         self.free_klc_lst = []  # 仅仅用作第一笔未画出来之前的缓存，为了获得更精准的结果而已，不加这块逻辑其实对后续计算没太大影响
+        self.change_begin_idx = 0  # 上次计算线段之后，第一根有变化（新增/删除/修改）的笔
+        self.change_klc_idx = 0  # 上次计算线段时最后一根合并K线，之后可能还会合并进新的K线
+        self.metric_index: Optional[CKLine_MetricIndex] = None  # 由CKLine_List设置，新建的笔用来做指标区间查询
 
     def __str__(self):
         return "\n".join([str(bi) for bi in self.bi_list])
@@ -33,6 +38,22 @@ class CBiList:
     def __len__(self):
         return len(self.bi_list)
 
+    def mark_change(self, idx: int):
+        self.change_begin_idx = min(self.change_begin_idx, idx)
+
+    def pop_change_begin(self) -> int:
+        # 供计算线段使用：返回自上次调用以来第一根有变化的笔，此前的笔都没有被修改过
+        res = self.change_begin_idx
+        if len(self.bi_list) > 0:
+            last_klc = self.bi_list[-1].end_klc
+            if last_klc.idx >= self.change_klc_idx:  # 结尾的合并K线可能又合并了新K线，高低点会变
+                res = min(res, len(self.bi_list) - 1)
+            while last_klc.next:
+                last_klc = last_klc.next
+            self.change_klc_idx = last_klc.idx
+        self.change_begin_idx = len(self.bi_list)
+        return res
+
     def try_create_first_bi(self, klc: CKLine) -> bool:
         for exist_free_klc in self.free_klc_lst:
             if exist_free_klc.fx == klc.fx:
@@ -75,12 +96,14 @@ class CBiList:
             return False
         _tmp_last_bi = self.bi_list[-1]
         self.bi_list.pop()
+        self.mark_change(len(self.bi_list))
         if not self.try_update_end(klc, for_virtual=for_virtual):
             self.bi_list.append(_tmp_last_bi)
             return False
         else:
             if for_virtual:
                 self.bi_list[-1].append_sure_end(_tmp_last_bi.end_klc)
+                self.mark_change(len(self.bi_list) - 1)
             return True
 
     def update_bi_sure(self, klc: CKLine) -> bool:
@@ -107,12 +130,14 @@ class CBiList:
             sure_end_list = [klc for klc in self.bi_list[-1].sure_end]
             if len(sure_end_list):
                 self.bi_list[-1].restore_from_virtual_end(sure_end_list[0])
+                self.mark_change(len(self.bi_list) - 1)
                 self.last_end = self[-1].end_klc
                 for sure_end in sure_end_list[1:]:
                     self.add_new_bi(self.last_end, sure_end, is_sure=True)
                     self.last_end = self[-1].end_klc
             else:
                 del self.bi_list[-1]
+                self.mark_change(len(self.bi_list))
         self.last_end = self[-1].end_klc if len(self) > 0 else None
         if len(self) > 0:
             self[-1].next = None
@@ -127,6 +152,7 @@ class CBiList:
         if (self[-1].is_up() and klc.high >= self[-1].end_klc.high) or (self[-1].is_down() and klc.low <= self[-1].end_klc.low):
             # 更新最后一笔
             self.bi_list[-1].update_virtual_end(klc)
+            self.mark_change(len(self.bi_list) - 1)
             return True
         _tmp_klc = klc
         while _tmp_klc and _tmp_klc.idx > self[-1].end_klc.idx:
@@ -141,7 +167,8 @@ class CBiList:
         return False
 
     def add_new_bi(self, pre_klc, cur_klc, is_sure=True):
-        self.bi_list.append(CBi(pre_klc, cur_klc, idx=len(self.bi_list), is_sure=is_sure))
+        self.bi_list.append(CBi(pre_klc, cur_klc, idx=len(self.bi_list), is_sure=is_sure, metric_index=self.metric_index))
+        self.mark_change(len(self.bi_list) - 1)
         if len(self.bi_list) >= 2:
             self.bi_list[-2].next = self.bi_list[-1]
             self.bi_list[-1].pre = self.bi_list[-2]
@@ -203,6 +230,7 @@ class CBiList:
         last_bi = self.bi_list[-1]
         if (last_bi.is_up() and check_top(klc, for_virtual) and klc.high >= last_bi.get_end_val()) or \
            (last_bi.is_down() and check_bottom(klc, for_virtual) and klc.low <= last_bi.get_end_val()):
+            self.mark_change(len(self.bi_list) - 1)
             last_bi.update_virtual_end(klc) if for_virtual else last_bi.update_new_end(klc)
             self.last_end = klc
             return True
@@ -212,6 +240,16 @@ class CBiList:
     def get_last_klu_of_last_bi(self) -> Optional[int]:
         return self.bi_list[-1].get_end_klu().idx if len(self) > 0 else None
 
+    def trim_before(self, bi_idx: int):
+        # 滚动窗口模式：删除idx<bi_idx的笔，下标保持不变
+        self.bi_list, removed = trim_list(self.bi_list, bi_idx)
+        for bi in removed:
+            bi.pre = bi.next = None
+        if len(self.bi_list) > bi_idx:
+            self.bi_list[bi_idx].pre = None
+        self.free_klc_lst = []
+        self.change_begin_idx = max(self.change_begin_idx, bi_idx)
+
 
 def end_is_peak(last_end: CKLine, cur_end: CKLine) -> bool:
     if last_end.fx == FX_TYPE.BOTTOM:
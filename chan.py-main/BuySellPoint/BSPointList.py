@@ -59,6 +59,20 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
             del self.bsp1_dict[self.bsp1_list[-1].bi.idx]
             self.bsp1_list.pop()
 
+    def trim_before(self, line_idx: int):
+        # 滚动窗口模式：删除所在笔/线段idx<line_idx的买卖点
+        for bsp_list in self.bsp_store_dict.values():
+            for lst in bsp_list:
+                cnt = next((i for i, bsp in enumerate(lst) if bsp.bi.idx >= line_idx), len(lst))
+                for bsp in lst[:cnt]:
+                    if self.bsp_store_flat_dict.get(bsp.bi.idx) is bsp:
+                        del self.bsp_store_flat_dict[bsp.bi.idx]
+                del lst[:cnt]
+        cnt = next((i for i, bsp in enumerate(self.bsp1_list) if bsp.bi.idx >= line_idx), len(self.bsp1_list))
+        for bsp in self.bsp1_list[:cnt]:
+            del self.bsp1_dict[bsp.bi.idx]
+        del self.bsp1_list[:cnt]
+
     def bsp_iter(self) -> Iterable[CBS_Point[LINE_TYPE]]:
         for bsp_list in self.bsp_store_dict.values():
             yield from bsp_list[True]
@@ -9,6 +9,8 @@ LINE_TYPE = TypeVar('LINE_TYPE', CBi, CSeg)
 
 
 class CBS_Point(Generic[LINE_TYPE]):
+    __slots__ = ('bi', 'klu', 'is_buy', 'type', 'relate_bsp1', 'features', 'is_segbsp')
+
     def __init__(self, bi: LINE_TYPE, is_buy, bs_type: BSP_TYPE, relate_bsp1: Optional['CBS_Point'], feature_dict=None):
         self.bi: LINE_TYPE = bi
         self.klu = bi.get_end_klu()
@@ -6,12 +6,15 @@ from collections import defaultdict
 from typing import Dict, Iterable, List, Optional, Union
 
 from BuySellPoint.BS_Point import CBS_Point
+from ChanCheckpoint import CChanCheckpoint
 from ChanConfig import CChanConfig
+from ChanSerializer import dump_chan, load_chan
 from Common.CEnum import AUTYPE, DATA_SRC, KL_TYPE
 from Common.ChanException import CChanException, ErrCode
 from Common.CTime import CTime
 from Common.func_util import check_kltype_order, kltype_lte_day
 from DataAPI.CommonStockAPI import CCommonStockApi
+from DataAPI.csvAPI import ctime_to_time_key, parse_time_key
 from KLine.KLine_List import CKLine_List
 from KLine.KLine_Unit import CKLine_Unit
 
@@ -80,8 +83,57 @@ class CChan:
                     if klu.sup_kl:
                         memo[id(klu)].sup_kl = memo[id(klu.sup_kl)]
                     memo[id(klu)].sub_kl_list = [memo[id(sub_kl)] for sub_kl in klu.sub_kl_list]
+        if hasattr(self, 'last_klu_checkpoint'):
+            obj.last_klu_checkpoint = copy.deepcopy(self.last_klu_checkpoint, memo)
         return obj
 
+    def checkpoint(self) -> CChanCheckpoint:
+        # 记录当前状态，之后可以通过rollback回到这里（可多次回滚），用来代替每次都deepcopy整个CChan
+        # 只保存不确定的尾部（虚笔、未确定线段、中枢、买卖点等），开销和尾部长度相关，和历史长度无关
+        return CChanCheckpoint(self)
+
+    def rollback(self, checkpoint: CChanCheckpoint):
+        checkpoint.restore(self)
+
+    def update_last_klu(self, inp):
+        # 用于实时行情中还没走完的K线，输入格式同trigger_load，最高级别只能传一根K线
+        # 最高级别K线时间和上一次update_last_klu的相同：撤销上次传入的K线（包括各次级别），用新值重新计算
+        # 时间更大：说明上一根已经走完，记录checkpoint后作为新K线加入
+        if self.lv_list[0] not in inp or len(inp[self.lv_list[0]]) != 1:
+            raise CChanException(f"update_last_klu需要且只能传入一根最高级别{self.lv_list[0]}K线", ErrCode.PARA_ERROR)
+        cur_time = inp[self.lv_list[0]][0].time
+        for klu_lst in inp.values():
+            for klu in klu_lst:  # 同一个klu对象可能被反复传入，清掉上一次计算时建立的关系
+                klu.release_store()
+                klu.sub_kl_list = []
+                klu.next = None
+        last_klu_checkpoint = getattr(self, 'last_klu_checkpoint', None)
+        if last_klu_checkpoint is not None and last_klu_checkpoint[0] == cur_time.ts and len(self[0]) > 0 and self[0][-1][-1].time.ts == cur_time.ts:
+            self.rollback(last_klu_checkpoint[1])
+        else:
+            self.trim_history()  # 只在记录checkpoint之前删除历史，之后的回滚不会跨越删除
+            self.last_klu_checkpoint = (cur_time.ts, self.checkpoint())
+        self.trigger_load(inp, trim=False)
+
+    def trim_history(self):
+        # 滚动窗口模式（keep_seg_cnt）：各级别删除已经确定的历史，并断开父子级别K线之间指向被删除K线的引用
+        if not self.conf.keep_seg_cnt:
+            return
+        for lv in self.lv_list:
+            removed_klu = self.kl_datas[lv].trim_history(self.conf.keep_seg_cnt)
+            if not removed_klu:
+                continue
+            begin_idx = removed_klu[-1].idx + 1
+            sup_kl = None
+            for klu in removed_klu:
+                for sub_klu in klu.sub_kl_list:
+                    sub_klu.sup_kl = None
+                if klu.sup_kl is not None and klu.sup_kl is not sup_kl:  # 父级别K线可能还保留着
+                    sup_kl = klu.sup_kl
+                    sup_kl.sub_kl_list = [sub_klu for sub_klu in sup_kl.sub_kl_list if sub_klu.idx >= begin_idx]
+                klu.sup_kl = None
+                klu.sub_kl_list = []
+
     def do_init(self):
         self.kl_datas: Dict[KL_TYPE, CKLine_List] = {}
         for idx in range(len(self.lv_list)):
@@ -106,16 +158,29 @@ class CChan:
     def get_next_lv_klu(self, lv_idx):
         if isinstance(lv_idx, int):
             lv_idx = self.lv_list[lv_idx]
-        if len(self.g_kl_iter[lv_idx]) == 0:
-            raise StopIteration
+        iter_lst = self.g_kl_iter[lv_idx]
+        while iter_lst:
+            try:
+                return next(iter_lst[0])
+            except StopIteration:
+                del iter_lst[0]
+        raise StopIteration
+
+    def read_lv_klu(self, lv_idx) -> Optional[CKLine_Unit]:
+        # 下一根K线：优先取上次多读的一根（已经检查过），否则从数据源读取并检查时间单调；没有数据时返回None
+        kline_unit = self.klu_cache[lv_idx]
+        if kline_unit is not None:
+            self.klu_cache[lv_idx] = None
+            return kline_unit
         try:
-            return self.g_kl_iter[lv_idx][0].__next__()
+            kline_unit = self.get_next_lv_klu(lv_idx)
         except StopIteration:
-            self.g_kl_iter[lv_idx] = self.g_kl_iter[lv_idx][1:]
-            if len(self.g_kl_iter[lv_idx]) != 0:
-                return self.get_next_lv_klu(lv_idx)
-            else:
-                raise
+            return None
+        self.try_set_klu_idx(lv_idx, kline_unit)
+        if kline_unit.time.ts <= self.klu_last_t[lv_idx].ts:
+            raise CChanException(f"kline time err, cur={kline_unit.time}, last={self.klu_last_t[lv_idx]}, or refer to quick_guide.md, try set auto=False in the CTime returned by your data source class", ErrCode.KL_NOT_MONOTONOUS)
+        self.klu_last_t[lv_idx] = kline_unit.time
+        return kline_unit
 
     def step_load(self):
         assert self.conf.trigger_step
@@ -129,7 +194,7 @@ class CChan:
         if not yielded:
             yield self
 
-    def trigger_load(self, inp):
+    def trigger_load(self, inp, trim=True):
         # {type: [klu, ...]}
         if not hasattr(self, 'klu_cache'):
             self.klu_cache: List[Optional[CKLine_Unit]] = [None for _ in self.lv_list]
@@ -149,6 +214,14 @@ class CChan:
         if not self.conf.trigger_step:  # 非回放模式全部算完之后才算一次中枢和线段
             for lv in self.lv_list:
                 self.kl_datas[lv].cal_seg_and_zs()
+        if trim:
+            self.trim_history()
+
+    def load_bulk(self, inp, autofix=False):
+        # 同trigger_load，但每个级别传入的是DataFrame或{列名: numpy数组}，整体检查价格后直接生成K线，不走逐行dict
+        # {type: DataFrame}，格式见DataAPI/BulkAPI.py
+        from DataAPI.BulkAPI import bulk_to_klu_list
+        self.trigger_load({lv: bulk_to_klu_list(data, lv, autofix) for lv, data in inp.items()})
 
     def init_lv_klu_iter(self, stockapi_cls):
         # 为了跳过一些获取数据失败的级别
@@ -169,31 +242,14 @@ class CChan:
         return lv_klu_iter
 
     def GetStockAPI(self):
-        _dict = {}
-        if self.data_src == DATA_SRC.BAO_STOCK:
-            from DataAPI.BaoStockAPI import CBaoStock
-            _dict[DATA_SRC.BAO_STOCK] = CBaoStock
-        elif self.data_src == DATA_SRC.CCXT:
-            from DataAPI.ccxt import CCXT
-            _dict[DATA_SRC.CCXT] = CCXT
-        elif self.data_src == DATA_SRC.CSV:
-            from DataAPI.csvAPI import CSV_API
-            _dict[DATA_SRC.CSV] = CSV_API
-        if self.data_src in _dict:
-            return _dict[self.data_src]
-        assert isinstance(self.data_src, str)
-        if self.data_src.find("custom:") < 0:
-            raise CChanException("load src type error", ErrCode.SRC_DATA_TYPE_ERR)
-        package_info = self.data_src.split(":")[1]
-        package_name, cls_name = package_info.split(".")
-        import importlib
-        module = importlib.import_module(f"DataAPI.{package_name}")
-        return getattr(module, cls_name)
+        return get_stock_api_cls(self.data_src)
 
     def load(self, step=False):
         stockapi_cls = self.GetStockAPI()
+        session_holder = getattr(stockapi_cls, 'session_holder', False)  # 外部（如CChanPool的worker）已经初始化过的，不再每次初始化和关闭
         try:
-            stockapi_cls.do_init()
+            if not session_holder:
+                stockapi_cls.do_init()
             for lv_idx, klu_iter in enumerate(self.init_lv_klu_iter(stockapi_cls)):
                 self.add_lv_iter(lv_idx, klu_iter)
             self.klu_cache: List[Optional[CKLine_Unit]] = [None for _ in self.lv_list]
@@ -203,13 +259,58 @@ class CChan:
             if not step:  # 非回放模式全部算完之后才算一次中枢和线段
                 for lv in self.lv_list:
                     self.kl_datas[lv].cal_seg_and_zs()
+                self.trim_history()
         except Exception:
             raise
         finally:
-            stockapi_cls.do_close()
+            self.g_kl_iter.clear()  # 数据源已关闭，剩下没读完的次级别迭代器不能再用，也不能被deepcopy/序列化
+            if not session_holder:
+                stockapi_cls.do_close()
         if len(self[0]) == 0:
             raise CChanException("最高级别没有获得任何数据", ErrCode.NO_DATA)
 
+    def resume_load(self, end_time=None):
+        # 从缓存恢复的CChan（见ChanCache.py）继续计算：只拉取各级别最后一根K线之后的数据
+        # 数据源返回的最后一根K线和缓存中的不一致（如复权因子变化）、缓存中已经有end_time之后的K线时抛KL_DATA_INVALID，需要全量重算
+        if self.conf.trigger_step:
+            raise CChanException("resume_load不支持trigger_step模式", ErrCode.PARA_ERROR)
+        self.end_time = str(end_time) if isinstance(end_time, datetime.date) else end_time
+        if self.end_time is not None:
+            end_time_key = parse_time_key(self.end_time, is_end=True)
+            for lv_idx, lv in enumerate(self.lv_list):
+                last_klu = self.klu_cache[lv_idx] or (self[lv_idx][-1][-1] if len(self[lv_idx]) > 0 else None)
+                if last_klu is not None and ctime_to_time_key(last_klu.time) > end_time_key:
+                    raise CChanException(f"{lv} cached kline {last_klu.time} is after end_time {self.end_time}", ErrCode.KL_DATA_INVALID)
+        stockapi_cls = self.GetStockAPI()
+        session_holder = getattr(stockapi_cls, 'session_holder', False)
+        try:
+            if not session_holder:
+                stockapi_cls.do_init()
+            for lv_idx, lv in enumerate(self.lv_list):
+                last_klu = self.klu_cache[lv_idx] or (self[lv_idx][-1][-1] if len(self[lv_idx]) > 0 else None)
+                begin_date = last_klu.time.toDateStr('-') if last_klu is not None else self.begin_time
+                stockapi_instance = stockapi_cls(code=self.code, k_type=lv, begin_date=begin_date, end_date=self.end_time, autype=self.autype)
+                self.add_lv_iter(lv_idx, self.load_stock_data_after(stockapi_instance, lv, last_klu))
+            for _ in self.load_iterator(lv_idx=0, parent_klu=None, step=False):
+                ...
+            for lv in self.lv_list:
+                self.kl_datas[lv].cal_seg_and_zs()
+            self.trim_history()
+        finally:
+            self.g_kl_iter.clear()  # 数据源已关闭，剩下没读完的次级别迭代器不能再用，也不能被deepcopy/序列化
+            if not session_holder:
+                stockapi_cls.do_close()
+
+    def load_stock_data_after(self, stockapi_instance: CCommonStockApi, lv, last_klu: Optional[CKLine_Unit]) -> Iterable[CKLine_Unit]:
+        # klu.idx不设置，由try_set_klu_idx接着已有K线编号
+        for klu in stockapi_instance.get_kl_data():
+            if last_klu is not None and klu.time.ts <= last_klu.time.ts:
+                if klu.time.ts == last_klu.time.ts and (klu.open, klu.high, klu.low, klu.close) != (last_klu.open, last_klu.high, last_klu.low, last_klu.close):
+                    raise CChanException(f"{lv} kline at {klu.time} differs from cache", ErrCode.KL_DATA_INVALID)
+                continue
+            klu.kl_type = lv
+            yield klu
+
     def set_klu_parent_relation(self, parent_klu, kline_unit, cur_lv, lv_idx):
         if self.conf.kl_data_check and kltype_lte_day(cur_lv) and kltype_lte_day(self.lv_list[lv_idx-1]):
             self.check_kl_consitent(parent_klu, kline_unit)
@@ -232,45 +333,48 @@ class CChan:
         else:
             kline_unit.set_idx(self[lv_idx][-1][-1].idx + 1)
 
+    def get_last_klu(self, lv_idx) -> Optional[CKLine_Unit]:
+        return self[lv_idx][-1][-1] if len(self[lv_idx]) > 0 and len(self[lv_idx][-1]) > 0 else None
+
     def load_iterator(self, lv_idx, parent_klu, step):
         # K线时间天级别以下描述的是结束时间，如60M线，每天第一根是10点30的
         # 天以上是当天日期
-        cur_lv = self.lv_list[lv_idx]
-        pre_klu = self[lv_idx][-1][-1] if len(self[lv_idx]) > 0 and len(self[lv_idx][-1]) > 0 else None
+        # 按深度优先顺序加入K线：每根K线加入后先加入属于它的次级别K线，再加入同级别下一根；回放模式每加完一根最高级别K线返回一次
+        # 用cur_lv_idx在级别之间上下移动代替递归，不会为每根父级别K线创建一个生成器
+        top_lv_idx = lv_idx
+        last_lv_idx = len(self.lv_list) - 1
+        parent_lst: List[Optional[CKLine_Unit]] = [None for _ in self.lv_list]  # 每个级别当前的父级别K线
+        parent_lst[top_lv_idx] = parent_klu
+        pre_klu_lst = [self.get_last_klu(_lv_idx) for _lv_idx in range(len(self.lv_list))]
+        cur_lv_idx = top_lv_idx
         while True:
-            if self.klu_cache[lv_idx]:
-                kline_unit = self.klu_cache[lv_idx]
-                assert kline_unit is not None
-                self.klu_cache[lv_idx] = None
-            else:
-                try:
-                    kline_unit = self.get_next_lv_klu(lv_idx)
-                    self.try_set_klu_idx(lv_idx, kline_unit)
-                    if not kline_unit.time > self.klu_last_t[lv_idx]:
-                        raise CChanException(f"kline time err, cur={kline_unit.time}, last={self.klu_last_t[lv_idx]}, or refer to quick_guide.md, try set auto=False in the CTime returned by your data source class", ErrCode.KL_NOT_MONOTONOUS)
-                    self.klu_last_t[lv_idx] = kline_unit.time
-                except StopIteration:
+            kline_unit = self.read_lv_klu(cur_lv_idx)
+            parent = parent_lst[cur_lv_idx]
+            if kline_unit is None or (parent is not None and kline_unit.time.ts > parent.time.ts):
+                if kline_unit is not None:
+                    self.klu_cache[cur_lv_idx] = kline_unit  # 属于下一根父级别K线
+                if cur_lv_idx == top_lv_idx:
                     break
-
-            if parent_klu and kline_unit.time > parent_klu.time:
-                self.klu_cache[lv_idx] = kline_unit
-                break
-            kline_unit.set_pre_klu(pre_klu)
-            pre_klu = kline_unit
-            self.add_new_kl(cur_lv, kline_unit)
-            if parent_klu:
-                self.set_klu_parent_relation(parent_klu, kline_unit, cur_lv, lv_idx)
-            if lv_idx != len(self.lv_list)-1:
-                for _ in self.load_iterator(lv_idx+1, kline_unit, step):
-                    ...
-                self.check_kl_align(kline_unit, lv_idx)
-            if lv_idx == 0 and step:
+                cur_lv_idx -= 1  # 次级别加完，回到父级别
+                self.check_kl_align(parent, cur_lv_idx)
+                if cur_lv_idx == 0 and step:
+                    self.trim_history()
+                    yield self
+                continue
+            kline_unit.set_pre_klu(pre_klu_lst[cur_lv_idx])
+            pre_klu_lst[cur_lv_idx] = kline_unit
+            self.add_new_kl(self.lv_list[cur_lv_idx], kline_unit)
+            if parent is not None:
+                self.set_klu_parent_relation(parent, kline_unit, self.lv_list[cur_lv_idx], cur_lv_idx)
+            if cur_lv_idx != last_lv_idx:
+                cur_lv_idx += 1
+                parent_lst[cur_lv_idx] = kline_unit
+            elif cur_lv_idx == 0 and step:
+                self.trim_history()
                 yield self
 
     def check_kl_consitent(self, parent_klu, sub_klu):
-        if parent_klu.time.year != sub_klu.time.year or \
-           parent_klu.time.month != sub_klu.time.month or \
-           parent_klu.time.day != sub_klu.time.day:
+        if parent_klu.time.day_idx() != sub_klu.time.day_idx():
             self.kl_inconsistent_detail[str(parent_klu.time)].append(sub_klu.time)
             if self.conf.print_warning:
                 print(f"[WARNING-{self.code}]父级别时间是{parent_klu.time}，次级别时间却是{sub_klu.time}")
@@ -342,6 +446,14 @@ class CChan:
 
         return chan
 
+    def chan_dump_binary(self, file_path):
+        # 扁平二进制格式，不需要调整递归深度，也不需要断开/恢复pre/next链接，比pickle快且文件小
+        dump_chan(self, file_path)
+
+    @staticmethod
+    def chan_load_binary(file_path) -> 'CChan':
+        return load_chan(file_path)
+
     def chan_pickle_restore(self):
         for kl_list in self.kl_datas.values():
             last_klu = None
@@ -374,3 +486,32 @@ class CChan:
                 if last_segseg:
                     last_segseg.next = segseg
                 last_segseg = segseg
+
+
+def get_stock_api_cls(data_src: Union[DATA_SRC, str]):
+    _dict = {}
+    if data_src == DATA_SRC.BAO_STOCK:
+        from DataAPI.BaoStockAPI import CBaoStock
+        _dict[DATA_SRC.BAO_STOCK] = CBaoStock
+    elif data_src == DATA_SRC.CCXT:
+        from DataAPI.ccxt import CCXT
+        _dict[DATA_SRC.CCXT] = CCXT
+    elif data_src == DATA_SRC.CSV:
+        from DataAPI.csvAPI import CSV_API
+        _dict[DATA_SRC.CSV] = CSV_API
+    elif data_src == DATA_SRC.BULK:
+        from DataAPI.BulkAPI import CBulkAPI
+        _dict[DATA_SRC.BULK] = CBulkAPI
+    elif data_src == DATA_SRC.RESAMPLE:
+        from DataAPI.ResampleAPI import CResampleAPI
+        _dict[DATA_SRC.RESAMPLE] = CResampleAPI
+    if data_src in _dict:
+        return _dict[data_src]
+    assert isinstance(data_src, str)
+    if data_src.find("custom:") < 0:
+        raise CChanException("load src type error", ErrCode.SRC_DATA_TYPE_ERR)
+    package_info = data_src.split(":")[1]
+    package_name, cls_name = package_info.split(".")
+    import importlib
+    module = importlib.import_module(f"DataAPI.{package_name}")
+    return getattr(module, cls_name)
@@ -0,0 +1,185 @@
+import copy
+import datetime
+import hashlib
+import marshal
+import mmap
+import os
+import re
+import struct
+from enum import Enum
+from typing import Optional, Union
+
+from Chan import CChan
+from ChanConfig import CChanConfig
+from ChanSerializer import dumps_chan, get_state, loads_chan
+from Common.CEnum import AUTYPE, DATA_SRC, KL_TYPE
+from Common.ChanException import CChanException, ErrCode
+
+# 按股票持久化CChan计算结果，下次启动时打开缓存，只补算缓存之后新增的K线，启动耗时只和新K线数量有关
+# 缓存key：(code, 级别, 配置hash, begin_time, 复权方式, 数据源)，同一个key只保留最新的一份，最后一根K线时间记录在文件头
+# 文件格式：CACHE_MAGIC + uint32(header长度) + marshal(header) + ChanSerializer格式的payload，读取时mmap整个文件，
+# 只看文件头不需要解码payload
+
+CACHE_MAGIC = b"CHANCACH"
+CACHE_VERSION = 7  # 跟随ChanSerializer.VERSION，旧缓存直接视为不存在
+_HEADER_LEN = struct.Struct("<I")
+
+# 不影响计算结果的配置项，不参与配置hash
+_CONF_HASH_IGNORE = {'print_warning', 'print_err_time', 'skip_step'}
+
+
+def _canonical(obj):
+    if isinstance(obj, Enum):
+        return f"{type(obj).__name__}.{obj.name}"
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(x) for x in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted(repr(_canonical(x)) for x in obj)
+    if isinstance(obj, dict):
+        return sorted((repr(_canonical(k)), _canonical(v)) for k, v in obj.items())
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    return [type(obj).__name__, [(name, _canonical(value)) for name, value in sorted(get_state(obj))]]
+
+
+def config_hash(conf: CChanConfig) -> str:
+    state = [(name, _canonical(value)) for name, value in sorted(get_state(conf)) if name not in _CONF_HASH_IGNORE]
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+class CChanCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(code, lv_list, conf: CChanConfig, begin_time=None, autype: AUTYPE = AUTYPE.QFQ, data_src: Union[DATA_SRC, str] = DATA_SRC.BAO_STOCK) -> tuple:
+        if isinstance(begin_time, datetime.date):
+            begin_time = str(begin_time)
+        return (
+            str(code),
+            tuple(lv.name for lv in lv_list),
+            config_hash(conf),
+            None if begin_time is None else str(begin_time),
+            autype.name if isinstance(autype, AUTYPE) else str(autype),
+            data_src.name if isinstance(data_src, DATA_SRC) else str(data_src),
+        )
+
+    def get_path(self, key: tuple) -> str:
+        code, lv_names = key[0], key[1]
+        safe_code = re.sub(r'[^0-9A-Za-z.\-]', '_', code)
+        key_hash = hashlib.md5(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{safe_code}_{'_'.join(lv_names)}_{key_hash}.chancache")
+
+    def read_header(self, key: tuple, print_warning=True) -> Optional[dict]:
+        # 只读文件头，返回None表示没有可用缓存；header['last_time']为各级别最后一根K线的时间戳
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header, _ = self.__parse_header(mm)
+            return header if header is not None and header['key'] == key else None
+        except Exception as e:  # 文件损坏（截断、空文件等）视为没有缓存
+            self.__warn_broken(key, e, print_warning)
+            return None
+
+    def load(self, key: tuple, print_warning=True) -> Optional[CChan]:
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header, offset = self.__parse_header(mm)
+                if header is None or header['key'] != key:
+                    return None
+                with memoryview(mm) as buf, buf[offset:] as payload:
+                    return loads_chan(payload)
+        except Exception as e:  # 文件损坏（截断、空文件等）视为没有缓存，由调用方全量重算
+            self.__warn_broken(key, e, print_warning)
+            return None
+
+    def save(self, chan: CChan, key: Optional[tuple] = None):
+        # 只缓存已经走完的K线：通过update_last_klu传入的未完成K线不写入缓存
+        if key is None:
+            key = self.get_key(chan.code, chan.lv_list, chan.conf, chan.begin_time, chan.autype, chan.data_src)
+        last_klu_checkpoint = getattr(chan, 'last_klu_checkpoint', None)
+        if last_klu_checkpoint is None:
+            payload = dumps_chan(chan)
+        elif len(chan[0]) > 0 and chan[0][-1][-1].time.ts == last_klu_checkpoint[0]:
+            chan = copy.deepcopy(chan)
+            chan.rollback(chan.last_klu_checkpoint[1])
+            del chan.last_klu_checkpoint
+            payload = dumps_chan(chan)
+        else:
+            del chan.last_klu_checkpoint
+            try:
+                payload = dumps_chan(chan)
+            finally:
+                chan.last_klu_checkpoint = last_klu_checkpoint
+        header = {
+            'version': CACHE_VERSION,
+            'key': key,
+            'last_time': [kl_list[-1][-1].time.ts if len(kl_list) > 0 else None for kl_list in chan.kl_datas.values()],
+        }
+        header_bytes = marshal.dumps(header)
+        path = self.get_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(CACHE_MAGIC)
+            f.write(_HEADER_LEN.pack(len(header_bytes)))
+            f.write(header_bytes)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())  # 落盘之后再替换，断电时不会留下空文件
+        os.replace(tmp_path, path)  # 先写临时文件再替换，中途失败不会留下损坏的缓存
+
+    def get_chan(
+        self,
+        code,
+        begin_time=None,
+        end_time=None,
+        data_src: Union[DATA_SRC, str] = DATA_SRC.BAO_STOCK,
+        lv_list=None,
+        config: Optional[CChanConfig] = None,
+        autype: AUTYPE = AUTYPE.QFQ,
+    ) -> CChan:
+        # 参数同CChan；有缓存时从缓存恢复并只计算新K线，否则全量计算，结果写回缓存
+        if config is None:
+            config = CChanConfig()
+        if config.trigger_step:
+            raise CChanException("CChanCache不支持trigger_step模式", ErrCode.PARA_ERROR)
+        if lv_list is None:
+            lv_list = [KL_TYPE.K_DAY, KL_TYPE.K_60M]
+        key = self.get_key(code, lv_list, config, begin_time, autype, data_src)
+        chan = self.load(key, config.print_warning)
+        if chan is not None:
+            chan.conf.print_warning, chan.conf.print_err_time = config.print_warning, config.print_err_time
+            try:
+                chan.resume_load(end_time)
+            except CChanException as e:
+                if e.errcode != ErrCode.KL_DATA_INVALID:
+                    raise
+                if config.print_warning:
+                    print(f"[WARNING-{code}]{e.msg}，缓存失效，重新计算")
+                chan = None
+        if chan is None:
+            chan = CChan(code=code, begin_time=begin_time, end_time=end_time, data_src=data_src, lv_list=lv_list, config=config, autype=autype)
+        self.save(chan, key)
+        return chan
+
+    def __warn_broken(self, key: tuple, e: Exception, print_warning: bool):
+        if print_warning:
+            print(f"[WARNING-{key[0]}]缓存文件{self.get_path(key)}无法读取({e!r})，缓存失效，重新计算")
+
+    @staticmethod
+    def __parse_header(mm):
+        if mm[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            return None, 0
+        offset = len(CACHE_MAGIC)
+        header_len, = _HEADER_LEN.unpack_from(mm, offset)
+        offset += _HEADER_LEN.size
+        header = marshal.loads(mm[offset:offset+header_len])
+        if header.get('version') != CACHE_VERSION:
+            return None, 0
+        return header, offset + header_len
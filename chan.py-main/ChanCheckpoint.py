@@ -0,0 +1,259 @@
+import copy
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from ChanSerializer import get_state, set_state, slot_names
+from Common.CEnum import KL_TYPE
+from Common.ChanException import CChanException, ErrCode
+from Common.TrimmedList import first_index
+
+# checkpoint/rollback：只保存此后可能被修改的尾部对象的状态，确定的前缀部分与当前CChan共享
+# 回滚时原地恢复这些对象的属性（对象身份不变，前缀中指向它们的引用依然有效），并截断各个列表
+
+TAIL_MARGIN = 4  # 在确定性边界之外额外多保存的klc/笔个数，覆盖checkpoint之后多根K线的更新
+
+_CONTAINER_TYPES = (list, dict, set, tuple, deque)
+
+
+def copy_container(v):
+    # 只复制容器本身（递归），容器里面的业务对象保持引用
+    t = type(v)
+    if t is list:
+        return [copy_container(x) if type(x) in _CONTAINER_TYPES else x for x in v]
+    if t is dict:
+        return {k: copy_container(x) if type(x) in _CONTAINER_TYPES else x for k, x in v.items()}
+    if t is tuple:
+        return tuple(copy_container(x) if type(x) in _CONTAINER_TYPES else x for x in v)
+    if t is set:
+        return set(v)
+    if t is deque:
+        return deque((copy_container(x) if type(x) in _CONTAINER_TYPES else x for x in v), maxlen=v.maxlen)
+    return v
+
+
+def save_state(obj) -> Dict[str, Any]:
+    return {k: copy_container(v) for k, v in get_state(obj)}
+
+
+def restore_state(obj, state: Dict[str, Any]):
+    # 每次恢复都重新复制容器，保证同一个checkpoint可以多次回滚
+    # 保存之后才赋值的属性要删掉，和保存时完全一致
+    _dict = getattr(obj, '__dict__', None)
+    if _dict is not None:
+        _dict.clear()
+    for name in slot_names(type(obj)):
+        if name not in state and hasattr(obj, name):
+            object.__delattr__(obj, name)
+    set_state(obj, [(k, copy_container(v)) for k, v in state.items()])
+
+
+class CListTail:
+    # 列表从begin开始的尾部，以及尾部每个元素的状态
+    def __init__(self, lst: list, begin: int, save_item=True):
+        begin = max(begin, first_index(lst))  # 滚动窗口模式下不包括已经删除的部分
+        self.begin = begin
+        self.prefix_last = lst[begin-1] if begin > first_index(lst) else None
+        self.items = lst[begin:]
+        self.states = [save_state(item) for item in self.items] if save_item else None
+
+    def restore(self, lst: list):
+        if len(lst) < self.begin or (self.prefix_last is not None and lst[self.begin-1] is not self.prefix_last):
+            raise CChanException("checkpoint expired, confirmed part has been modified", ErrCode.COMMON_ERROR)
+        if self.states is not None:
+            for item, state in zip(self.items, self.states):
+                restore_state(item, state)
+        del lst[self.begin:]
+        lst.extend(self.items)
+
+
+def last_sure_idx(seg_lst) -> int:
+    idx = len(seg_lst) - 1
+    while idx >= 0 and not seg_lst[idx].is_sure:
+        idx -= 1
+    return idx
+
+
+def cal_watermark(line_lst, seg_lst, zs_lst) -> Tuple[int, int, int]:
+    """
+    返回(line_w, seg_w, zs_w)，分别是笔(或线段的线段时的线段)、线段、中枢列表中第一个后续可能被修改的位置
+    """
+    # 线段：cal_seg只会删除最后一个确定线段之后的（最多再加上最后一个确定线段）
+    seg_w = max(0, last_sure_idx(seg_lst) - 1)
+    # update_zs_in_seg会一直往前更新到ele_inside_is_sure的线段
+    seg_idx = len(seg_lst) - 1
+    while seg_idx >= 0 and not seg_lst[seg_idx].ele_inside_is_sure:
+        seg_idx -= 1
+    seg_w = min(seg_w, seg_idx + 1)
+
+    if seg_w < len(seg_lst):
+        line_w = seg_lst[seg_w].start_bi.idx
+        zs_begin_klu_idx = seg_lst[seg_w].start_bi.get_begin_klu().idx
+    else:
+        line_w = 0
+        zs_begin_klu_idx = -1
+    line_w = max(0, min(line_w, len(line_lst) - TAIL_MARGIN))
+
+    # 中枢：cal_bi_zs删除last_sure_pos之后的，之前的最后一两个可能被try_add_to_end/try_combine修改
+    zs_w = len(zs_lst)
+    while zs_w > 0 and (zs_lst[zs_w-1].begin_bi.idx >= min(zs_lst.last_sure_pos, line_w) or zs_lst[zs_w-1].end.idx >= zs_begin_klu_idx):
+        zs_w -= 1
+    zs_w = max(0, zs_w - 2)
+    return line_w, seg_w, zs_w
+
+
+class CBSPointListCheckpoint:
+    def __init__(self, bsp_list, line_w: int):
+        self.line_w = line_w
+        self.store_tail: Dict[Any, Tuple[CListTail, CListTail]] = {}
+        for bsp_type, (sell_lst, buy_lst) in bsp_list.bsp_store_dict.items():
+            self.store_tail[bsp_type] = (self.get_tail(sell_lst), self.get_tail(buy_lst))
+        self.bsp1_tail = self.get_tail(bsp_list.bsp1_list)
+        self.last_sure_pos = bsp_list.last_sure_pos
+        self.last_sure_seg_idx = bsp_list.last_sure_seg_idx
+
+    def get_tail(self, lst: list) -> CListTail:
+        begin = len(lst)
+        while begin > 0 and lst[begin-1].bi.idx >= self.line_w:
+            begin -= 1
+        tail = CListTail(lst, begin)
+        # 特征是bsp单独持有的对象
+        tail.feature_states = [save_state(bsp.features) for bsp in tail.items]  # type: ignore
+        return tail
+
+    @staticmethod
+    def restore_tail(tail: CListTail, lst: list, flat_dict: dict):
+        # 先把当前尾部从索引中删掉，恢复之后再加回来
+        for bsp in lst[tail.begin:]:
+            if flat_dict.get(bsp.bi.idx) is bsp:
+                del flat_dict[bsp.bi.idx]
+        tail.restore(lst)
+        for bsp, state in zip(tail.items, tail.feature_states):  # type: ignore
+            restore_state(bsp.features, state)
+            flat_dict[bsp.bi.idx] = bsp
+
+    def restore(self, bsp_list):
+        for bsp_type, (sell_lst, buy_lst) in bsp_list.bsp_store_dict.items():
+            if bsp_type not in self.store_tail:
+                for bsp in sell_lst + buy_lst:
+                    if bsp_list.bsp_store_flat_dict.get(bsp.bi.idx) is bsp:
+                        del bsp_list.bsp_store_flat_dict[bsp.bi.idx]
+        new_store_dict = {}
+        for bsp_type, (sell_tail, buy_tail) in self.store_tail.items():
+            sell_lst, buy_lst = bsp_list.bsp_store_dict.get(bsp_type, ([], []))
+            self.restore_tail(sell_tail, sell_lst, bsp_list.bsp_store_flat_dict)
+            self.restore_tail(buy_tail, buy_lst, bsp_list.bsp_store_flat_dict)
+            new_store_dict[bsp_type] = (sell_lst, buy_lst)
+        bsp_list.bsp_store_dict = new_store_dict
+        self.restore_tail(self.bsp1_tail, bsp_list.bsp1_list, bsp_list.bsp1_dict)
+        bsp_list.last_sure_pos = self.last_sure_pos
+        bsp_list.last_sure_seg_idx = self.last_sure_seg_idx
+
+
+class CZSListCheckpoint:
+    def __init__(self, zs_list, zs_w: int):
+        self.zs_tail = CListTail(zs_list.zs_lst, zs_w)
+        self.free_item_lst = list(zs_list.free_item_lst)
+        self.last_sure_pos = zs_list.last_sure_pos
+        self.last_seg_idx = zs_list.last_seg_idx
+
+    def restore(self, zs_list):
+        self.zs_tail.restore(zs_list.zs_lst)
+        zs_list.free_item_lst = list(self.free_item_lst)
+        zs_list.last_sure_pos = self.last_sure_pos
+        zs_list.last_seg_idx = self.last_seg_idx
+
+
+class CKLineListCheckpoint:
+    def __init__(self, kl_list):
+        self.trim_cnt = kl_list.trim_cnt
+        bi_w, seg_w, zs_w = cal_watermark(kl_list.bi_list, kl_list.seg_list, kl_list.zs_list)
+        seg_w2, segseg_w, segzs_w = cal_watermark(kl_list.seg_list, kl_list.segseg_list, kl_list.segzs_list)
+        seg_w = min(seg_w, seg_w2)
+
+        # 合并K线只有最后一根会被修改(try_add/update_fx/set_next)，笔线段中枢对klc只持有引用
+        self.klc_tail = CListTail(kl_list.lst, max(0, len(kl_list.lst) - TAIL_MARGIN))
+        klu_lst = [klu for klc in self.klc_tail.items for klu in klc.lst]
+        # 批量计算指标模式下，还没算指标的K线之后会被set_metric_item修改
+        tail_klu_ids = {id(klu) for klu in klu_lst}
+        klu_lst = [klu for klu in kl_list.metric_pending_klu if id(klu) not in tail_klu_ids] + klu_lst
+        self.klu_states = [(klu, save_state(klu)) for klu in klu_lst]
+        self.store_columns = None if kl_list.kl_store is None else (kl_list.kl_store.column_lengths(), kl_list.kl_store.begin_idx)
+        self.metric_index_len = len(kl_list.metric_index)
+        self.metric_model_lst = copy.deepcopy(kl_list.metric_model_lst)
+        self.metric_pending_klu = list(kl_list.metric_pending_klu)
+
+        self.bi_tail = CListTail(kl_list.bi_list.bi_list, bi_w)
+        self.bi_last_end = kl_list.bi_list.last_end
+        self.free_klc_lst = list(kl_list.bi_list.free_klc_lst)
+
+        self.seg_tail = CListTail(kl_list.seg_list.lst, seg_w)
+        self.segseg_tail = CListTail(kl_list.segseg_list.lst, segseg_w)
+        self.zs = CZSListCheckpoint(kl_list.zs_list, zs_w)
+        self.segzs = CZSListCheckpoint(kl_list.segzs_list, segzs_w)
+        self.bsp = CBSPointListCheckpoint(kl_list.bs_point_lst, bi_w)
+        self.seg_bsp = CBSPointListCheckpoint(kl_list.seg_bs_point_lst, seg_w)
+
+        self.last_sure_seg_start_bi_idx = kl_list.last_sure_seg_start_bi_idx
+        self.last_sure_segseg_start_bi_idx = kl_list.last_sure_segseg_start_bi_idx
+
+    def restore(self, kl_list):
+        self.klc_tail.restore(kl_list.lst)
+        for klu, state in self.klu_states:
+            restore_state(klu, state)
+        if self.store_columns is not None:
+            kl_list.kl_store.truncate(self.store_columns[0])
+            kl_list.kl_store.begin_idx = self.store_columns[1]
+        kl_list.metric_index.truncate(self.metric_index_len)
+        kl_list.metric_model_lst = copy.deepcopy(self.metric_model_lst)
+        kl_list.metric_pending_klu = list(self.metric_pending_klu)
+
+        self.bi_tail.restore(kl_list.bi_list.bi_list)
+        kl_list.bi_list.last_end = self.bi_last_end
+        kl_list.bi_list.free_klc_lst = list(self.free_klc_lst)
+
+        self.seg_tail.restore(kl_list.seg_list.lst)
+        self.segseg_tail.restore(kl_list.segseg_list.lst)
+        self.zs.restore(kl_list.zs_list)
+        self.segzs.restore(kl_list.segzs_list)
+        self.bsp.restore(kl_list.bs_point_lst)
+        self.seg_bsp.restore(kl_list.seg_bs_point_lst)
+
+        kl_list.last_sure_seg_start_bi_idx = self.last_sure_seg_start_bi_idx
+        kl_list.last_sure_segseg_start_bi_idx = self.last_sure_segseg_start_bi_idx
+        # 回滚之后不再复用之前的线段，下一次全部按有变化重算
+        kl_list.bi_list.change_begin_idx = 0
+        kl_list.seg_list.change_begin_idx = 0
+        kl_list.segseg_list.change_begin_idx = 0
+
+    def tail_size(self) -> int:
+        return len(self.klu_states)
+
+
+class CChanCheckpoint:
+    def __init__(self, chan):
+        self.kl_datas: Dict[KL_TYPE, CKLineListCheckpoint] = {kl_type: CKLineListCheckpoint(kl_list) for kl_type, kl_list in chan.kl_datas.items()}
+        self.klu_cache: Optional[list] = copy.copy(getattr(chan, 'klu_cache', None))
+        self.klu_last_t: Optional[list] = copy.copy(getattr(chan, 'klu_last_t', None))
+        self.kl_misalign_cnt = chan.kl_misalign_cnt
+        self.kl_inconsistent_detail = copy.deepcopy(chan.kl_inconsistent_detail)
+        self.g_kl_iter = {lv: list(iters) for lv, iters in chan.g_kl_iter.items()}
+
+    def restore(self, chan):
+        if set(self.kl_datas) != set(chan.kl_datas):
+            raise CChanException("checkpoint does not match current levels", ErrCode.COMMON_ERROR)
+        if any(chan.kl_datas[kl_type].trim_cnt != kl_checkpoint.trim_cnt for kl_type, kl_checkpoint in self.kl_datas.items()):
+            raise CChanException("checkpoint expired, history has been trimmed", ErrCode.COMMON_ERROR)
+        for kl_type, kl_checkpoint in self.kl_datas.items():
+            kl_checkpoint.restore(chan.kl_datas[kl_type])
+        for attr in ['klu_cache', 'klu_last_t']:
+            value: Optional[List] = getattr(self, attr)
+            if value is None:
+                if hasattr(chan, attr):
+                    delattr(chan, attr)
+            else:
+                setattr(chan, attr, list(value))
+        chan.kl_misalign_cnt = self.kl_misalign_cnt
+        chan.kl_inconsistent_detail = copy.deepcopy(self.kl_inconsistent_detail)
+        chan.g_kl_iter.clear()
+        for lv, iters in self.g_kl_iter.items():
+            chan.g_kl_iter[lv] = list(iters)
@@ -0,0 +1,240 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Union
+
+from Chan import CChan, get_stock_api_cls
+from ChanConfig import CChanConfig
+from ChanPool import CBSPointSummary, CLineSummary
+from Common.CEnum import AUTYPE, DATA_FIELD, DATA_SRC, KL_TYPE, TRADE_INFO_LST
+from Common.ChanException import CChanException, ErrCode
+from DataAPI.BulkAPI import CBulkAPI
+from KLine.KLine_Unit import CKLine_Unit
+
+# 单只股票长历史的分块并行计算：K线按时间切成若干块，每块往前多带warmup_klu_cnt根K线作为预热，各自在一个进程里计算
+# 相邻两块在重叠部分（后一块的预热部分）拼接，在重叠部分的中间切换：之前的结果用前一块的，之后的用后一块的
+# - 对齐：后一块中第一个和前一块相同、并且之后到切换点为止都和前一块一一相同的确定的笔（线段/中枢/买卖点同理）
+# - 校验：对齐之后到切换点之间两块的结果必须完全相同，任何一种结果对不上（预热不够等）都退回整体串行计算
+# 只支持单级别、非逐步模式，返回的是摘要（同ChanPool），不是CChan
+
+
+class CZSSummary:
+    def __init__(self, zs):
+        self.begin_time = zs.begin.time
+        self.end_time = zs.end.time
+        self.low: float = zs.low
+        self.high: float = zs.high
+        self.is_sure: bool = zs.is_sure
+
+    def __str__(self):
+        return f"{self.begin_time}~{self.end_time} [{self.low}, {self.high}] sure={self.is_sure}"
+
+
+def line_sig(line: CLineSummary):
+    return line.begin_time.ts, line.end_time.ts, line.dir, line.is_sure, line.begin_val, line.end_val
+
+
+def zs_sig(zs: CZSSummary):
+    return zs.begin_time.ts, zs.end_time.ts, zs.low, zs.high, zs.is_sure
+
+
+def bsp_sig(bsp: CBSPointSummary):
+    return bsp.time.ts, bsp.is_buy, tuple(bsp.type), bsp.is_sure
+
+
+def line_begin_ts(line: CLineSummary):
+    return line.begin_time.ts
+
+
+def bsp_begin_ts(bsp: CBSPointSummary):
+    return bsp.time.ts
+
+
+RESULT_ITEMS = {
+    # 结果名: (签名, 开始时间)
+    'bi_lst': (line_sig, line_begin_ts),
+    'seg_lst': (line_sig, line_begin_ts),
+    'zs_lst': (zs_sig, lambda zs: zs.begin_time.ts),
+    'bsp_lst': (bsp_sig, bsp_begin_ts),
+    'seg_bsp_lst': (bsp_sig, bsp_begin_ts),
+}
+
+
+class CChunkResult:
+    def __init__(self, code, kl_type: KL_TYPE):
+        self.code = code
+        self.kl_type = kl_type
+        self.klu_cnt = 0
+        self.bi_lst: List[CLineSummary] = []
+        self.seg_lst: List[CLineSummary] = []
+        self.zs_lst: List[CZSSummary] = []
+        self.bsp_lst: List[CBSPointSummary] = []  # 按时间排序
+        self.seg_bsp_lst: List[CBSPointSummary] = []
+        self.chunk_cnt = 1  # 实际并行计算的块数，1表示串行计算
+        self.fallback_reason: Optional[str] = None  # 分块结果对不上退回串行计算的原因
+
+    def is_stitched(self):
+        return self.chunk_cnt > 1 and self.fallback_reason is None
+
+    def renumber(self):
+        # 拼接之后笔/线段的idx从0开始重新编号
+        for lst in [self.bi_lst, self.seg_lst]:
+            for idx, line in enumerate(lst):
+                line.idx = idx
+
+
+def get_chunk_result(chan: CChan, klu_offset: int) -> CChunkResult:
+    kl_list = chan[0]
+    res = CChunkResult(chan.code, kl_list.kl_type)
+    res.klu_cnt = sum(len(klc.lst) for klc in kl_list.lst)
+    res.bi_lst = [CLineSummary(bi) for bi in kl_list.bi_list]
+    res.seg_lst = [CLineSummary(seg) for seg in kl_list.seg_list]
+    res.zs_lst = [CZSSummary(zs) for zs in kl_list.zs_list]
+    res.bsp_lst = [CBSPointSummary(bsp) for bsp in kl_list.bs_point_lst.getSortedBspList()]
+    res.seg_bsp_lst = [CBSPointSummary(bsp) for bsp in kl_list.seg_bs_point_lst.getSortedBspList()]
+    for bsp in res.bsp_lst + res.seg_bsp_lst:
+        bsp.klu_idx += klu_offset
+    return res
+
+
+def klu_to_column(klu_lst: List[CKLine_Unit]) -> Dict[str, list]:
+    # 交给DATA_SRC.BULK的列式数据，子进程里重新生成K线
+    res: Dict[str, list] = {DATA_FIELD.FIELD_TIME: [klu.time for klu in klu_lst]}
+    for field, attr in [(DATA_FIELD.FIELD_OPEN, 'open'), (DATA_FIELD.FIELD_HIGH, 'high'), (DATA_FIELD.FIELD_LOW, 'low'), (DATA_FIELD.FIELD_CLOSE, 'close')]:
+        res[field] = [getattr(klu, attr) for klu in klu_lst]
+    for metric in TRADE_INFO_LST:
+        value_lst = [klu.trade_info.metric.get(metric) for klu in klu_lst]
+        if any(value is not None for value in value_lst):
+            res[metric] = [float("nan") if value is None else value for value in value_lst]
+    return res
+
+
+def cal_chunk(code, kl_type: KL_TYPE, column: Dict[str, list], klu_offset: int, config: CChanConfig) -> CChunkResult:
+    # 串行计算时在调用方进程里执行，用单独的代码注册数据，不能覆盖/清掉调用方自己通过CBulkAPI.set_data注册的数据
+    bulk_code = f"__chunk_{os.getpid()}_{code}"
+    CBulkAPI.set_data(bulk_code, kl_type, column)
+    try:
+        chan = CChan(code=bulk_code, data_src=DATA_SRC.BULK, lv_list=[kl_type], config=config)
+    finally:
+        CBulkAPI.clear_data(bulk_code)
+    res = get_chunk_result(chan, klu_offset)
+    res.code = code
+    return res
+
+
+def _cal_chunk(args) -> CChunkResult:
+    return cal_chunk(*args)
+
+
+def find_sync(pre_lst: list, cur_lst: list, cut_ts, sig: Callable, begin_ts: Callable) -> Optional[float]:
+    # 后一块中第一个和前一块相同的确定结果，并且从这里到cut_ts之前两块的结果一一相同，返回它的开始时间
+    pos_dict = {sig(item): idx for idx, item in enumerate(pre_lst) if item.is_sure and begin_ts(item) < cut_ts}
+    for cur_idx, item in enumerate(cur_lst):
+        if begin_ts(item) >= cut_ts:
+            break
+        pre_idx = pos_dict.get(sig(item)) if item.is_sure else None
+        if pre_idx is not None and is_same(pre_lst[pre_idx:], cur_lst[cur_idx:], cut_ts, sig, begin_ts):
+            return begin_ts(item)
+    return None
+
+
+def is_same(pre_lst: list, cur_lst: list, cut_ts, sig: Callable, begin_ts: Callable) -> bool:
+    pre_sig = [sig(item) for item in pre_lst if begin_ts(item) < cut_ts]
+    cur_sig = [sig(item) for item in cur_lst if begin_ts(item) < cut_ts]
+    return pre_sig == cur_sig
+
+
+def stitch(pre_lst: list, cur_lst: list, sync_ts, cut_ts, sig: Callable, begin_ts: Callable) -> Optional[list]:
+    # pre_lst: 已经拼好的结果，cur_lst: 下一块（含预热部分）的结果
+    # 开始时间在[sync_ts, cut_ts)之间的结果两块必须完全相同，之前的用前一块的，之后的用后一块的；对不上时返回None
+    pre_overlap = [item for item in pre_lst if begin_ts(item) >= sync_ts]
+    cur_overlap = [item for item in cur_lst if begin_ts(item) >= sync_ts]
+    if not is_same(pre_overlap, cur_overlap, cut_ts, sig, begin_ts):
+        return None
+    return [item for item in pre_lst if begin_ts(item) < cut_ts] + [item for item in cur_lst if begin_ts(item) >= cut_ts]
+
+
+class CChanChunk:
+    def __init__(
+        self,
+        code,
+        kl_type: KL_TYPE,
+        config: Optional[CChanConfig] = None,
+        data_src: Union[DATA_SRC, str] = DATA_SRC.BAO_STOCK,
+        begin_time=None,
+        end_time=None,
+        autype: AUTYPE = AUTYPE.QFQ,
+        max_workers: Optional[int] = None,
+        chunk_cnt: Optional[int] = None,
+        warmup_klu_cnt: int = 10000,
+    ):
+        if config is None:
+            config = CChanConfig()
+        if config.trigger_step:
+            raise CChanException("CChanChunk does not support trigger_step", ErrCode.PARA_ERROR)
+        self.code = code
+        self.kl_type = kl_type
+        self.config = config
+        self.data_src = data_src
+        self.begin_time = begin_time
+        self.end_time = end_time
+        self.autype = autype
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_cnt = chunk_cnt or self.max_workers
+        self.warmup_klu_cnt = warmup_klu_cnt  # 每块往前多算的K线数，线段买卖点依赖线段的线段，需要覆盖足够多的线段
+
+    def load_klu(self) -> List[CKLine_Unit]:
+        stockapi_cls = get_stock_api_cls(self.data_src)
+        session_holder = getattr(stockapi_cls, 'session_holder', False)
+        if not session_holder:
+            stockapi_cls.do_init()
+        try:
+            stockapi = stockapi_cls(code=self.code, k_type=self.kl_type, begin_date=self.begin_time, end_date=self.end_time, autype=self.autype)
+            return list(stockapi.get_kl_data())
+        finally:
+            if not session_holder:
+                stockapi_cls.do_close()
+
+    def split(self, klu_cnt: int) -> List[int]:
+        # 每块的开始位置，每块至少要比预热部分长，否则还不如串行
+        chunk_cnt = min(self.chunk_cnt, klu_cnt // max(1, 2 * self.warmup_klu_cnt))
+        if chunk_cnt <= 1:
+            return [0]
+        return [klu_cnt * i // chunk_cnt for i in range(chunk_cnt)]
+
+    def run(self) -> CChunkResult:
+        klu_lst = self.load_klu()
+        begin_lst = self.split(len(klu_lst))
+        if len(begin_lst) == 1:
+            return self.cal_sequential(klu_lst)
+
+        end_lst = begin_lst[1:] + [len(klu_lst)]
+        warmup_begin_lst = [max(0, begin - self.warmup_klu_cnt) for begin in begin_lst]
+        task_lst = [(self.code, self.kl_type, klu_to_column(klu_lst[warmup_begin:end]), warmup_begin, self.config) for warmup_begin, end in zip(warmup_begin_lst, end_lst)]
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(task_lst))) as executor:
+            chunk_res_lst = list(executor.map(_cal_chunk, task_lst))
+
+        res = chunk_res_lst[0]
+        for begin, warmup_begin, chunk_res in zip(begin_lst[1:], warmup_begin_lst[1:], chunk_res_lst[1:]):
+            cut_ts = klu_lst[(warmup_begin + begin) // 2].time.ts  # 在重叠部分的中间切换，两边都离各自的边界足够远
+            bi_sync_ts = find_sync(res.bi_lst, chunk_res.bi_lst, cut_ts, line_sig, line_begin_ts)
+            for name, (sig, begin_ts) in RESULT_ITEMS.items():
+                stitched = None
+                if bi_sync_ts is not None:
+                    sync_ts = find_sync(getattr(res, name), getattr(chunk_res, name), cut_ts, sig, begin_ts)
+                    # 重叠部分可能没有这种结果（比如线段买卖点），这时从笔对齐的位置开始比较
+                    stitched = stitch(getattr(res, name), getattr(chunk_res, name), bi_sync_ts if sync_ts is None else sync_ts, cut_ts, sig, begin_ts)
+                if stitched is None:
+                    seq_res = self.cal_sequential(klu_lst)
+                    seq_res.chunk_cnt = len(begin_lst)
+                    seq_res.fallback_reason = f"{name} mismatch in overlap before {klu_lst[begin].time}"
+                    return seq_res
+                setattr(res, name, stitched)
+        res.klu_cnt = len(klu_lst)
+        res.chunk_cnt = len(begin_lst)
+        res.renumber()
+        return res
+
+    def cal_sequential(self, klu_lst: List[CKLine_Unit]) -> CChunkResult:
+        res = cal_chunk(self.code, self.kl_type, klu_to_column(klu_lst), 0, self.config)
+        res.renumber()
+        return res
@@ -14,6 +14,23 @@ from Math.TrendModel import CTrendModel
 from Seg.SegConfig import CSegConfig
 from ZS.ZSConfig import CZSConfig
 
+BSP_PARA_DEFAULT = {  # 买卖点参数及默认值，也可以加-buy/-sell/-segbuy/-segsell/-seg后缀单独设置
+    "divergence_rate": float("inf"),
+    "min_zs_cnt": 1,
+    "bsp1_only_multibi_zs": True,
+    "max_bs2_rate": 0.9999,
+    "macd_algo": "peak",
+    "bs1_peak": True,
+    "bs_type": "1,1p,2,2s,3a,3b",
+    "bsp2_follow_1": True,
+    "bsp3_follow_1": True,
+    "bsp3_peak": False,
+    "bsp2s_follow_2": False,
+    "max_bsp2s_lv": None,
+    "strict_bsp3": False,
+    "bsp3a_max_zs_cnt": 1,
+}
+
 
 class CChanConfig:
     def __init__(self, conf=None):
@@ -48,6 +65,11 @@ class CChanConfig:
         self.auto_skip_illegal_sub_lv = conf.get("auto_skip_illegal_sub_lv", False)
         self.print_warning = conf.get("print_warning", True)
         self.print_err_time = conf.get("print_err_time", True)
+        self.kl_columnar = conf.get("kl_columnar", False)
+        self.batch_metric = conf.get("batch_metric", False)
+        self.keep_seg_cnt = conf.get("keep_seg_cnt", 0)
+        if self.keep_seg_cnt and (self.keep_seg_cnt < 4 or self.seg_conf.seg_algo != "chan"):
+            raise CChanException(f"keep_seg_cnt={self.keep_seg_cnt} requires >= 4 and seg_algo=chan", ErrCode.PARA_ERROR)
 
         self.mean_metrics: List[int] = conf.get("mean_metrics", [])
         self.trend_metrics: List[int] = conf.get("trend_metrics", [])
@@ -67,6 +89,7 @@ class CChanConfig:
             'countdown_cmp2close': True,
         })
         self.boll_n = conf.get("boll_n", 20)
+        self.metric_history_len = conf.get("metric_history_len", 1)
 
         self.set_bsp_config(conf)
 
@@ -78,6 +101,7 @@ class CChanConfig:
                 fastperiod=self.macd_config['fast'],
                 slowperiod=self.macd_config['slow'],
                 signalperiod=self.macd_config['signal'],
+                history_len=self.metric_history_len,
             )
         ]
         res.extend(CTrendModel(TREND_TYPE.MEAN, mean_T) for mean_T in self.mean_metrics)
@@ -97,29 +121,13 @@ class CChanConfig:
                 countdown_cmp2close=self.demark_config['countdown_cmp2close'],
             ))
         if self.cal_rsi:
-            res.append(RSI(self.rsi_cycle))
+            res.append(RSI(self.rsi_cycle, history_len=self.metric_history_len))
         if self.cal_kdj:
             res.append(KDJ(self.kdj_cycle))
         return res
 
     def set_bsp_config(self, conf):
-        para_dict = {
-            "divergence_rate": float("inf"),
-            "min_zs_cnt": 1,
-            "bsp1_only_multibi_zs": True,
-            "max_bs2_rate": 0.9999,
-            "macd_algo": "peak",
-            "bs1_peak": True,
-            "bs_type": "1,1p,2,2s,3a,3b",
-            "bsp2_follow_1": True,
-            "bsp3_follow_1": True,
-            "bsp3_peak": False,
-            "bsp2s_follow_2": False,
-            "max_bsp2s_lv": None,
-            "strict_bsp3": False,
-            "bsp3a_max_zs_cnt": 1,
-        }
-        args = {para: conf.get(para, default_value) for para, default_value in para_dict.items()}
+        args = {para: conf.get(para, default_value) for para, default_value in BSP_PARA_DEFAULT.items()}
         self.bs_point_conf = CBSPointConfig(**args)
 
         self.seg_bs_point_conf = CBSPointConfig(**args)
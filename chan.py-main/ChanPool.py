@@ -0,0 +1,139 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util
+from typing import Dict, List, Optional, Union
+
+from Chan import CChan, get_stock_api_cls
+from ChanConfig import CChanConfig
+from Common.CEnum import AUTYPE, DATA_SRC, KL_TYPE
+from Common.ChanException import CChanException, ErrCode
+
+# 多股票并行计算：每个进程各自拉数据、计算CChan，只把精简后的结果传回主进程，不pickle整个CChan
+
+
+class CLineSummary:
+    # 笔或者线段的摘要
+    def __init__(self, line):
+        self.idx: int = line.idx
+        self.dir = line.dir
+        self.is_sure: bool = line.is_sure
+        self.begin_time = line.get_begin_klu().time
+        self.end_time = line.get_end_klu().time
+        self.begin_val: float = line.get_begin_val()
+        self.end_val: float = line.get_end_val()
+
+    def __str__(self):
+        return f"{self.idx}:{self.begin_time}({self.begin_val})~{self.end_time}({self.end_val}) {self.dir} sure={self.is_sure}"
+
+
+class CBSPointSummary:
+    def __init__(self, bsp):
+        self.time = bsp.klu.time
+        self.klu_idx: int = bsp.klu.idx
+        self.price: float = bsp.klu.close
+        self.is_buy: bool = bsp.is_buy
+        self.type = list(bsp.type)
+        self.is_sure: bool = bsp.bi.is_sure
+
+    def type2str(self):
+        return ",".join([x.value for x in self.type])
+
+    def __str__(self):
+        return f"{self.time} {'buy' if self.is_buy else 'sell'} {self.type2str()} price={self.price}"
+
+
+class CLevelSummary:
+    # 单个级别的计算结果
+    def __init__(self, kl_list, bsp_number: int):
+        self.kl_type: KL_TYPE = kl_list.kl_type
+        self.klu_cnt = sum(len(klc.lst) for klc in kl_list.lst)
+        self.last_klu_time = kl_list[-1][-1].time if len(kl_list) > 0 else None
+        self.last_bi: Optional[CLineSummary] = CLineSummary(kl_list.bi_list[-1]) if len(kl_list.bi_list) > 0 else None
+        self.last_seg: Optional[CLineSummary] = CLineSummary(kl_list.seg_list[-1]) if len(kl_list.seg_list) > 0 else None
+        self.bsp_lst: List[CBSPointSummary] = [CBSPointSummary(bsp) for bsp in kl_list.bs_point_lst.get_latest_bsp(bsp_number)]
+        self.seg_bsp_lst: List[CBSPointSummary] = [CBSPointSummary(bsp) for bsp in kl_list.seg_bs_point_lst.get_latest_bsp(bsp_number)]
+
+
+class CChanSummary:
+    def __init__(self, code):
+        self.code = code
+        self.lv_data: Dict[KL_TYPE, CLevelSummary] = {}
+        self.errcode: Optional[ErrCode] = None
+        self.err_msg: Optional[str] = None
+
+    def is_ok(self):
+        return self.errcode is None
+
+    def __getitem__(self, kl_type: KL_TYPE) -> CLevelSummary:
+        return self.lv_data[kl_type]
+
+
+def _init_worker(data_src: Union[DATA_SRC, str]):
+    # 每个worker进程只初始化一次数据源，进程退出时关闭
+    stockapi_cls = get_stock_api_cls(data_src)
+    stockapi_cls.do_init()
+    stockapi_cls.session_holder = True
+    util.Finalize(None, stockapi_cls.do_close, exitpriority=10)
+
+
+def cal_chan_summary(code, begin_time, end_time, data_src, lv_list, config: CChanConfig, autype: AUTYPE, bsp_number: int) -> CChanSummary:
+    res = CChanSummary(code)
+    try:
+        chan = CChan(
+            code=code,
+            begin_time=begin_time,
+            end_time=end_time,
+            data_src=data_src,
+            lv_list=lv_list,
+            config=config,
+            autype=autype,
+        )
+        if config.trigger_step:
+            for _ in chan.step_load():
+                ...
+        for kl_type, kl_list in chan.kl_datas.items():
+            res.lv_data[kl_type] = CLevelSummary(kl_list, bsp_number)
+    except CChanException as e:
+        res.errcode = e.errcode
+        res.err_msg = e.msg
+    except Exception as e:  # 数据源返回脏数据等其他异常，同样只记在这只股票上，不能让executor.map中断整个run
+        res.errcode = ErrCode.COMMON_ERROR
+        res.err_msg = repr(e)
+    return res
+
+
+def _cal_chan_summary(args) -> CChanSummary:
+    return cal_chan_summary(*args)
+
+
+class CChanPool:
+    def __init__(
+        self,
+        config: CChanConfig,
+        data_src: Union[DATA_SRC, str] = DATA_SRC.BAO_STOCK,
+        lv_list=None,
+        begin_time=None,
+        end_time=None,
+        autype: AUTYPE = AUTYPE.QFQ,
+        max_workers: Optional[int] = None,
+        chunksize: Optional[int] = None,
+        bsp_number: int = 1,
+    ):
+        self.config = config
+        self.data_src = data_src
+        self.lv_list = lv_list if lv_list is not None else [KL_TYPE.K_DAY, KL_TYPE.K_60M]
+        self.begin_time = begin_time
+        self.end_time = end_time
+        self.autype = autype
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = chunksize  # None表示按股票数量和进程数自动分块
+        self.bsp_number = bsp_number  # 每个级别返回最近多少个买卖点，0表示全部
+
+    def run(self, code_list: List[str]) -> Dict[str, CChanSummary]:
+        # 返回 {code: CChanSummary}，计算失败的股票errcode/err_msg非空，不影响其他股票
+        if len(code_list) == 0:
+            return {}
+        chunksize = self.chunksize or max(1, len(code_list) // (self.max_workers * 4))
+        task_lst = [(code, self.begin_time, self.end_time, self.data_src, self.lv_list, self.config, self.autype, self.bsp_number) for code in code_list]
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker, initargs=(self.data_src,)) as executor:
+            return {res.code: res for res in executor.map(_cal_chan_summary, task_lst, chunksize=chunksize)}
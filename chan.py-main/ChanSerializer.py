@@ -0,0 +1,546 @@
+import importlib
+import marshal
+import operator
+import types
+from array import array
+from collections import defaultdict, deque
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+from Common.ChanException import CChanException, ErrCode
+from Common.TrimmedList import CTrimmedList, first_index
+from KLine.KLine import CKLine
+from KLine.KLine_Unit import CKLine_Unit
+
+# CChan的二进制序列化：不走pickle的递归，所有对象拍平成一张表，对象之间的引用用表中的下标表示
+# K线(klu)按列存储（同一个属性在所有K线上的取值连续存放），合并K线(klc)只存每根包含的K线个数/方向/分型，加载时按下标重建
+# 文件格式：MAGIC + marshal(payload)，payload里面只有基本类型
+# 类/枚举按module:qualname保存，加载时只接受SAFE_GLOBALS中的名字（本项目里CChan会持有的类），其他名字直接报错，
+# 不会导入或调用文件里指定的任意对象；用户自己扩展的类（自定义买卖点、指标等）需要先用register_safe_global登记
+
+MAGIC = b"CHANBIN\x00"
+VERSION = 7
+
+# 编码后的值：None/bool/int/float/str/bytes原样保存，其他都是(TAG, ...)
+T_TUPLE = 0
+T_LIST = 1
+T_DICT = 2
+T_SET = 3
+T_DEQUE = 4
+T_DEFAULTDICT = 5
+T_ENUM = 6
+T_REF = 7  # 对象表中的对象
+T_GLOBAL = 8  # 类、函数等，按module:qualname保存
+T_ARRAY = 9
+T_KLU = 10  # 某个级别第row根K线
+T_KLC = 11  # 某个级别第idx根合并K线
+T_CREF = 12  # 已经出现过的容器（保持多个对象共享同一个list/dict的关系）
+T_KLC_LIST = 13  # CKLine_List.lst
+T_TRIMMED_LIST = 14  # 滚动窗口模式下删除过头部的list（CTrimmedList），额外保存删除的个数
+
+_PRIMITIVE_TYPES = (type(None), bool, int, float, str, bytes)
+
+# klu中由重建过程恢复的属性，不按列保存
+_KLU_DERIVED_ATTR = {'_CKLine_Unit__klc'}
+
+# typing在实例化泛型类（如CBSPointList[CBi, CBiList]()）时记下的泛型参数，不属于对象状态
+_SKIP_ATTR = {'__orig_class__'}
+
+_ENUM_NAMES = [
+    'DATA_SRC', 'KL_TYPE', 'KLINE_DIR', 'FX_TYPE', 'BI_DIR', 'BI_TYPE', 'BSP_TYPE', 'AUTYPE', 'TREND_TYPE',
+    'TREND_LINE_SIDE', 'LEFT_SEG_METHOD', 'FX_CHECK_METHOD', 'SEG_TYPE', 'CAL_STAGE', 'MACD_ALGO',
+]
+
+SAFE_GLOBALS = {
+    *[f"Common.CEnum:{name}" for name in _ENUM_NAMES],
+    "builtins:list", "builtins:dict", "builtins:set", "builtins:int", "builtins:float",  # defaultdict的default_factory
+    "Chan:CChan",
+    "ChanConfig:CChanConfig",
+    "ChanModel.Features:CFeatures",
+    "Common.CTime:CTime",
+    "Bi.Bi:CBi",
+    "Bi.BiConfig:CBiConfig",
+    "Bi.BiList:CBiList",
+    "BuySellPoint.BSPointConfig:CBSPointConfig",
+    "BuySellPoint.BSPointConfig:CPointConfig",
+    "BuySellPoint.BSPointList:CBSPointList",
+    "BuySellPoint.BS_Point:CBS_Point",
+    "KLine.KLine:CKLine",
+    "KLine.KLine_Unit:CKLine_Unit",
+    "KLine.KLine_List:CKLine_List",
+    "KLine.KLine_MetricIndex:CKLine_MetricIndex",
+    "KLine.KLine_MetricIndex:CRangeExtremum",
+    "KLine.KLine_Store:CKLine_Store",
+    "KLine.TradeInfo:CTradeInfo",
+    "Math.BOLL:BOLL_Metric",
+    "Math.BOLL:BollModel",
+    "Math.Demark:C_KL",
+    "Math.Demark:CDemarkCountdown",
+    "Math.Demark:CDemarkEngine",
+    "Math.Demark:CDemarkIndex",
+    "Math.Demark:CDemarkSetup",
+    "Math.KDJ:KDJ",
+    "Math.KDJ:KDJ_Item",
+    "Math.MACD:CMACD",
+    "Math.MACD:CMACD_item",
+    "Math.RSI:RSI",
+    "Math.TrendLine:CTrendLine",
+    "Math.TrendLine:Line",
+    "Math.TrendLine:Point",
+    "Math.TrendModel:CTrendModel",
+    "Seg.Eigen:CEigen",
+    "Seg.EigenFX:CEigenFX",
+    "Seg.Seg:CSeg",
+    "Seg.SegConfig:CSegConfig",
+    "Seg.SegListComm:CSegListComm",
+    "Seg.SegListChan:CSegListChan",
+    "Seg.SegListDef:CSegListDef",
+    "Seg.SegListDYH:CSegListDYH",
+    "ZS.ZS:CZS",
+    "ZS.ZSConfig:CZSConfig",
+    "ZS.ZSList:CZSList",
+}
+
+
+_slot_names_cache: Dict[type, Tuple[str, ...]] = {}
+
+
+def slot_names(cls) -> Tuple[str, ...]:
+    if cls not in _slot_names_cache:
+        res = []
+        for _cls in cls.__mro__:
+            for name in getattr(_cls, '__slots__', ()):
+                if name in ('__dict__', '__weakref__'):
+                    continue
+                if name.startswith('__') and not name.endswith('__'):
+                    name = f"_{_cls.__name__.lstrip('_')}{name}"
+                res.append(name)
+        _slot_names_cache[cls] = tuple(res)
+    return _slot_names_cache[cls]
+
+
+def get_state(obj) -> List[Tuple[str, Any]]:
+    # 同时兼容__dict__和__slots__
+    res = [(name, value) for name, value in obj.__dict__.items() if name not in _SKIP_ATTR] if hasattr(obj, '__dict__') else []
+    for name in slot_names(type(obj)):
+        if hasattr(obj, name):
+            res.append((name, getattr(obj, name)))
+    return res
+
+
+def set_state(obj, state: List[Tuple[str, Any]]):
+    _dict = getattr(obj, '__dict__', None)
+    slots = slot_names(type(obj))
+    for name, value in state:
+        if _dict is not None and name not in slots:
+            _dict[name] = value
+        else:
+            object.__setattr__(obj, name, value)
+
+
+def global_name(obj) -> str:
+    return f"{obj.__module__}:{obj.__qualname__}"
+
+
+def register_safe_global(cls):
+    # 登记用户自己扩展的类，之后可以序列化和加载
+    SAFE_GLOBALS.add(global_name(cls))
+    return cls
+
+
+def resolve_global(name: str):
+    if name not in SAFE_GLOBALS:
+        raise CChanException(f"class not allowed in chan binary: {name}", ErrCode.SRC_DATA_FORMAT_ERROR)
+    module_name, qualname = name.split(":")
+    res = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        res = getattr(res, attr)
+    if not isinstance(res, type):
+        raise CChanException(f"not a class in chan binary: {name}", ErrCode.SRC_DATA_FORMAT_ERROR)
+    return res
+
+
+K_OBJ = 0
+K_CONTAINER = 1
+K_TUPLE = 2
+K_ENUM = 3
+K_GLOBAL = 4
+K_ARRAY = 5
+K_NUMPY = 6
+K_UNKNOWN = 7
+
+
+def get_type_kind(t: type) -> int:
+    if t in (list, dict, defaultdict, set, deque, CTrimmedList):
+        return K_CONTAINER
+    if t is tuple:
+        return K_TUPLE
+    if t is array:
+        return K_ARRAY
+    if issubclass(t, Enum):
+        return K_ENUM
+    if issubclass(t, type) or t in (types.FunctionType, types.BuiltinFunctionType):
+        return K_GLOBAL
+    if t.__module__ == 'numpy':  # numpy标量
+        return K_NUMPY
+    if '__dict__' in dir(t) or slot_names(t):
+        return K_OBJ
+    return K_UNKNOWN
+
+
+class CChanEncoder:
+    def __init__(self, chan):
+        self.chan = chan
+        self.global_idx: Dict[str, int] = {}
+        self.obj_idx: Dict[int, int] = {}
+        self.obj_lst: List[Any] = []
+        self.container_idx: Dict[int, int] = {}
+        self.container_keep: List[Any] = []  # 防止编码过程中临时容器被回收后id被复用
+        self.type_kind: Dict[type, int] = {}
+
+        self.kl_list_lst = list(chan.kl_datas.values())
+        self.klu_rows: List[List[CKLine_Unit]] = [[klu for klc in kl_list.lst for klu in klc.lst] for kl_list in self.kl_list_lst]
+        self.klu_pos: Dict[int, Tuple[int, int]] = {}
+        self.klc_pos: Dict[int, Tuple[int, int]] = {}
+        self.klc_list_pos: Dict[int, int] = {}
+        for lv_idx, (kl_list, rows) in enumerate(zip(self.kl_list_lst, self.klu_rows)):
+            self.klc_list_pos[id(kl_list.lst)] = lv_idx
+            for row, klu in enumerate(rows):
+                self.klu_pos[id(klu)] = (lv_idx, row)
+            for klc_idx, klc in enumerate(kl_list.lst, first_index(kl_list.lst)):
+                self.klc_pos[id(klc)] = (lv_idx, klc_idx)
+
+    def get_global_idx(self, obj) -> int:
+        name = global_name(obj)
+        if name not in self.global_idx:
+            if name not in SAFE_GLOBALS:  # 保存时就报错，不要写出加载不了的文件
+                raise CChanException(f"can't serialize {name}, use register_safe_global to allow it", ErrCode.COMMON_ERROR)
+            self.global_idx[name] = len(self.global_idx)
+        return self.global_idx[name]
+
+    def enc_container(self, v, tag, items, *extra):
+        if id(v) in self.container_idx:
+            return (T_CREF, self.container_idx[id(v)])
+        self.container_idx[id(v)] = len(self.container_idx)
+        self.container_keep.append(v)
+        return (tag, *extra, [self.enc(x) for x in items])
+
+    def enc(self, v):
+        t = type(v)
+        if t in _PRIMITIVE_TYPES:
+            return v
+        kind = self.type_kind.get(t)
+        if kind is None:
+            kind = self.type_kind[t] = get_type_kind(t)
+        if kind == K_OBJ:
+            _id = id(v)
+            if _id in self.klu_pos:
+                return (T_KLU, *self.klu_pos[_id])
+            if _id in self.klc_pos:
+                return (T_KLC, *self.klc_pos[_id])
+            idx = self.obj_idx.get(_id)
+            if idx is None:
+                idx = self.obj_idx[_id] = len(self.obj_lst)
+                self.obj_lst.append(v)
+            return (T_REF, idx)
+        if kind == K_CONTAINER:
+            if id(v) in self.klc_list_pos:
+                return (T_KLC_LIST, self.klc_list_pos[id(v)])
+            if t is list:
+                return self.enc_container(v, T_LIST, v)
+            if t is dict:
+                return self.enc_container(v, T_DICT, [x for kv in v.items() for x in kv])
+            if t is defaultdict:
+                return self.enc_container(v, T_DEFAULTDICT, [x for kv in v.items() for x in kv], self.enc(v.default_factory))
+            if t is set:
+                return self.enc_container(v, T_SET, v)
+            if t is CTrimmedList:
+                return self.enc_container(v, T_TRIMMED_LIST, v, v.offset)
+            return self.enc_container(v, T_DEQUE, v, v.maxlen)
+        if kind == K_TUPLE:
+            return (T_TUPLE, [self.enc(x) for x in v])
+        if kind == K_ENUM:
+            return (T_ENUM, self.get_global_idx(t), v.value)
+        if kind == K_GLOBAL:
+            return (T_GLOBAL, self.get_global_idx(v))
+        if kind == K_ARRAY:
+            return (T_ARRAY, v.typecode, v.tobytes())
+        if kind == K_NUMPY:
+            return v.item()
+        raise CChanException(f"can't serialize {t}", ErrCode.COMMON_ERROR)
+
+    def enc_column(self, values: list, by_value=True):
+        # 同一个属性在所有K线上的取值，尽量用紧凑的列表示
+        # by_value: 是否允许把对象按值展开成多列，只有K线直接持有的对象(指标值、交易信息、时间等)可以，更深层的对象可能被共享，按引用保存
+        if len(values) == 0:
+            return ('g', [])
+        first = values[0]
+        if len(set(map(id, values))) == 1:
+            return ('s', self.enc(first))
+        t = type(first)
+        if len(set(map(type, values))) == 1:
+            if t is float:
+                return ('f', array('d', values).tobytes())
+            if t is bool:
+                return ('b', bytes(values))
+            if t is int and all(-(1 << 63) <= v < (1 << 63) for v in values):
+                return ('i', array('q', values).tobytes())
+            if isinstance(first, Enum):
+                return ('e', self.get_global_idx(t), [v.value for v in values])
+            if t is list:
+                # K线自己持有的list（次级别K线列表等），不需要保持共享关系，拼接成一列
+                return ('l', array('q', [len(v) for v in values]).tobytes(), self.enc_column([x for v in values for x in v], by_value=False))
+            if t is dict:
+                keys = list(first.keys())
+                if all(v.keys() == first.keys() for v in values):
+                    return ('d', [self.enc(k) for k in keys], [self.enc_column([v[k] for v in values], by_value=False) for k in keys])
+            if by_value and get_type_kind(t) == K_OBJ and not isinstance(first, CKLine_Unit):
+                states = [dict(get_state(v)) for v in values]
+                names = list(states[0].keys())
+                if all(state.keys() == states[0].keys() for state in states):
+                    return ('o', self.get_global_idx(t), names, [self.enc_column([state[name] for state in states], by_value=False) for name in names])
+        return ('g', [self.enc(v) for v in values])
+
+    def enc_klu_level(self, rows: List[CKLine_Unit]):
+        states = [dict(get_state(klu)) for klu in rows]
+        attr_rows: Dict[str, Optional[List[int]]] = {}  # None表示所有K线都有这个属性
+        if states and all(state.keys() == states[0].keys() for state in states):
+            attr_rows = {name: None for name in states[0]}
+        else:
+            for row, state in enumerate(states):
+                for name in state:
+                    attr_rows.setdefault(name, []).append(row)  # type: ignore
+        columns = []
+        for name, row_lst in attr_rows.items():
+            if name in _KLU_DERIVED_ATTR:
+                continue
+            if row_lst is None:
+                mask = None
+                values = [state[name] for state in states]
+            else:
+                mask = array('q', row_lst).tobytes()
+                values = [states[row][name] for row in row_lst]
+            if name == 'pre' and mask is None and all(map(operator.is_, values, [None] + rows[:-1])):
+                column: tuple = ('pre',)
+            elif name == 'next' and mask is None and all(map(operator.is_, values, rows[1:] + [None])):
+                column = ('next',)
+            else:
+                column = self.enc_column(values)
+            columns.append((name, mask, column))
+        return columns
+
+    def enc_klc_level(self, kl_list):
+        return {
+            'offset': first_index(kl_list.lst),
+            'cnt': array('q', [len(klc.lst) for klc in kl_list.lst]).tobytes(),
+            'idx': self.enc_column([klc.idx for klc in kl_list.lst]),
+            'dir': self.enc_column([klc.dir for klc in kl_list.lst]),
+            'fx': self.enc_column([klc.fx for klc in kl_list.lst]),
+            'kl_type': self.enc_column([klc.kl_type for klc in kl_list.lst]),
+        }
+
+    def encode(self) -> dict:
+        levels = []
+        for kl_list, rows in zip(self.kl_list_lst, self.klu_rows):
+            levels.append({'klu_cnt': len(rows), 'klu': self.enc_klu_level(rows), 'klc': self.enc_klc_level(kl_list)})
+        root = self.enc(self.chan)
+        obj_table = []
+        obj_idx = 0
+        while obj_idx < len(self.obj_lst):  # 编码过程中会不断发现新对象，逐个处理，不递归
+            obj = self.obj_lst[obj_idx]
+            state = []
+            for name, value in get_state(obj):
+                state.append(name)
+                state.append(self.enc(value))
+            obj_table.append((self.get_global_idx(type(obj)), state))
+            obj_idx += 1
+        return {
+            'version': VERSION,
+            'globals': sorted(self.global_idx, key=self.global_idx.get),
+            'levels': levels,
+            'objects': obj_table,
+            'root': root,
+        }
+
+
+class CChanDecoder:
+    def __init__(self, payload: dict):
+        if payload.get('version') != VERSION:
+            raise CChanException(f"unsupported chan binary version: {payload.get('version')}", ErrCode.SRC_DATA_FORMAT_ERROR)
+        self.payload = payload
+        self.globals = [resolve_global(name) for name in payload['globals']]
+        self.objs = [self.new_obj(cls_idx) for cls_idx, _ in payload['objects']]
+        self.klu_rows: List[List[CKLine_Unit]] = [[CKLine_Unit.__new__(CKLine_Unit) for _ in range(level['klu_cnt'])] for level in payload['levels']]
+        self.klc_lst: List[List[CKLine]] = []
+        self.containers: List[Any] = []
+
+    def get_enum_cls(self, idx):
+        cls = self.globals[idx]
+        if not issubclass(cls, Enum):
+            raise CChanException(f"not an enum in chan binary: {global_name(cls)}", ErrCode.SRC_DATA_FORMAT_ERROR)
+        return cls
+
+    def new_obj(self, idx):
+        cls = self.globals[idx]
+        if issubclass(cls, Enum):
+            raise CChanException(f"can't create enum object in chan binary: {global_name(cls)}", ErrCode.SRC_DATA_FORMAT_ERROR)
+        return cls.__new__(cls)
+
+    def new_container(self, v):
+        self.containers.append(v)
+        return v
+
+    def dec(self, v):
+        if type(v) is not tuple:
+            return v
+        tag = v[0]
+        if tag == T_REF:
+            return self.objs[v[1]]
+        if tag == T_KLU:
+            return self.klu_rows[v[1]][v[2]]
+        if tag == T_KLC:
+            return self.klc_lst[v[1]][v[2]]
+        if tag == T_KLC_LIST:
+            return self.klc_lst[v[1]]
+        if tag == T_CREF:
+            return self.containers[v[1]]
+        if tag == T_TUPLE:
+            return tuple(self.dec(x) for x in v[1])
+        if tag == T_LIST:
+            res = self.new_container([])
+            res.extend(self.dec(x) for x in v[1])
+            return res
+        if tag in (T_DICT, T_DEFAULTDICT):
+            if tag == T_DICT:
+                res = self.new_container({})
+            else:
+                res = self.new_container(defaultdict(self.dec(v[1])))
+            items = v[-1]
+            for i in range(0, len(items), 2):
+                key = self.dec(items[i])
+                res[key] = self.dec(items[i+1])
+            return res
+        if tag == T_TRIMMED_LIST:
+            res = self.new_container(CTrimmedList(offset=v[1]))
+            res.extend(self.dec(x) for x in v[2])
+            return res
+        if tag == T_SET:
+            res = self.new_container(set())
+            res.update(self.dec(x) for x in v[1])
+            return res
+        if tag == T_DEQUE:
+            res = self.new_container(deque(maxlen=v[1]))
+            res.extend(self.dec(x) for x in v[2])
+            return res
+        if tag == T_ENUM:
+            return self.get_enum_cls(v[1])(v[2])
+        if tag == T_GLOBAL:
+            return self.globals[v[1]]
+        if tag == T_ARRAY:
+            res = array(v[1])
+            res.frombytes(v[2])
+            return res
+        raise CChanException(f"unknown tag in chan binary: {tag}", ErrCode.SRC_DATA_FORMAT_ERROR)
+
+    def dec_column(self, column, n: int) -> list:
+        kind = column[0]
+        if kind == 's':
+            value = self.dec(column[1])
+            return [value] * n
+        if kind == 'f':
+            return array('d', column[1]).tolist()
+        if kind == 'i':
+            return array('q', column[1]).tolist()
+        if kind == 'b':
+            return [bool(x) for x in column[1]]
+        if kind == 'e':
+            cls = self.get_enum_cls(column[1])
+            return [cls(x) for x in column[2]]
+        if kind == 'd':
+            keys = [self.dec(k) for k in column[1]]
+            value_columns = [self.dec_column(c, n) for c in column[2]]
+            return [dict(zip(keys, values)) for values in zip(*value_columns)] if keys else [{} for _ in range(n)]
+        if kind == 'o':
+            names = column[2]
+            value_columns = [self.dec_column(c, n) for c in column[3]]
+            res = []
+            for values in zip(*value_columns) if names else ([] for _ in range(n)):
+                obj = self.new_obj(column[1])
+                set_state(obj, list(zip(names, values)))
+                res.append(obj)
+            return res
+        if kind == 'l':
+            len_lst = array('q', column[1]).tolist()
+            items = self.dec_column(column[2], sum(len_lst))
+            res, begin = [], 0
+            for length in len_lst:
+                res.append(items[begin:begin+length])
+                begin += length
+            return res
+        if kind == 'g':
+            return [self.dec(x) for x in column[1]]
+        raise CChanException(f"unknown column kind in chan binary: {kind}", ErrCode.SRC_DATA_FORMAT_ERROR)
+
+    def dec_klu_level(self, rows: List[CKLine_Unit], columns):
+        for name, mask, column in columns:
+            row_lst = range(len(rows)) if mask is None else array('q', mask).tolist()
+            if column[0] == 'pre':
+                values: list = [None] + rows[:-1]
+            elif column[0] == 'next':
+                values = rows[1:] + [None]
+            else:
+                values = self.dec_column(column, len(row_lst))
+            for row, value in zip(row_lst, values):
+                object.__setattr__(rows[row], name, value)
+
+    def dec_klc_level(self, rows: List[CKLine_Unit], klc_info) -> List[CKLine]:
+        cnt_lst = array('q', klc_info['cnt']).tolist()
+        n = len(cnt_lst)
+        idx_lst = self.dec_column(klc_info['idx'], n)
+        dir_lst = self.dec_column(klc_info['dir'], n)
+        fx_lst = self.dec_column(klc_info['fx'], n)
+        kl_type_lst = self.dec_column(klc_info['kl_type'], n)
+        res: List[CKLine] = CTrimmedList(offset=klc_info['offset']) if klc_info['offset'] else []
+        row = 0
+        for cnt, idx, _dir, fx, kl_type in zip(cnt_lst, idx_lst, dir_lst, fx_lst, kl_type_lst):
+            # 和CKLine_List.__deepcopy__一样，按K线重建合并K线
+            klc = CKLine(rows[row], idx=idx, _dir=_dir)
+            for klu in rows[row+1:row+cnt]:
+                klu.set_klc(klc)
+                klc.try_add(klu, skip_update_input=True)
+            klc.set_fx(fx)
+            klc.kl_type = kl_type
+            if res:
+                res[-1].set_next(klc)
+                klc.set_pre(res[-1])
+            res.append(klc)
+            row += cnt
+        return res
+
+    def decode(self):
+        for rows, level in zip(self.klu_rows, self.payload['levels']):
+            self.dec_klu_level(rows, level['klu'])
+            self.klc_lst.append(self.dec_klc_level(rows, level['klc']))
+        for obj, (_, state) in zip(self.objs, self.payload['objects']):
+            set_state(obj, [(state[i], self.dec(state[i+1])) for i in range(0, len(state), 2)])
+        return self.dec(self.payload['root'])
+
+
+def dumps_chan(chan) -> bytes:
+    return MAGIC + marshal.dumps(CChanEncoder(chan).encode())
+
+
+def loads_chan(data: bytes):
+    if data[:len(MAGIC)] != MAGIC:
+        raise CChanException("not a chan binary file", ErrCode.SRC_DATA_FORMAT_ERROR)
+    return CChanDecoder(marshal.loads(data[len(MAGIC):])).decode()
+
+
+def dump_chan(chan, file_path: str):
+    with open(file_path, "wb") as f:
+        f.write(dumps_chan(chan))
+
+
+def load_chan(file_path: str):
+    with open(file_path, "rb") as f:
+        return loads_chan(f.read())
@@ -0,0 +1,99 @@
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+from Chan import CChan
+from Common.ChanException import CChanException, ErrCode
+from DataAPI.StreamAPI import CCommonStreamApi
+from KLine.KLine_Unit import CKLine_Unit
+
+# 把流式数据源（DataAPI/StreamAPI.py）持续喂给CChan：
+# - 已经走完且比CChan里最后一根K线新的K线攒成一批调用trigger_load
+# - 没走完的K线（以及刚走完的最后一根）调用update_last_klu，同一根K线反复更新时回滚到checkpoint重算
+# 读数据和计算分开：计算期间到达的同一根K线的多次更新只保留最新值，从K线走完到买卖点更新的延迟只取决于一次计算的时间
+
+
+def coalesce_updates(updates: List[Tuple[CKLine_Unit, bool]]) -> List[Tuple[CKLine_Unit, bool]]:
+    # 同一根K线只保留最后一次的值
+    res: List[Tuple[CKLine_Unit, bool]] = []
+    for klu, is_closed in updates:
+        if res and res[-1][0].time.ts == klu.time.ts:
+            res[-1] = (klu, is_closed or res[-1][1])
+        else:
+            res.append((klu, is_closed))
+    return res
+
+
+class CChanStreamer:
+    def __init__(self, chan: CChan, stream: CCommonStreamApi, on_update: Optional[Callable] = None):
+        # chan需要以trigger_step=True创建（构造时不拉取数据），并且只有一个级别（update_last_klu只接受最高级别K线）
+        # on_update(chan, klu, is_closed)：每次计算完成后调用，可以是普通函数或者协程函数
+        if len(chan.lv_list) != 1:
+            raise CChanException("CChanStreamer only supports single level CChan", ErrCode.PARA_ERROR)
+        if not chan.conf.trigger_step:
+            raise CChanException("CChanStreamer requires trigger_step=True", ErrCode.PARA_ERROR)
+        self.chan = chan
+        self.stream = stream
+        self.on_update = on_update
+        self.lv = chan.lv_list[0]
+        self.update_cnt = 0  # 实际计算的次数（合并之后）
+        self.recv_cnt = 0  # 从数据源收到的更新次数
+
+    def last_ts(self) -> Optional[float]:
+        kl_list = self.chan[0]
+        return kl_list[-1][-1].time.ts if len(kl_list) > 0 else None
+
+    def apply(self, updates: List[Tuple[CKLine_Unit, bool]]) -> Tuple[CKLine_Unit, bool]:
+        # 在工作线程中执行，返回最后一次更新
+        closed_klu: List[CKLine_Unit] = []
+        last_ts = self.last_ts()
+        for klu, is_closed in updates[:-1]:
+            if is_closed and (last_ts is None or klu.time.ts > last_ts):
+                closed_klu.append(klu)
+            else:
+                self.flush(closed_klu)
+                closed_klu = []
+                self.chan.update_last_klu({self.lv: [klu]})
+            last_ts = klu.time.ts
+        self.flush(closed_klu)
+        klu, is_closed = updates[-1]
+        self.chan.update_last_klu({self.lv: [klu]})  # 最后一根即使已经走完也按实时K线处理，之后它的值不会再变
+        return klu, is_closed
+
+    def flush(self, klu_lst: List[CKLine_Unit]):
+        if klu_lst:
+            self.chan.trigger_load({self.lv: klu_lst})
+
+    async def produce(self, queue: asyncio.Queue):
+        try:
+            async for item in self.stream.stream():
+                queue.put_nowait(item)
+        finally:
+            queue.put_nowait(None)
+
+    async def run(self):
+        queue: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(self.produce(queue))
+        try:
+            finished = False
+            while not finished:
+                updates = [await queue.get()]
+                while not queue.empty():
+                    updates.append(queue.get_nowait())
+                if updates[-1] is None:
+                    finished = True
+                    updates.pop()
+                if not updates:
+                    continue
+                self.recv_cnt += len(updates)
+                updates = coalesce_updates(updates)
+                klu, is_closed = await asyncio.to_thread(self.apply, updates)
+                self.update_cnt += 1
+                if self.on_update is not None:
+                    res = self.on_update(self.chan, klu, is_closed)
+                    if asyncio.iscoroutine(res):
+                        await res
+            await producer  # 数据源抛出的异常在这里抛出
+        finally:
+            if not producer.done():
+                producer.cancel()
+            await self.stream.close()
@@ -0,0 +1,116 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+from Chan import CChan
+from ChanConfig import BSP_PARA_DEFAULT, CChanConfig
+from ChanPool import CChanSummary, CLevelSummary
+from Common.CEnum import AUTYPE, CAL_STAGE, DATA_SRC
+from Common.ChanException import CChanException, ErrCode
+
+# 同一只股票、同一段历史上的参数扫描：按参数影响的阶段（K线/笔、线段、中枢、买卖点）分组，
+# 上游参数相同的配置共用上游阶段的计算结果，只重算下游阶段
+# - K线/笔阶段的参数（笔、指标、数据检查等）不同：各自构建一个CChan，重新拉数据
+# - 线段/中枢/买卖点参数不同：在同一个CChan上从对应阶段开始重算（CKLine_List.recal_from_stage）
+# 只扫描买卖点参数时，总开销约为一次完整计算 + 配置数 × 买卖点计算
+# 配置按字典里写出来的参数分组，显式写出默认值和不写视为不同的参数，只是少共用一些计算，结果不受影响
+
+SEG_PARA = {"seg_algo", "left_seg_method"}
+ZS_PARA = {"zs_combine", "zs_combine_mode", "one_bi_zs", "zs_algo"}
+BSP_PARA_SUFFIX = ("-buy", "-sell", "-segbuy", "-segsell", "-seg")
+
+
+def get_para_stage(key: str) -> CAL_STAGE:
+    if key in SEG_PARA:
+        return CAL_STAGE.SEG
+    if key in ZS_PARA:
+        return CAL_STAGE.ZS
+    if key in BSP_PARA_DEFAULT or key.endswith(BSP_PARA_SUFFIX):
+        return CAL_STAGE.BSP
+    return CAL_STAGE.KL
+
+
+def get_stage_key(conf: dict) -> Tuple[str, str, str, str]:
+    # 每个阶段自己的参数，用repr比较，参数值可以是dict/list
+    stage_items: Dict[CAL_STAGE, list] = {stage: [] for stage in CAL_STAGE}
+    for key, value in conf.items():
+        stage_items[get_para_stage(key)].append((key, value))
+    return tuple(repr(sorted(stage_items[stage], key=lambda item: item[0])) for stage in CAL_STAGE)  # type: ignore
+
+
+def first_diff_stage(key1: Tuple[str, ...], key2: Tuple[str, ...]) -> Optional[CAL_STAGE]:
+    for stage, item1, item2 in zip(CAL_STAGE, key1, key2):
+        if item1 != item2:
+            return stage
+    return None
+
+
+class CChanSweep:
+    def __init__(
+        self,
+        code,
+        config_lst: List[dict],
+        begin_time=None,
+        end_time=None,
+        data_src: Union[DATA_SRC, str] = DATA_SRC.BAO_STOCK,
+        lv_list=None,
+        autype: AUTYPE = AUTYPE.QFQ,
+        bsp_number: int = 0,
+    ):
+        # config_lst是CChanConfig的参数字典列表（不会被修改），不支持trigger_step和keep_seg_cnt
+        self.code = code
+        self.config_lst = config_lst
+        self.begin_time = begin_time
+        self.end_time = end_time
+        self.data_src = data_src
+        self.lv_list = lv_list
+        self.autype = autype
+        self.bsp_number = bsp_number  # 每个级别返回最近多少个买卖点，0表示全部
+        self.stage_cal_cnt: Dict[CAL_STAGE, int] = {stage: 0 for stage in CAL_STAGE}  # 每个阶段实际计算的次数
+
+        self.chan_config_lst = [CChanConfig(dict(conf)) for conf in config_lst]  # 先检查所有参数
+        for chan_config in self.chan_config_lst:
+            if chan_config.trigger_step or chan_config.keep_seg_cnt:
+                raise CChanException("CChanSweep does not support trigger_step or keep_seg_cnt", ErrCode.PARA_ERROR)
+
+    def run(self) -> List[CChanSummary]:
+        # 返回和config_lst一一对应的结果，某组K线参数计算失败时，该组的配置errcode/err_msg非空
+        key_lst = [get_stage_key(conf) for conf in self.config_lst]
+        # 按各阶段参数排序，相同的上游参数排在一起，每个上游阶段的结果只算一次
+        order = sorted(range(len(self.config_lst)), key=lambda idx: key_lst[idx])
+        summary_dict: Dict[int, CChanSummary] = {}
+        chan: Optional[CChan] = None
+        err: Optional[CChanException] = None
+        last_idx: Optional[int] = None
+        for idx in order:
+            stage = CAL_STAGE.KL if last_idx is None else first_diff_stage(key_lst[last_idx], key_lst[idx])
+            last_idx = idx
+            if stage == CAL_STAGE.KL:
+                chan, err = None, None
+                self.stage_cal_cnt[CAL_STAGE.KL] += 1
+                try:
+                    chan = self.build_chan(self.chan_config_lst[idx])
+                except CChanException as e:
+                    err = e
+            elif stage is not None and chan is not None:
+                for kl_list in chan.kl_datas.values():
+                    kl_list.recal_from_stage(self.chan_config_lst[idx], stage)
+                self.stage_cal_cnt[stage] += 1
+            summary = CChanSummary(self.code)
+            if chan is not None:
+                for kl_type, kl_list in chan.kl_datas.items():
+                    summary.lv_data[kl_type] = CLevelSummary(kl_list, self.bsp_number)
+            elif err is not None:
+                summary.errcode = err.errcode
+                summary.err_msg = err.msg
+            summary_dict[idx] = summary
+        return [summary_dict[idx] for idx in range(len(self.config_lst))]
+
+    def build_chan(self, config: CChanConfig) -> CChan:
+        return CChan(
+            code=self.code,
+            begin_time=self.begin_time,
+            end_time=self.end_time,
+            data_src=self.data_src,
+            lv_list=self.lv_list,
+            config=config,
+            autype=self.autype,
+        )
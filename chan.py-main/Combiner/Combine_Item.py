@@ -1,25 +1,46 @@
+from operator import attrgetter, methodcaller
+from typing import Dict
+
 from Common.ChanException import CChanException, ErrCode
 
 
-class CCombine_Item:
-    def __init__(self, item):
+# 合并时按元素类型读取时间/高低点，每种元素一个适配器（类属性都是C实现的getter）
+class CKLU_CombineAdapter:
+    time_begin = attrgetter('time')
+    time_end = attrgetter('time')
+    high = attrgetter('high')
+    low = attrgetter('low')
+
+
+class CBi_CombineAdapter:
+    time_begin = attrgetter('begin_klc.idx')
+    time_end = attrgetter('end_klc.idx')
+    high = methodcaller('_high')
+    low = methodcaller('_low')
+
+
+class CSeg_CombineAdapter:
+    time_begin = attrgetter('start_bi.begin_klc.idx')
+    time_end = attrgetter('end_bi.end_klc.idx')
+    high = methodcaller('_high')
+    low = methodcaller('_low')
+
+
+_adapter_cache: Dict[type, type] = {}
+
+
+def get_combine_adapter(item_type: type):
+    if item_type not in _adapter_cache:
         from Bi.Bi import CBi
         from KLine.KLine_Unit import CKLine_Unit
         from Seg.Seg import CSeg
-        if isinstance(item, CBi):
-            self.time_begin = item.begin_klc.idx
-            self.time_end = item.end_klc.idx
-            self.high = item._high()
-            self.low = item._low()
-        elif isinstance(item, CKLine_Unit):
-            self.time_begin = item.time
-            self.time_end = item.time
-            self.high = item.high
-            self.low = item.low
-        elif isinstance(item, CSeg):
-            self.time_begin = item.start_bi.begin_klc.idx
-            self.time_end = item.end_bi.end_klc.idx
-            self.high = item._high()
-            self.low = item._low()
+        if issubclass(item_type, CBi):
+            _adapter_cache[item_type] = CBi_CombineAdapter
+        elif issubclass(item_type, CKLine_Unit):
+            _adapter_cache[item_type] = CKLU_CombineAdapter
+        elif issubclass(item_type, CSeg):
+            _adapter_cache[item_type] = CSeg_CombineAdapter
         else:
-            raise CChanException(f"{type(item)} is unsupport sub class of CCombine_Item", ErrCode.COMMON_ERROR)
+            raise CChanException(f"{item_type} is unsupport sub class of get_combine_adapter", ErrCode.COMMON_ERROR)
+    return _adapter_cache[item_type]
+
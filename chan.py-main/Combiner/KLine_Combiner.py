@@ -1,24 +1,28 @@
 from typing import Generic, Iterable, List, Optional, Self, TypeVar, Union, overload
 
-from Common.cache import make_cache
 from Common.CEnum import FX_TYPE, KLINE_DIR
 from Common.ChanException import CChanException, ErrCode
 from KLine.KLine_Unit import CKLine_Unit
 
-from .Combine_Item import CCombine_Item
+from .Combine_Item import get_combine_adapter
 
 T = TypeVar('T')
 
 
 class CKLine_Combiner(Generic[T]):
+    __slots__ = ('__time_begin', '__time_end', '__high', '__low', '__lst', '__high_peak_idx', '__low_peak_idx', '__dir', '__fx', '__pre', '__next', '_memoize_cache')
+
     def __init__(self, kl_unit: T, _dir):
-        item = CCombine_Item(kl_unit)
-        self.__time_begin = item.time_begin
-        self.__time_end = item.time_end
-        self.__high = item.high
-        self.__low = item.low
+        adapter = get_combine_adapter(type(kl_unit))
+        self.__time_begin = adapter.time_begin(kl_unit)
+        self.__time_end = adapter.time_end(kl_unit)
+        self.__high = adapter.high(kl_unit)
+        self.__low = adapter.low(kl_unit)
 
         self.__lst: List[T] = [kl_unit]  # 本级别每一根单位K线
+        # 最后一个取到high/low的元素在lst中的下标，合并时维护，取峰值元素时不用倒序扫描lst
+        self.__high_peak_idx = 0
+        self.__low_peak_idx = 0
 
         self.__dir = _dir
         self.__fx = FX_TYPE.UNKNOWN
@@ -61,18 +65,19 @@ class CKLine_Combiner(Generic[T]):
         assert self.next is not None
         return self.next
 
-    def test_combine(self, item: CCombine_Item, exclude_included=False, allow_top_equal=None):
-        if (self.high >= item.high and self.low <= item.low):
+    def test_combine(self, high, low, exclude_included=False, allow_top_equal=None):
+        # high/low: 待合并元素的高低点
+        if (self.__high >= high and self.__low <= low):
             return KLINE_DIR.COMBINE
-        if (self.high <= item.high and self.low >= item.low):
-            if allow_top_equal == 1 and self.high == item.high and self.low > item.low:
+        if (self.__high <= high and self.__low >= low):
+            if allow_top_equal == 1 and self.__high == high and self.__low > low:
                 return KLINE_DIR.DOWN
-            elif allow_top_equal == -1 and self.low == item.low and self.high < item.high:
+            elif allow_top_equal == -1 and self.__low == low and self.__high < high:
                 return KLINE_DIR.UP
             return KLINE_DIR.INCLUDED if exclude_included else KLINE_DIR.COMBINE
-        if (self.high > item.high and self.low > item.low):
+        if (self.__high > high and self.__low > low):
             return KLINE_DIR.DOWN
-        if (self.high < item.high and self.low < item.low):
+        if (self.__high < high and self.__low < low):
             return KLINE_DIR.UP
         else:
             raise CChanException("combine type unknown", ErrCode.COMBINER_ERR)
@@ -85,23 +90,30 @@ class CKLine_Combiner(Generic[T]):
         # allow_top_equal = None普通模式
         # allow_top_equal = 1 被包含，顶部相等不合并
         # allow_top_equal = -1 被包含，底部相等不合并
-        combine_item = CCombine_Item(unit_kl)
-        _dir = self.test_combine(combine_item, exclude_included, allow_top_equal)
+        adapter = get_combine_adapter(type(unit_kl))
+        high = adapter.high(unit_kl)
+        low = adapter.low(unit_kl)
+        _dir = self.test_combine(high, low, exclude_included, allow_top_equal)
         if _dir == KLINE_DIR.COMBINE:
             self.__lst.append(unit_kl)
             if isinstance(unit_kl, CKLine_Unit) and not skip_update_input:
                 unit_kl.set_klc(self)
-            if self.dir == KLINE_DIR.UP:
-                if combine_item.high != combine_item.low or combine_item.high != self.high:  # 处理一字K线
-                    self.__high = max([self.high, combine_item.high])
-                    self.__low = max([self.low, combine_item.low])
-            elif self.dir == KLINE_DIR.DOWN:
-                if combine_item.high != combine_item.low or combine_item.low != self.low:  # 处理一字K线
-                    self.__high = min([self.high, combine_item.high])
-                    self.__low = min([self.low, combine_item.low])
+            if self.__dir == KLINE_DIR.UP:
+                if high != low or high != self.__high:  # 处理一字K线
+                    self.__high = max(self.__high, high)
+                    self.__low = max(self.__low, low)
+            elif self.__dir == KLINE_DIR.DOWN:
+                if high != low or low != self.__low:  # 处理一字K线
+                    self.__high = min(self.__high, high)
+                    self.__low = min(self.__low, low)
             else:
                 raise CChanException(f"KLINE_DIR = {self.dir} err!!! must be {KLINE_DIR.UP}/{KLINE_DIR.DOWN}", ErrCode.COMBINER_ERR)
-            self.__time_end = combine_item.time_end
+            # 合并后的high/low要么不变，要么等于新元素的值，新元素取到时就是最后一个峰值元素
+            if high == self.__high:
+                self.__high_peak_idx = len(self.__lst) - 1
+            if low == self.__low:
+                self.__low_peak_idx = len(self.__lst) - 1
+            self.__time_end = adapter.time_end(unit_kl)
             self.clean_cache()
         # 返回UP/DOWN/COMBINE给KL_LIST，设置下一个的方向
         return _dir
@@ -110,19 +122,11 @@ class CKLine_Combiner(Generic[T]):
         # 获取最大值 or 最小值所在klu/bi
         return self.get_high_peak_klu() if is_high else self.get_low_peak_klu()
 
-    @make_cache
     def get_high_peak_klu(self) -> T:
-        for kl in self.lst[::-1]:
-            if CCombine_Item(kl).high == self.high:
-                return kl
-        raise CChanException("can't find peak...", ErrCode.COMBINER_ERR)
+        return self.__lst[self.__high_peak_idx]
 
-    @make_cache
     def get_low_peak_klu(self) -> T:
-        for kl in self.lst[::-1]:
-            if CCombine_Item(kl).low == self.low:
-                return kl
-        raise CChanException("can't find peak...", ErrCode.COMBINER_ERR)
+        return self.__lst[self.__low_peak_idx]
 
     def update_fx(self, _pre: Self, _next: Self, exclude_included=False, allow_top_equal=None):
         # allow_top_equal = None普通模式
@@ -6,6 +6,8 @@ class DATA_SRC(Enum):
     BAO_STOCK = auto()
     CCXT = auto()
     CSV = auto()
+    BULK = auto()  # 内存中的DataFrame/numpy数组，见DataAPI/BulkAPI.py
+    RESAMPLE = auto()  # 只拉取一个基础级别，其他级别本地合成，见DataAPI/ResampleAPI.py
 
 
 class KL_TYPE(Enum):
@@ -100,6 +102,14 @@ class SEG_TYPE(Enum):
     SEG = auto()
 
 
+class CAL_STAGE(Enum):
+    # 计算流程的各个阶段，按先后顺序，后面的阶段只依赖前面的结果
+    KL = auto()  # K线合并、指标、笔
+    SEG = auto()
+    ZS = auto()
+    BSP = auto()
+
+
 class MACD_ALGO(Enum):
     AREA = auto()
     PEAK = auto()
@@ -1,41 +1,118 @@
 from datetime import datetime
 
+# 时间戳统一用整数秒，按“把当地时间当成UTC”计算（不受时区/夏令时影响），只用于比较先后和计算间隔
+# 年月日时分只在展示时由时间戳现算，K线核心逻辑里只比较ts
+DAY_END_SHIFT = 23 * 3600 + 59 * 60  # auto模式下00:00表示当天收盘，按23:59计算ts
+MONTH_DAYS = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def days_in_month(year, month):
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return MONTH_DAYS[month]
+
+
+def days_from_civil(year, month, day):
+    # 公历日期 -> 距1970-01-01的天数，整数和numpy整数数组都适用
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def civil_from_days(days: int):
+    days += 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (month <= 2), month, day
+
 
 class CTime:
     def __init__(self, year, month, day, hour, minute, second=0, auto=True):
-        self.year = year
-        self.month = month
-        self.day = day
-        self.hour = hour
-        self.minute = minute
-        self.second = second
+        if not (1 <= month <= 12 and 1 <= day <= days_in_month(year, month) and 0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+            raise ValueError(f"invalid time: {year}/{month}/{day} {hour}:{minute}:{second}")
         self.auto = auto  # 自适应对天的理解
+        self.__disp_ts: int = days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
         self.set_timestamp()  # set self.ts
 
+    @classmethod
+    def from_ts(cls, disp_ts: int, auto=False) -> 'CTime':
+        # disp_ts为展示时间对应的整数时间戳（即days_from_civil(...)*86400+时分秒），数据源向量化算好之后直接构造
+        obj = cls.__new__(cls)
+        obj.auto = auto
+        obj.__disp_ts = disp_ts
+        obj.set_timestamp()
+        return obj
+
+    @property
+    def disp_ts(self) -> int:
+        return self.__disp_ts
+
+    def get_fields(self):
+        # (year, month, day, hour, minute, second)
+        days, seconds = divmod(self.__disp_ts, 86400)
+        return (*civil_from_days(days), seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    @property
+    def year(self) -> int:
+        return self.get_fields()[0]
+
+    @property
+    def month(self) -> int:
+        return self.get_fields()[1]
+
+    @property
+    def day(self) -> int:
+        return self.get_fields()[2]
+
+    @property
+    def hour(self) -> int:
+        return self.__disp_ts % 86400 // 3600
+
+    @property
+    def minute(self) -> int:
+        return self.__disp_ts % 3600 // 60
+
+    @property
+    def second(self) -> int:
+        return self.__disp_ts % 60
+
+    def day_idx(self) -> int:
+        # 距1970-01-01的天数，用于判断是否同一天
+        return self.__disp_ts // 86400
+
     def __str__(self):
-        if self.hour == 0 and self.minute == 0:
-            return f"{self.year:04}/{self.month:02}/{self.day:02}"
-        else:
-            return f"{self.year:04}/{self.month:02}/{self.day:02} {self.hour:02}:{self.minute:02}"
+        return self.to_str()
 
     def to_str(self):
-        if self.hour == 0 and self.minute == 0:
-            return f"{self.year:04}/{self.month:02}/{self.day:02}"
+        year, month, day, hour, minute, _ = self.get_fields()
+        if hour == 0 and minute == 0:
+            return f"{year:04}/{month:02}/{day:02}"
         else:
-            return f"{self.year:04}/{self.month:02}/{self.day:02} {self.hour:02}:{self.minute:02}"
+            return f"{year:04}/{month:02}/{day:02} {hour:02}:{minute:02}"
 
     def toDateStr(self, splt=''):
-        return f"{self.year:04}{splt}{self.month:02}{splt}{self.day:02}"
+        year, month, day, *_ = self.get_fields()
+        return f"{year:04}{splt}{month:02}{splt}{day:02}"
 
     def toDate(self):
-        return CTime(self.year, self.month, self.day, 0, 0, auto=False)
+        return CTime.from_ts(self.day_idx() * 86400, auto=False)
+
+    def to_datetime(self) -> datetime:
+        return datetime(*self.get_fields())
 
     def set_timestamp(self):
-        if self.hour == 0 and self.minute == 0 and self.auto:
-            date = datetime(self.year, self.month, self.day, 23, 59, self.second)
+        if self.auto and self.__disp_ts % 86400 < 60:  # 00:00
+            self.ts: int = self.__disp_ts + DAY_END_SHIFT
         else:
-            date = datetime(self.year, self.month, self.day, self.hour, self.minute, self.second)
-        self.ts = date.timestamp()
+            self.ts = self.__disp_ts
 
     def __gt__(self, t2):
         return self.ts > t2.ts
@@ -0,0 +1,77 @@
+from typing import Tuple, Union
+
+
+class CTrimmedList(list):
+    # 头部可以被裁剪掉的list（滚动窗口模式，见CChanConfig.keep_seg_cnt）
+    # 下标、切片和len()都按裁剪前的位置计算，元素的idx和它在列表中的位置保持一致；迭代只包含保留下来的元素
+    # 访问已经裁剪掉的下标会抛IndexError
+    __slots__ = ('offset',)
+
+    def __init__(self, iterable=(), offset=0):
+        super(CTrimmedList, self).__init__(iterable)
+        self.offset = offset  # 已经裁剪掉的元素个数
+
+    def __len__(self):
+        return self.offset + list.__len__(self)
+
+    def __bool__(self):
+        # 是否还有保留的元素，`if lst: lst[-1]`这类写法不会访问到已经裁剪掉的部分
+        return list.__len__(self) > 0
+
+    def trim(self, cnt: int):
+        # 删除最前面cnt个保留的元素
+        list.__delitem__(self, slice(0, cnt))
+        self.offset += cnt
+
+    def __real_index(self, index: int) -> int:
+        if index < 0:
+            return index
+        if index < self.offset:
+            raise IndexError(f"index {index} has been trimmed (offset={self.offset})")
+        return index - self.offset
+
+    def __real_slice(self, index: slice) -> slice:
+        start, stop, step = index.indices(len(self))
+        if step > 0:
+            return slice(max(start - self.offset, 0), max(stop - self.offset, 0), step)
+        if start < self.offset:
+            return slice(0, 0, step)
+        return slice(start - self.offset, stop - self.offset if stop >= self.offset else None, step)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return list.__getitem__(self, self.__real_slice(index))
+        return list.__getitem__(self, self.__real_index(index))
+
+    def __setitem__(self, index: Union[int, slice], value):
+        if isinstance(index, slice):
+            list.__setitem__(self, self.__real_slice(index), value)
+        else:
+            list.__setitem__(self, self.__real_index(index), value)
+
+    def __delitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            list.__delitem__(self, self.__real_slice(index))
+        else:
+            list.__delitem__(self, self.__real_index(index))
+
+    def __reduce_ex__(self, protocol):
+        # pickle/deepcopy时保留offset，元素按list的方式逐个追加
+        return (CTrimmedList, (), self.offset, list.__iter__(self))
+
+    def __setstate__(self, state):
+        self.offset = state
+
+
+def first_index(lst: list) -> int:
+    # 列表中第一个保留元素的下标，普通list为0
+    return lst.offset if isinstance(lst, CTrimmedList) else 0
+
+
+def trim_list(lst: list, begin: int) -> Tuple[CTrimmedList, list]:
+    # 删除下标小于begin的元素，返回(裁剪后的列表, 被删除的元素)；普通list第一次裁剪时转成CTrimmedList
+    if not isinstance(lst, CTrimmedList):
+        lst = CTrimmedList(lst)
+    removed = lst[:begin]
+    lst.trim(len(removed))
+    return lst, removed
@@ -1,34 +1,26 @@
+import functools
 import inspect
-import types
 
+_MISSING = object()
 
-class make_cache:
-    def __init__(self, func):
-        self.func = func
 
-        fargspec = inspect.getfullargspec(func)
-        if len(fargspec.args) != 1 or fargspec.args[0] != "self":
-            raise Exception("@memoize must be `(self)`")
+def make_cache(func):
+    # 无参方法的结果缓存在实例的_memoize_cache字典里，clean_cache()把字典换成空的即全部失效
+    # 返回普通函数而不是描述符对象，绑定由解释器完成，命中时只有一次字典查找
+    fargspec = inspect.getfullargspec(func)
+    if len(fargspec.args) != 1 or fargspec.args[0] != "self":
+        raise Exception("@memoize must be `(self)`")
 
-        # set key for this function
-        self.func_key = str(func)
+    func_key = func.__qualname__
 
-    def __get__(self, instance, cls):
-        if instance is None:
-            raise Exception("@memoize's must be bound")
-
-        if not hasattr(instance, "_memoize_cache"):
-            setattr(instance, "_memoize_cache", {})
-
-        return types.MethodType(self, instance)
-
-    def __call__(self, *args, **kwargs):
-        instance = args[0]
-        cache = instance._memoize_cache
-
-        if self.func_key in cache:
-            return cache[self.func_key]
-
-        result = self.func(*args, **kwargs)
-        cache[self.func_key] = result
+    @functools.wraps(func)
+    def wrapper(self):
+        try:
+            cache = self._memoize_cache
+        except AttributeError:
+            cache = self._memoize_cache = {}
+        result = cache.get(func_key, _MISSING)
+        if result is _MISSING:
+            result = cache[func_key] = func(self)
         return result
+    return wrapper
@@ -0,0 +1,163 @@
+import gc
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from Common.CEnum import DATA_FIELD, KL_TYPE, TRADE_INFO_LST
+from Common.ChanException import CChanException, ErrCode
+from Common.CTime import CTime
+from Common.func_util import kltype_lt_day
+from KLine.KLine_Unit import CKLine_Unit
+from KLine.TradeInfo import CTradeInfo
+
+from .CommonStockAPI import CCommonStockApi
+from .csvAPI import ctime_to_time_key, parse_time_key, parse_time_key_chunk, time_key_to_ts
+
+# 直接从内存中的DataFrame/numpy数组导入K线，不经过csv落盘再逐行解析
+# 数据可以是pandas.DataFrame，也可以是{列名: 数组}的字典，列名同DATA_FIELD（时间列也可以叫time，DataFrame也可以用DatetimeIndex作为时间）
+# 时间列支持datetime64/datetime/pandas.Timestamp、字符串（格式同csv）以及CTime
+
+
+def get_column(data, names: List[str]):
+    for name in names:
+        if name in data:
+            return data[name]
+    return None
+
+
+def datetime64_to_key(arr: np.ndarray) -> np.ndarray:
+    arr = arr.astype('datetime64[m]')
+    month_begin = arr.astype('datetime64[M]')
+    year = arr.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = month_begin.astype(np.int64) % 12 + 1
+    day = (arr.astype('datetime64[D]') - month_begin.astype('datetime64[D]')).astype(np.int64) + 1
+    minute_of_day = (arr - arr.astype('datetime64[D]')).astype(np.int64)
+    return year * 10**8 + month * 10**6 + day * 10**4 + (minute_of_day // 60) * 100 + minute_of_day % 60
+
+
+def get_time_key(time_col) -> np.ndarray:
+    # 时间列统一转成整数YYYYMMDDHHMM，和csvAPI的time_key一致
+    if hasattr(time_col, 'dt') and getattr(time_col.dt, 'tz', None) is not None:  # 带时区的pandas时间，保留当地时间
+        time_col = time_col.dt.tz_localize(None)
+    elif getattr(time_col, 'tz', None) is not None:
+        time_col = time_col.tz_localize(None)
+    arr = np.asarray(time_col)
+    if len(arr) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if np.issubdtype(arr.dtype, np.datetime64):
+        return datetime64_to_key(arr)
+    if np.issubdtype(arr.dtype, np.number):  # 整数时间戳单位不确定（秒/毫秒），需要调用方先转成datetime64
+        raise CChanException("numeric time column is not supported, convert it to datetime64 first", ErrCode.SRC_DATA_FORMAT_ERROR)
+    first = arr[0]
+    if isinstance(first, CTime):
+        return np.array([ctime_to_time_key(t) for t in arr], dtype=np.int64)
+    if isinstance(first, (str, bytes)):
+        return parse_time_key_chunk([t.encode() if isinstance(t, str) else t for t in arr])
+    try:
+        return datetime64_to_key(arr.astype('datetime64[m]'))
+    except (ValueError, TypeError) as e:
+        raise CChanException(f"unknown time column type: {type(first)}", ErrCode.SRC_DATA_FORMAT_ERROR) from e
+
+
+def key_to_ctime(key: int, auto: bool) -> CTime:
+    date, hour_minute = divmod(key, 10**4)
+    year, month_day = divmod(date, 10**4)
+    return CTime(year, month_day // 100, month_day % 100, hour_minute // 100, hour_minute % 100, auto=auto)
+
+
+def check_price(time_key: np.ndarray, _open: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, autofix: bool) -> Tuple[np.ndarray, np.ndarray]:
+    # 向量化版本的CKLine_Unit.check，返回(修正后的high, 修正后的low)
+    min_price = np.minimum.reduce([low, _open, high, close])
+    bad = low > min_price
+    if bad.any():
+        if not autofix:
+            i = int(np.argmax(bad))
+            raise CChanException(f"{key_to_ctime(int(time_key[i]), False)} low price={low[i]} is not min of [low={low[i]}, open={_open[i]}, high={high[i]}, close={close[i]}]", ErrCode.KL_DATA_INVALID)
+        low = np.where(bad, min_price, low)
+    max_price = np.maximum.reduce([low, _open, high, close])
+    bad = high < max_price
+    if bad.any():
+        if not autofix:
+            i = int(np.argmax(bad))
+            raise CChanException(f"{key_to_ctime(int(time_key[i]), False)} high price={high[i]} is not max of [low={low[i]}, open={_open[i]}, high={high[i]}, close={close[i]}]", ErrCode.KL_DATA_INVALID)
+        high = np.where(bad, max_price, high)
+    return high, low
+
+
+def bulk_to_klu_list(data, kl_type: KL_TYPE, autofix=False, begin_date=None, end_date=None) -> List[CKLine_Unit]:
+    time_col = get_column(data, [DATA_FIELD.FIELD_TIME, "time"])
+    if time_col is None and hasattr(data, 'index'):  # DataFrame以时间为index
+        time_col = data.index
+    if time_col is None:
+        raise CChanException("bulk data has no time column", ErrCode.SRC_DATA_FORMAT_ERROR)
+    time_key = get_time_key(time_col)
+    price = {}
+    for field in [DATA_FIELD.FIELD_OPEN, DATA_FIELD.FIELD_HIGH, DATA_FIELD.FIELD_LOW, DATA_FIELD.FIELD_CLOSE]:
+        col = get_column(data, [field])
+        if col is None:
+            raise CChanException(f"bulk data has no {field} column", ErrCode.SRC_DATA_FORMAT_ERROR)
+        price[field] = np.asarray(col, dtype=np.float64)
+    trade_info = {metric: np.asarray(get_column(data, [metric]), dtype=np.float64) for metric in TRADE_INFO_LST if get_column(data, [metric]) is not None}
+
+    if begin_date is not None or end_date is not None:
+        mask = np.ones(len(time_key), dtype=bool)
+        if begin_date is not None:
+            mask &= time_key >= parse_time_key(begin_date)
+        if end_date is not None:
+            mask &= time_key <= parse_time_key(end_date, is_end=True)
+        time_key = time_key[mask]
+        price = {field: value[mask] for field, value in price.items()}
+        trade_info = {metric: value[mask] for metric, value in trade_info.items()}
+
+    _open, close = price[DATA_FIELD.FIELD_OPEN], price[DATA_FIELD.FIELD_CLOSE]
+    high, low = check_price(time_key, _open, price[DATA_FIELD.FIELD_HIGH], price[DATA_FIELD.FIELD_LOW], close, autofix)
+
+    auto = not kltype_lt_day(kl_type)  # 日线及以上时间描述的是当天，同ccxt数据源
+    ts_lst = time_key_to_ts(time_key).tolist()
+    metric_value_lst = [[None if v != v else v for v in value.tolist()] for value in trade_info.values()]  # nan视为None
+    res = []
+    gc_enabled = gc.isenabled()
+    gc.disable()  # 新建的K线之间没有循环引用，一次性创建大量对象时分代回收反复扫描res，关掉能快一倍多
+    try:
+        for ts, o, h, l, c, *metric_values in zip(ts_lst, _open.tolist(), high.tolist(), low.tolist(), close.tolist(), *metric_value_lst):
+            klu = CKLine_Unit.from_value(CTime.from_ts(ts, auto=auto), o, h, l, c, CTradeInfo(dict(zip(trade_info.keys(), metric_values))))
+            klu.kl_type = kl_type
+            res.append(klu)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return res
+
+
+class CBulkAPI(CCommonStockApi):
+    # DATA_SRC.BULK：先通过set_data注册数据，CChan按(code, kl_type)取用，begin_time/end_time同csv
+    data_dict: Dict[Tuple[str, KL_TYPE], object] = {}
+    autofix = False
+
+    def __init__(self, code, k_type=KL_TYPE.K_DAY, begin_date=None, end_date=None, autype=None):
+        super(CBulkAPI, self).__init__(code, k_type, begin_date, end_date, autype)
+
+    @classmethod
+    def set_data(cls, code, k_type: KL_TYPE, data):
+        cls.data_dict[(code, k_type)] = data
+
+    @classmethod
+    def clear_data(cls, code: Optional[str] = None):
+        for key in [key for key in cls.data_dict if code is None or key[0] == code]:
+            del cls.data_dict[key]
+
+    def get_kl_data(self):
+        if (self.code, self.k_type) not in self.data_dict:
+            raise CChanException(f"bulk data not set: {self.code} {self.k_type}", ErrCode.SRC_DATA_NOT_FOUND)
+        yield from bulk_to_klu_list(self.data_dict[(self.code, self.k_type)], self.k_type, self.autofix, self.begin_date, self.end_date)
+
+    def SetBasciInfo(self):
+        pass
+
+    @classmethod
+    def do_init(cls):
+        pass
+
+    @classmethod
+    def do_close(cls):
+        pass
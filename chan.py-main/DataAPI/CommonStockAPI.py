@@ -5,6 +5,8 @@ from KLine.KLine_Unit import CKLine_Unit
 
 
 class CCommonStockApi:
+    session_holder = False  # 为True时do_init/do_close由外部统一调用，CChan.load不再每次调用
+
     def __init__(self, code, k_type, begin_date, end_date, autype):
         self.code = code
         self.name = None
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from Common.ChanException import CChanException, ErrCode
+
+# ccxt格式K线的并发分页下载 + 列式本地缓存
+# - 时间范围按每页page_limit根切成多个窗口，窗口之间并发下载，请求速度由令牌桶限制
+# - 每个窗口内部按since继续翻页，直到窗口结束或交易所没有更多数据，窗口边界的重复/缺失由合并时去重处理
+# - 结果是按时间戳排序去重后的结构化数组（OHLCV_DTYPE），同一时间戳以后下载的为准
+# - 缓存目录下每列一个定长二进制文件，增量更新时只截断被覆盖的尾部再追加，不重写整个文件
+
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+OHLCV_DTYPE = np.dtype([('timestamp', np.int64)] + [(col, np.float64) for col in OHLCV_COLUMNS[1:]])
+
+TIMEFRAME_MS = {
+    '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '1d': 86_400_000, '1w': 604_800_000,
+    '1M': 2_419_200_000,  # 按最短的28天算，下一根K线最早在这之后
+}
+
+
+def rows_to_array(rows: List[list]) -> np.ndarray:
+    res = np.zeros(len(rows), dtype=OHLCV_DTYPE)
+    if len(rows) == 0:
+        return res
+    arr = np.array(rows, dtype=np.float64).reshape(len(rows), -1)
+    res['timestamp'] = arr[:, 0].astype(np.int64)
+    for i, col in enumerate(OHLCV_COLUMNS[1:], start=1):
+        res[col] = np.nan_to_num(arr[:, i]) if i < arr.shape[1] else 0.0  # volume可能为None
+    return res
+
+
+def merge_ohlcv(*arr_lst: np.ndarray) -> np.ndarray:
+    # 拼接后按时间戳稳定排序，时间戳相同时保留排在最后的（靠后的参数优先）
+    arr_lst = tuple(arr for arr in arr_lst if len(arr) > 0)
+    if len(arr_lst) == 0:
+        return np.zeros(0, dtype=OHLCV_DTYPE)
+    data = np.concatenate(arr_lst)
+    data = data[np.argsort(data['timestamp'], kind='stable')]
+    ts = data['timestamp']
+    return data[np.append(ts[1:] != ts[:-1], True)]
+
+
+class CTokenBucket:
+    # 平均每秒rate个请求，最多连续capacity个；只在同一个事件循环中使用，不需要加锁
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise CChanException(f"rate must be positive: {rate}", ErrCode.PARA_ERROR)
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    async def acquire(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CHistoryDownloader:
+    # exchange为ccxt.async_support的交易所实例（或者ReplayExchange.CReplayExchange），建议关闭exchange自带的enableRateLimit，由令牌桶统一限速
+    # rate为None时按exchange.rateLimit（每次请求间隔的毫秒数）换算
+    def __init__(self, exchange, code, timeframe: str, page_limit=1000, max_concurrency=8, rate: Optional[float] = None, max_retry=3, retry_interval=2.0):
+        if timeframe not in TIMEFRAME_MS:
+            raise CChanException(f"unknown timeframe: {timeframe}", ErrCode.PARA_ERROR)
+        self.exchange = exchange
+        self.code = code
+        self.timeframe = timeframe
+        self.page_limit = page_limit
+        self.max_concurrency = max_concurrency
+        if rate is None:
+            rate_limit = getattr(exchange, 'rateLimit', None)
+            rate = 1000 / rate_limit if rate_limit else 10.0
+        self.bucket = CTokenBucket(rate, capacity=max_concurrency)
+        self.max_retry = max_retry
+        self.retry_interval = retry_interval
+        self.request_cnt = 0
+
+    async def fetch_page(self, since: int) -> List[list]:
+        for i in range(self.max_retry):
+            await self.bucket.acquire()
+            self.request_cnt += 1
+            try:
+                return await self.exchange.fetch_ohlcv(self.code, self.timeframe, since=since, limit=self.page_limit)
+            except Exception as e:
+                if i == self.max_retry - 1:
+                    raise CChanException(f"fetch_ohlcv {self.code} {self.timeframe} since={since} failed: {e}", ErrCode.SRC_DATA_NOT_FOUND) from e
+                print(f"网络波动，第 {i+1} 次重试... ({e})")
+                await asyncio.sleep(self.retry_interval)
+        return []
+
+    async def fetch_window(self, begin: int, end: Optional[int]) -> np.ndarray:
+        # 下载[begin, end)内的K线，end为None表示直到最新
+        page_lst = []
+        since = begin
+        while True:
+            page = await self.fetch_page(since)
+            if end is not None:
+                page = [row for row in page if row[0] < end]
+            page_lst.append(rows_to_array(page))
+            if len(page) < self.page_limit:  # 窗口结束（被end截断）或者没有更多数据
+                break
+            if end is not None and page[-1][0] + TIMEFRAME_MS[self.timeframe] >= end:  # 下一根已经在窗口之外，省掉一次请求
+                break
+            since = int(page[-1][0]) + 1
+        return merge_ohlcv(*page_lst)
+
+    def split_window(self, since: int, until: Optional[int]) -> List[tuple]:
+        if until is None:
+            return [(since, None)]
+        window_ms = TIMEFRAME_MS[self.timeframe] * self.page_limit
+        res = [(begin, min(begin + window_ms, until)) for begin in range(since, until, window_ms)]
+        if res:
+            res[-1] = (res[-1][0], None)  # 最后一个窗口下载到最新，不漏掉until之后才走完的K线
+        return res
+
+    async def download(self, since: int, until: Optional[int] = None) -> np.ndarray:
+        # since/until为毫秒时间戳，until为None时只能串行翻页
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch(begin, end):
+            async with semaphore:
+                return await self.fetch_window(begin, end)
+        res = await asyncio.gather(*[fetch(begin, end) for begin, end in self.split_window(since, until)])
+        return merge_ohlcv(*res)
+
+    def now_ms(self) -> int:
+        if hasattr(self.exchange, 'milliseconds'):
+            return int(self.exchange.milliseconds())
+        return int(time.time() * 1000)
+
+    async def download_latest(self, bar_cnt: int) -> np.ndarray:
+        # 最近bar_cnt根K线（按时间推算起点，停牌等原因可能不足bar_cnt根）
+        until = self.now_ms()
+        return await self.download(until - bar_cnt * TIMEFRAME_MS[self.timeframe], until)
+
+
+class COhlcvCache:
+    # 列式缓存：path目录下每列一个<列名>.bin，内容为原始int64/float64数组
+    def __init__(self, path):
+        self.path = path
+
+    def column_path(self, col) -> str:
+        return os.path.join(self.path, f"{col}.bin")
+
+    def exists(self) -> bool:
+        return all(os.path.exists(self.column_path(col)) for col in OHLCV_COLUMNS)
+
+    def __len__(self):
+        if not self.exists():
+            return 0
+        # 追加中途被打断时各列长度可能不一致，以最短的为准
+        return min(os.path.getsize(self.column_path(col)) // OHLCV_DTYPE[col].itemsize for col in OHLCV_COLUMNS)
+
+    def load(self) -> np.ndarray:
+        cnt = len(self)
+        res = np.zeros(cnt, dtype=OHLCV_DTYPE)
+        if cnt == 0:
+            return res
+        for col in OHLCV_COLUMNS:
+            res[col] = np.fromfile(self.column_path(col), dtype=OHLCV_DTYPE[col], count=cnt)
+        return res
+
+    def last_timestamp(self) -> Optional[int]:
+        cnt = len(self)
+        if cnt == 0:
+            return None
+        with open(self.column_path('timestamp'), 'rb') as f:
+            f.seek((cnt - 1) * OHLCV_DTYPE['timestamp'].itemsize)
+            return int(np.frombuffer(f.read(OHLCV_DTYPE['timestamp'].itemsize), dtype=np.int64)[0])
+
+    def append(self, data: np.ndarray):
+        # data按时间排序；缓存中时间戳>=data第一根的部分被data覆盖，只需要读缓存的尾部
+        if len(data) == 0:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        cnt = len(self)
+        keep_cnt = cnt
+        last_ts = self.last_timestamp()
+        if last_ts is not None and data['timestamp'][0] <= last_ts:
+            ts = np.fromfile(self.column_path('timestamp'), dtype=np.int64, count=cnt)
+            keep_cnt = int(np.searchsorted(ts, data['timestamp'][0], side='left'))
+            old_tail = np.zeros(cnt - keep_cnt, dtype=OHLCV_DTYPE)
+            for col in OHLCV_COLUMNS:  # 被覆盖的部分里可能有data中没有的K线，合并后再写回
+                itemsize = OHLCV_DTYPE[col].itemsize
+                old_tail[col] = np.fromfile(self.column_path(col), dtype=OHLCV_DTYPE[col], count=cnt - keep_cnt, offset=keep_cnt * itemsize)
+            data = merge_ohlcv(old_tail, data)
+        for col in OHLCV_COLUMNS:
+            with open(self.column_path(col), 'r+b' if os.path.exists(self.column_path(col)) else 'wb') as f:
+                f.truncate(keep_cnt * OHLCV_DTYPE[col].itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(data[col]).tobytes())
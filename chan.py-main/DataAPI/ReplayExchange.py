@@ -0,0 +1,75 @@
+import asyncio
+import bisect
+import time
+from typing import List, Optional
+
+# 本地回放的ccxt风格交易所，接口同ccxt.pro的fetch_ohlcv/watch_ohlcv，用于测试StreamAPI.CCcxtStream和ChanStream.CChanStreamer
+# 前history_cnt根K线作为已有历史，之后每次watch_ohlcv推进一个tick：每根K线先推送ticks_per_bar-1次没走完的值，最后一次是最终值
+# publish_time记录每个tick推送的时间（time.perf_counter），用来统计从K线走完到计算完成的延迟
+# 也可以当作历史数据接口测试HistoryDownloader.CHistoryDownloader：latency模拟每次请求的网络延迟，request_cnt统计请求次数
+
+
+class CReplayExchange:
+    def __init__(self, ohlcv: List[list], history_cnt=0, ticks_per_bar=1, interval=0.0, latency=0.0):
+        self.ohlcv = [list(row) for row in ohlcv]
+        self.ts_lst = [row[0] for row in self.ohlcv]
+        self.ticks_per_bar = ticks_per_bar
+        self.interval = interval  # 每个tick之间等待的秒数
+        self.bar_idx = history_cnt  # 正在推送的K线
+        self.tick = 0  # 当前K线已经推送的次数
+        self.finished = history_cnt >= len(self.ohlcv)
+        self.publish_time: List[float] = []  # 每根K线最终值的推送时间
+        self.latency = latency
+        self.request_cnt = 0
+
+    def partial_row(self, row: list, tick: int) -> list:
+        # 第tick次（从1开始）推送的值：收盘价从开盘价线性走到最终收盘价，最后一次为最终值
+        if tick >= self.ticks_per_bar:
+            return list(row)
+        ratio = tick / self.ticks_per_bar
+        close = row[1] + (row[4] - row[1]) * ratio
+        return [row[0], row[1], max(row[1], close), min(row[1], close), close, row[5] * ratio]
+
+    def released_rows(self) -> List[list]:
+        res = self.ohlcv[:self.bar_idx]
+        if self.tick > 0 and self.bar_idx < len(self.ohlcv):
+            res.append(self.partial_row(self.ohlcv[self.bar_idx], self.tick))
+        return res
+
+    def milliseconds(self) -> int:
+        # 回放中的“当前时间”：最后一根已推送K线的时间戳
+        if self.tick > 0 and self.bar_idx < len(self.ohlcv):
+            return int(self.ts_lst[self.bar_idx])
+        return int(self.ts_lst[self.bar_idx - 1]) if self.bar_idx > 0 else 0
+
+    async def fetch_ohlcv(self, symbol: str, timeframe: str, since: Optional[int] = None, limit: Optional[int] = None, params=None) -> List[list]:
+        self.request_cnt += 1
+        await asyncio.sleep(self.latency)
+        if since is not None:
+            begin = bisect.bisect_left(self.ts_lst, since, hi=self.bar_idx)
+            end = self.bar_idx if limit is None else min(self.bar_idx, begin + limit)
+            rows = [list(row) for row in self.ohlcv[begin:end]]
+            if end == self.bar_idx and (limit is None or len(rows) < limit) and self.tick > 0 and self.bar_idx < len(self.ohlcv):
+                rows.append(self.partial_row(self.ohlcv[self.bar_idx], self.tick))
+            return rows
+        rows = self.released_rows()
+        return rows[-limit:] if limit is not None else rows
+
+    async def watch_ohlcv(self, symbol: str, timeframe: str, since: Optional[int] = None, limit: Optional[int] = None, params=None) -> List[list]:
+        if self.finished:
+            return []
+        if self.interval > 0:
+            await asyncio.sleep(self.interval)
+        else:
+            await asyncio.sleep(0)
+        self.tick += 1
+        row = self.partial_row(self.ohlcv[self.bar_idx], self.tick)
+        if self.tick >= self.ticks_per_bar:
+            self.publish_time.append(time.perf_counter())
+            self.bar_idx += 1
+            self.tick = 0
+            self.finished = self.bar_idx >= len(self.ohlcv)
+        return [row]
+
+    async def close(self):
+        pass
@@ -0,0 +1,212 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+from Common.CEnum import AUTYPE, DATA_SRC, KL_TYPE, TRADE_INFO_LST
+from Common.ChanException import CChanException, ErrCode
+from Common.CTime import CTime, civil_from_days
+from Common.func_util import check_kltype_order
+from KLine.KLine_Unit import CKLine_Unit
+from KLine.TradeInfo import CTradeInfo
+
+from .CommonStockAPI import CCommonStockApi
+
+# 只从数据源拉取一个基础级别（如1分钟/5分钟），其他级别在本地合成，每个级别不再单独请求数据源
+# 合成的父级别K线时间一定不早于它包含的所有次级别K线，各级别之间不会出现对不齐的告警
+# K线时间约定：
+# - 有交易时段的市场（如A股）：输入输出都是K线结束时间，分钟级别按交易时间切分（A股60M为10:30/11:30/14:00/15:00）
+# - 24小时市场（如数字货币）：输入默认是开盘时间（同DataAPI/ccxt.py），输出为K线内最后一分钟的时间
+#   （1分钟线即开盘时间，60M线为xx:59），这样跨零点的最后一根也落在当天，和日线（当天日期）对齐
+# - 日线及以上：当天日期（auto=True），周/月/季/年线为周期内最后一个有数据的日期
+# 不支持跨零点的夜盘时段
+
+KL_MINUTES = {
+    KL_TYPE.K_1M: 1, KL_TYPE.K_3M: 3, KL_TYPE.K_5M: 5,
+    KL_TYPE.K_15M: 15, KL_TYPE.K_30M: 30, KL_TYPE.K_60M: 60,
+}
+
+
+def parse_clock(s: str) -> int:
+    # "09:30" -> 570
+    hour, minute = s.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+class CSession:
+    def __init__(self, segments: Optional[List[Tuple[str, str]]] = None, base_label: str = 'end'):
+        # segments: 交易时段，如[("09:30", "11:30"), ("13:00", "15:00")]，None表示24小时连续交易
+        # base_label: 输入K线的时间是开盘时间(begin)还是结束时间(end)
+        if base_label not in ('begin', 'end'):
+            raise CChanException(f"unknown base_label: {base_label}", ErrCode.PARA_ERROR)
+        self.base_label = base_label
+        self.segments: Optional[List[Tuple[int, int]]] = None
+        if segments is not None:
+            self.segments = [(parse_clock(begin), parse_clock(end)) for begin, end in segments]
+            if any(begin >= end for begin, end in self.segments) or any(self.segments[i][1] > self.segments[i+1][0] for i in range(len(self.segments) - 1)):
+                raise CChanException(f"invalid session segments: {segments}", ErrCode.PARA_ERROR)
+            self.total = sum(end - begin for begin, end in self.segments)
+            self.elapsed_lst = [self.cal_elapsed(minute) for minute in range(24 * 60 + 1)]
+
+    def cal_elapsed(self, minute: int) -> int:
+        # 从第一个时段开盘到minute经过的交易分钟数，时段之外的时间按最近的时段边界算
+        res = 0
+        for begin, end in self.segments:
+            if minute <= begin:
+                break
+            res += min(minute, end) - begin
+        return res
+
+    def bucket_idx(self, end_minute: int, n: int) -> int:
+        # 结束于end_minute的K线属于当天第几根（从1开始）n分钟K线，集合竞价/收盘后的K线并入第一根/最后一根
+        elapsed = self.elapsed_lst[end_minute]
+        return min(max(1, -(-elapsed // n)), -(-self.total // n))
+
+    def bucket_end(self, idx: int, n: int) -> int:
+        # 第idx根n分钟K线的结束时间（当天分钟数），正好是时段收盘的算在该时段内
+        elapsed = min(idx * n, self.total)
+        for begin, end in self.segments:
+            if elapsed <= end - begin:
+                return begin + elapsed
+            elapsed -= end - begin
+        return self.segments[-1][1]
+
+
+SESSION_24X7 = CSession(None, base_label='begin')
+SESSION_CN_STOCK = CSession([("09:30", "11:30"), ("13:00", "15:00")], base_label='end')
+
+
+class CKLineResampler:
+    # 增量合成：每次add一根基础级别K线，所属周期变化时返回上一根已经走完的K线
+    # get_cur_klu返回当前还没走完的K线（每次都是新对象），可以配合CChan.update_last_klu用于实时行情
+    def __init__(self, k_type: KL_TYPE, base_type: KL_TYPE, session: CSession = SESSION_24X7):
+        check_kltype_order([k_type, base_type] if k_type != base_type else [k_type])
+        if base_type not in KL_MINUTES and k_type in KL_MINUTES:
+            raise CChanException(f"can not resample {base_type} to {k_type}", ErrCode.PARA_ERROR)
+        if k_type in KL_MINUTES and KL_MINUTES[k_type] % KL_MINUTES[base_type] != 0:
+            raise CChanException(f"{k_type} is not a multiple of {base_type}", ErrCode.PARA_ERROR)
+        self.k_type = k_type
+        self.base_type = base_type
+        self.session = session
+        self.minutes = KL_MINUTES.get(k_type)  # None表示日线及以上
+        self.base_minutes = KL_MINUTES.get(base_type)
+
+        self.key = None  # 当前K线所属周期
+        self.label: Tuple[int, bool] = (0, False)  # 当前K线的(展示时间戳, auto)
+        self._open = self.high = self.low = self.close = 0.0
+        self.trade_info: Dict[str, Optional[float]] = {}
+
+    def get_bucket(self, klu: CKLine_Unit) -> Tuple[Union[int, tuple], Tuple[int, bool]]:
+        disp_ts = klu.time.disp_ts
+        if self.base_minutes is None:
+            day = disp_ts // 86400
+        elif self.session.segments is None:
+            open_ts = disp_ts if self.session.base_label == 'begin' else disp_ts - self.base_minutes * 60
+            if self.minutes is not None:
+                key = open_ts // (self.minutes * 60)
+                return key, ((key + 1) * self.minutes * 60 - 60, False)
+            day = open_ts // 86400
+        else:
+            end_ts = disp_ts if self.session.base_label == 'end' else disp_ts + self.base_minutes * 60
+            day = end_ts // 86400
+            if self.minutes is not None:
+                idx = self.session.bucket_idx(end_ts % 86400 // 60, self.minutes)
+                return (day, idx), (day * 86400 + self.session.bucket_end(idx, self.minutes) * 60, False)
+        label = (day * 86400, True)
+        if self.k_type == KL_TYPE.K_DAY:
+            return day, label
+        if self.k_type == KL_TYPE.K_WEEK:
+            return (day + 3) // 7, label  # 1970-01-01是周四，按周一开始分周
+        year, month, _ = civil_from_days(day)
+        if self.k_type == KL_TYPE.K_MON:
+            return year * 12 + month, label
+        if self.k_type == KL_TYPE.K_QUARTER:
+            return year * 4 + (month - 1) // 3, label
+        return year, label
+
+    def add(self, klu: CKLine_Unit) -> Optional[CKLine_Unit]:
+        key, label = self.get_bucket(klu)
+        res = None
+        if self.key is not None and key != self.key:
+            if key < self.key:
+                raise CChanException(f"kline time err, cur={klu.time}, last={self.get_cur_klu().time}", ErrCode.KL_NOT_MONOTONOUS)
+            res = self.get_cur_klu()
+            self.key = None
+        if self.key is None:
+            self.key = key
+            self._open, self.high, self.low, self.close = klu.open, klu.high, klu.low, klu.close
+            self.trade_info = dict(klu.trade_info.metric)
+        else:
+            self.high = max(self.high, klu.high)
+            self.low = min(self.low, klu.low)
+            self.close = klu.close
+            for metric in TRADE_INFO_LST:  # 成交量、成交额、换手率都是周期内求和
+                value = klu.trade_info.metric.get(metric)
+                if value is not None:
+                    cur_value = self.trade_info.get(metric)
+                    self.trade_info[metric] = value if cur_value is None else cur_value + value
+        self.label = label  # 日线以上为最后一个有数据的日期
+        return res
+
+    def get_cur_klu(self) -> Optional[CKLine_Unit]:
+        if self.key is None:
+            return None
+        disp_ts, auto = self.label
+        return CKLine_Unit.from_value(CTime.from_ts(disp_ts, auto=auto), self._open, self.high, self.low, self.close, CTradeInfo(self.trade_info))
+
+    def flush(self) -> Optional[CKLine_Unit]:
+        # 数据结束，返回最后一根（可能没走完）
+        res = self.get_cur_klu()
+        self.key = None
+        return res
+
+
+class CResampleAPI(CCommonStockApi):
+    # DATA_SRC.RESAMPLE：先通过set_base设置基础级别的数据源，CChan的每个级别都由同一份基础级别数据合成
+    # 同一次加载的各级别共用一份基础数据，只请求数据源一次
+    base_src: Union[DATA_SRC, str] = DATA_SRC.CSV
+    base_lv: KL_TYPE = KL_TYPE.K_5M
+    session: CSession = SESSION_24X7
+    base_cache: Optional[tuple] = None  # ((code, begin, end, autype), 基础级别K线列表)，只保留最近一只股票
+
+    def __init__(self, code, k_type=KL_TYPE.K_DAY, begin_date=None, end_date=None, autype=AUTYPE.QFQ):
+        super(CResampleAPI, self).__init__(code, k_type, begin_date, end_date, autype)
+
+    @classmethod
+    def set_base(cls, data_src: Union[DATA_SRC, str], base_lv: KL_TYPE, session: Optional[CSession] = None):
+        cls.base_src = data_src
+        cls.base_lv = base_lv
+        if session is not None:
+            cls.session = session
+        cls.base_cache = None
+
+    @classmethod
+    def get_base_cls(cls):
+        from Chan import get_stock_api_cls
+        return get_stock_api_cls(cls.base_src)
+
+    def load_base(self) -> List[CKLine_Unit]:
+        key = (self.code, self.begin_date, self.end_date, self.autype)
+        if self.base_cache is None or self.base_cache[0] != key:
+            base_api = self.get_base_cls()(code=self.code, k_type=self.base_lv, begin_date=self.begin_date, end_date=self.end_date, autype=self.autype)
+            CResampleAPI.base_cache = (key, list(base_api.get_kl_data()))
+        return self.base_cache[1]
+
+    def get_kl_data(self):
+        resampler = CKLineResampler(self.k_type, self.base_lv, self.session)
+        for klu in self.load_base():
+            finished_klu = resampler.add(klu)
+            if finished_klu is not None:
+                yield finished_klu
+        last_klu = resampler.flush()
+        if last_klu is not None:
+            yield last_klu
+
+    def SetBasciInfo(self):
+        pass
+
+    @classmethod
+    def do_init(cls):
+        cls.get_base_cls().do_init()
+
+    @classmethod
+    def do_close(cls):
+        CResampleAPI.base_cache = None
+        cls.get_base_cls().do_close()
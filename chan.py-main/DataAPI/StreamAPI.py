@@ -0,0 +1,114 @@
+import abc
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from Common.CEnum import DATA_FIELD, KL_TYPE
+from Common.ChanException import CChanException, ErrCode
+from Common.CTime import CTime
+from Common.func_util import kltype_lt_day
+from KLine.KLine_Unit import CKLine_Unit
+
+# 流式数据源：异步迭代返回(K线, 是否已走完)，一根K线走完之前会多次返回当前的最新值
+# 通常交给ChanStream.CChanStreamer持续喂给CChan，不需要像get_kl_data那样每次重新下载全部历史
+
+CCXT_TIMEFRAME = {
+    KL_TYPE.K_DAY: '1d', KL_TYPE.K_WEEK: '1w', KL_TYPE.K_MON: '1M',
+    KL_TYPE.K_1M: '1m', KL_TYPE.K_3M: '3m', KL_TYPE.K_5M: '5m', KL_TYPE.K_15M: '15m',
+    KL_TYPE.K_30M: '30m', KL_TYPE.K_60M: '1h',
+}
+
+
+def ohlcv_to_klu(row: list, k_type: KL_TYPE) -> CKLine_Unit:
+    # ccxt格式：[毫秒时间戳, open, high, low, close, volume]，时间处理同DataAPI/ccxt.py
+    dt = datetime.fromtimestamp(row[0] / 1000)
+    return CKLine_Unit({
+        DATA_FIELD.FIELD_TIME: CTime(dt.year, dt.month, dt.day, dt.hour, dt.minute, auto=not kltype_lt_day(k_type)),
+        DATA_FIELD.FIELD_OPEN: float(row[1]),
+        DATA_FIELD.FIELD_HIGH: float(row[2]),
+        DATA_FIELD.FIELD_LOW: float(row[3]),
+        DATA_FIELD.FIELD_CLOSE: float(row[4]),
+        DATA_FIELD.FIELD_VOLUME: float(row[5] or 0.0),
+    }, autofix=True)
+
+
+class CCommonStreamApi:
+    def __init__(self, code, k_type: KL_TYPE):
+        self.code = code
+        self.k_type = k_type
+
+    @abc.abstractmethod
+    def stream(self) -> AsyncIterator[Tuple[CKLine_Unit, bool]]:
+        # 异步生成器，按时间顺序返回(klu, is_closed)；同一根K线可以多次返回，最后一次的值为准
+        pass
+
+    async def close(self):
+        pass
+
+
+class CCcxtStream(CCommonStreamApi):
+    # exchange为ccxt.pro/ccxt.async_support的交易所实例（或者ReplayExchange.CReplayExchange）
+    # 先拉一页历史，之后有watch_ohlcv（websocket推送）时用推送，否则每poll_interval秒调用一次fetch_ohlcv
+    # 某根K线之后出现了更晚的K线，才认为它已经走完
+    def __init__(self, code, k_type: KL_TYPE, exchange, since: Optional[int] = None, history_limit=1000, poll_interval=1.0, max_retry=3, retry_interval=2.0):
+        super(CCcxtStream, self).__init__(code, k_type)
+        self.exchange = exchange
+        self.timeframe = CCXT_TIMEFRAME[k_type]
+        self.since = since  # 毫秒时间戳，None表示只要最近history_limit根
+        self.history_limit = history_limit
+        self.poll_interval = poll_interval
+        self.max_retry = max_retry
+        self.retry_interval = retry_interval
+
+    async def request(self, method: str, **kwargs) -> List[list]:
+        for i in range(self.max_retry):
+            try:
+                return await getattr(self.exchange, method)(self.code, self.timeframe, **kwargs)
+            except Exception as e:
+                if i == self.max_retry - 1:
+                    raise CChanException(f"{method} {self.code} {self.timeframe} failed: {e}", ErrCode.SRC_DATA_NOT_FOUND) from e
+                print(f"网络波动，第 {i+1} 次重试... ({e})")
+                await asyncio.sleep(self.retry_interval)
+        return []
+
+    async def fetch_history(self) -> List[list]:
+        if self.since is None:
+            return await self.request('fetch_ohlcv', limit=self.history_limit)
+        res: List[list] = []
+        since = self.since
+        while True:
+            page = await self.request('fetch_ohlcv', since=since, limit=self.history_limit)
+            res.extend(page)
+            if len(page) < self.history_limit:
+                return res
+            since = page[-1][0] + 1
+
+    async def iter_batches(self) -> AsyncIterator[List[list]]:
+        yield await self.fetch_history()
+        watch = getattr(self.exchange, 'watch_ohlcv', None)
+        while not getattr(self.exchange, 'finished', False):  # finished: 回放结束，真实交易所没有这个属性
+            if watch is not None:
+                yield await self.request('watch_ohlcv')
+            else:
+                await asyncio.sleep(self.poll_interval)
+                yield await self.request('fetch_ohlcv', limit=2)  # 上一根刚走完时，它的最终值和新K线一起返回
+
+    async def stream(self) -> AsyncIterator[Tuple[CKLine_Unit, bool]]:
+        open_row: Optional[list] = None  # 还没走完的最后一根K线
+        async for batch in self.iter_batches():
+            changed = False
+            for row in sorted(batch, key=lambda r: r[0]):
+                if open_row is not None and row[0] < open_row[0]:
+                    continue
+                if open_row is not None and row[0] > open_row[0]:
+                    yield ohlcv_to_klu(open_row, self.k_type), True
+                elif open_row is not None and list(row) == open_row:
+                    continue
+                open_row = list(row)
+                changed = True
+            if changed and open_row is not None:
+                yield ohlcv_to_klu(open_row, self.k_type), False
+
+    async def close(self):
+        if hasattr(self.exchange, 'close'):
+            await self.exchange.close()
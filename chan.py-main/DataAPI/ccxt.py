@@ -1,6 +1,6 @@
+import asyncio
 import os
-import ccxt
-import time
+import ccxt.async_support as ccxt_async
 import pandas as pd
 from datetime import datetime
 from Common.CEnum import AUTYPE, DATA_FIELD, KL_TYPE
@@ -8,6 +8,7 @@ from Common.CTime import CTime
 from Common.func_util import kltype_lt_day, str2float
 from KLine.KLine_Unit import CKLine_Unit
 from .CommonStockAPI import CCommonStockApi
+from .HistoryDownloader import OHLCV_COLUMNS, CHistoryDownloader, COhlcvCache, merge_ohlcv, rows_to_array
 
 def GetColumnNameFromFieldList(fileds: str):
     _dict = {
@@ -21,134 +22,83 @@ def GetColumnNameFromFieldList(fileds: str):
     return [_dict[x] for x in fileds.split(",")]
 
 class CCXT(CCommonStockApi):
+    target_limit = 100000  # 如果没有缓存，首次下载的数量
+    max_concurrency = 8  # 同时下载的时间窗口数
+    rate = 10.0  # 每秒最多请求次数
+
     def __init__(self, code, k_type=KL_TYPE.K_DAY, begin_date=None, end_date=None, autype=AUTYPE.QFQ):
         super(CCXT, self).__init__(code, k_type, begin_date, end_date, autype)
 
     def get_kl_data(self):
         fields = "time,open,high,low,close,volume"
-        
+
         # === 代理配置 ===
         my_proxies = {
-            'http': 'http://127.0.0.1:10809', 
+            'http': 'http://127.0.0.1:10809',
             'https': 'http://127.0.0.1:10809',
         }
-        
-        exchange = ccxt.binance({
-            'proxies': my_proxies,
+
+        exchange = ccxt_async.binance({
+            'aiohttp_proxy': my_proxies['https'],
             'timeout': 30000,
-            'enableRateLimit': True,
+            'enableRateLimit': False,  # 由CHistoryDownloader的令牌桶统一限速
         })
 
         timeframe = self.__convert_type()
-        
-        # --- 缓存文件路径 ---
-        # 例如: BTC_USDT_5m.csv
+
+        # --- 缓存路径 ---
+        # 例如: BTC_USDT_5m/ 目录，每列一个二进制文件；旧版本的 BTC_USDT_5m.csv 缓存第一次运行时自动导入
         safe_code = self.code.replace('/', '_')
-        cache_file = f"{safe_code}_{timeframe}.csv"
-        
-        # 1. 读取本地缓存
-        cached_data = []
-        last_timestamp = None
-        
-        if os.path.exists(cache_file):
-            try:
-                # 读取 CSV，不包含表头，列顺序：timestamp, open, high, low, close, volume
-                df_cache = pd.read_csv(cache_file)
-                if not df_cache.empty:
-                    # 转换为列表 [ [ts, o, h, l, c, v], ... ]
-                    cached_data = df_cache.values.tolist()
-                    last_timestamp = int(cached_data[-1][0]) # 获取最后一根K线的时间戳
-                    print(f"✅ 读取本地缓存成功：{len(cached_data)} 条 (最新时间: {datetime.fromtimestamp(last_timestamp/1000)})")
-            except Exception as e:
-                print(f"⚠️ 缓存读取失败，将重新下载: {e}")
-                cached_data = []
-
-        # 2. 准备下载
-        target_limit = 100000 # 如果没有缓存，首次下载的数量
-        new_data = []
-        
-        # --- 自动重试与增量下载逻辑 ---
-        def fetch_page(since=None, params={}):
-            for i in range(3):
-                try:
-                    if since:
-                        return exchange.fetch_ohlcv(self.code, timeframe, since=since, limit=1000, params=params)
-                    else:
-                        return exchange.fetch_ohlcv(self.code, timeframe, limit=1000, params=params)
-                except Exception as e:
-                    print(f"网络波动，第 {i+1} 次重试... ({e})")
-                    time.sleep(2)
-            raise Exception("连接交易所失败")
+        cache = COhlcvCache(f"{safe_code}_{timeframe}")
+        self.import_csv_cache(cache, f"{safe_code}_{timeframe}.csv")
+
+        final_data = asyncio.run(self.sync_cache(exchange, cache, timeframe))
 
+        # 生成 K 线对象返回给主程序
+        for ts, *values in zip(final_data['timestamp'].tolist(), *[final_data[col].tolist() for col in OHLCV_COLUMNS[1:]]):
+            time_obj = datetime.fromtimestamp(ts / 1000)
+            item_data = [time_obj, *values]
+            yield CKLine_Unit(self.create_item_dict(item_data, GetColumnNameFromFieldList(fields)), autofix=True)
+
+    async def sync_cache(self, exchange, cache: COhlcvCache, timeframe: str):
         try:
-            if last_timestamp:
-                # === 增量模式：只下载比缓存更新的数据 ===
-                print(">> 正在检查新数据...")
-                # since = 最后一根时间 + 1ms，避免重复
-                current_batch = fetch_page(since=last_timestamp + 1)
-                while current_batch:
-                    new_data.extend(current_batch)
-                    print(f"   已获取新数据: {len(new_data)} 条")
-                    
-                    # 如果取满了1000条，可能还有更多，继续取
-                    if len(current_batch) < 1000:
-                        break
-                        
-                    last_ts = current_batch[-1][0]
-                    current_batch = fetch_page(since=last_ts + 1)
-                    time.sleep(0.1)
+            downloader = CHistoryDownloader(exchange, self.code, timeframe, max_concurrency=self.max_concurrency, rate=self.rate)
+            last_timestamp = cache.last_timestamp()
+            if last_timestamp is not None:
+                print(f"✅ 读取本地缓存成功：{len(cache)} 条 (最新时间: {datetime.fromtimestamp(last_timestamp/1000)})")
+            try:
+                if last_timestamp is not None:
+                    # === 增量模式：从缓存最后一根开始下载（最后一根缓存时可能还没走完，重新下载覆盖） ===
+                    print(">> 正在检查新数据...")
+                    new_data = await downloader.download(last_timestamp, downloader.now_ms())
+                else:
+                    # === 首次模式：并发下载最近 target_limit 根 ===
+                    print(f">> 本地无缓存，开始下载最近 {self.target_limit} 条数据...")
+                    new_data = (await downloader.download_latest(self.target_limit))[-self.target_limit:]
+            except Exception as e:
+                print(f"❌ 数据同步中断: {e}")
+                # 如果是增量更新失败，至少可以用旧缓存跑，不抛出异常
+                if last_timestamp is None:
+                    raise e
+                new_data = rows_to_array([])
+            if len(new_data):
+                print(f"💾 合并并保存 {len(new_data)} 条新数据到本地（请求 {downloader.request_cnt} 次）...")
+                cache.append(new_data)
             else:
-                # === 首次模式：下载最近的 target_limit 根 ===
-                print(f">> 本地无缓存，开始下载最近 {target_limit} 条数据...")
-                current_batch = fetch_page()
-                new_data = current_batch
-                
-                while len(new_data) < target_limit:
-                    if not current_batch: break
-                    first_ts = current_batch[0][0]
-                    params = {'endTime': first_ts - 1}
-                    
-                    print(f"   加载历史中... (当前 {len(new_data)}/{target_limit})")
-                    current_batch = fetch_page(params=params)
-                    if not current_batch: break
-                    
-                    new_data = current_batch + new_data
-                    time.sleep(0.1)
-                
-                # 如果超出了，只保留最后 target_limit 条
-                if len(new_data) > target_limit:
-                    new_data = new_data[-target_limit:]
+                print(">> 没有新数据，直接使用缓存。")
+        finally:
+            await exchange.close()
+        return cache.load()
 
+    @staticmethod
+    def import_csv_cache(cache: COhlcvCache, csv_file):
+        if cache.exists() or not os.path.exists(csv_file):
+            return
+        try:
+            df_cache = pd.read_csv(csv_file)  # 列顺序：timestamp, open, high, low, close, volume
+            cache.append(merge_ohlcv(rows_to_array(df_cache.values)))
         except Exception as e:
-            print(f"❌ 数据同步中断: {e}")
-            # 如果是增量更新失败，至少可以用旧缓存跑，不抛出异常
-            if not cached_data:
-                raise e
-
-        # 3. 合并与去重
-        if new_data:
-            print(f"💾 合并并保存 {len(new_data)} 条新数据到本地...")
-            total_data = cached_data + new_data
-            
-            # 使用字典去重 (以时间戳为key)，防止重叠
-            data_dict = {x[0]: x for x in total_data}
-            # 按时间排序
-            sorted_data = sorted(data_dict.values(), key=lambda x: x[0])
-            
-            # 保存回 CSV
-            df_save = pd.DataFrame(sorted_data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df_save.to_csv(cache_file, index=False)
-            
-            final_data = sorted_data
-        else:
-            print(">> 没有新数据，直接使用缓存。")
-            final_data = cached_data
-
-        # 4. 生成 K 线对象返回给主程序
-        for item in final_data:
-            time_obj = datetime.fromtimestamp(item[0] / 1000)
-            item_data = [time_obj, item[1], item[2], item[3], item[4], item[5]]
-            yield CKLine_Unit(self.create_item_dict(item_data, GetColumnNameFromFieldList(fields)), autofix=True)
+            print(f"⚠️ 缓存读取失败，将重新下载: {e}")
 
     def SetBasciInfo(self): pass
     @classmethod
@@ -1,13 +1,30 @@
 import os
+import re
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
 from Common.CEnum import DATA_FIELD, KL_TYPE
 from Common.ChanException import CChanException, ErrCode
-from Common.CTime import CTime
+from Common.CTime import MONTH_DAYS, CTime, days_from_civil
 from Common.func_util import str2float
 from KLine.KLine_Unit import CKLine_Unit
 
 from .CommonStockAPI import CCommonStockApi
 
+CHUNK_SIZE = 1 << 22  # 每次从文件读取4MB，按块整体切分、转换，不逐行解析
+
+# 时间统一转成整数YYYYMMDDHHMM（time_key），单调递增，用于二分查找begin/end以及二进制缓存
+# 定长时间格式：长度 -> 年、月、日、(时、分)在字符串中的位置
+_FIXED_TIME_FORMAT: Dict[int, Tuple[Tuple[int, int], ...]] = {
+    10: ((0, 4), (5, 7), (8, 10)),  # 2023/01/02
+    16: ((0, 4), (5, 7), (8, 10), (11, 13), (14, 16)),  # 2023/01/02 09:30
+    17: ((0, 4), (4, 6), (6, 8), (8, 10), (10, 12)),  # 20230102093000000
+    19: ((0, 4), (5, 7), (8, 10), (11, 13), (14, 16)),  # 2023/01/02 09:30:00
+}
+_TIME_KEY_WEIGHT = (10**8, 10**6, 10**4, 10**2, 1)
+
 
 def create_item_dict(data, column_name):
     for i in range(len(data)):
@@ -59,12 +76,154 @@ def parse_time_column(inp):
         minute = int(inp[14:16])
     else:
         raise Exception(f"unknown time column from csv: {inp}")
-    
+
     # 注意这里也加了 auto=False
     return CTime(year, month, day, hour, minute, auto=False)
 
 
+def parse_time_key(inp: str, is_end=False) -> int:
+    # begin_date/end_date转成time_key，支持2023-01-02、2023/01/02 09:30、20230102等写法
+    # 只有日期时，end_date包含当天所有K线
+    num_lst = re.findall(r"\d+", str(inp))
+    if len(num_lst) == 1 and len(num_lst[0]) >= 8:
+        s = num_lst[0]
+        num_lst = [s[:4], s[4:6], s[6:8]] + [s[i:i+2] for i in range(8, min(len(s), 12), 2)]
+    if len(num_lst) < 3:
+        raise CChanException(f"unknown date format: {inp}", ErrCode.PARA_ERROR)
+    year, month, day = int(num_lst[0]), int(num_lst[1]), int(num_lst[2])
+    if len(num_lst) >= 5:
+        hour, minute = int(num_lst[3]), int(num_lst[4])
+    else:
+        hour, minute = (23, 59) if is_end else (0, 0)
+    return year * 10**8 + month * 10**6 + day * 10**4 + hour * 100 + minute
+
+
+def ctime_to_time_key(t: CTime) -> int:
+    year, month, day, hour, minute, _ = t.get_fields()
+    return year * 10**8 + month * 10**6 + day * 10**4 + hour * 100 + minute
+
+
+def time_key_to_ts(time_key: np.ndarray) -> np.ndarray:
+    # time_key(YYYYMMDDHHMM)数组 -> CTime.from_ts需要的整数时间戳，非法日期（如2月30日）同CTime抛ValueError
+    year, month, day = time_key // 10**8, time_key // 10**6 % 100, time_key // 10**4 % 100
+    month_days = np.array(MONTH_DAYS)[np.clip(month, 0, 12)] + ((month == 2) & (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0)))
+    invalid = (month < 1) | (month > 12) | (day < 1) | (day > month_days) | (time_key // 100 % 100 >= 24) | (time_key % 100 >= 60)
+    if invalid.any():
+        raise ValueError(f"invalid time: {time_key[invalid][0]}")
+    days = days_from_civil(year, month, day)
+    return days * 86400 + time_key // 100 % 100 * 3600 + time_key % 100 * 60
+
+
+def parse_time_key_chunk(time_lst: List[bytes]) -> np.ndarray:
+    # 定长格式整块向量化解析，否则逐行走parse_time_column
+    length = len(time_lst[0])
+    fmt = _FIXED_TIME_FORMAT.get(length)
+    raw = np.array(time_lst)
+    if fmt is not None and raw.dtype.itemsize == length and (np.char.str_len(raw) == length).all():
+        digits = raw.view(np.uint8).reshape(-1, length).astype(np.int64) - ord("0")
+        digit_pos = [i for begin, end in fmt for i in range(begin, end)]
+        if ((digits[:, digit_pos] >= 0) & (digits[:, digit_pos] <= 9)).all():
+            res = np.zeros(len(time_lst), dtype=np.int64)
+            for (begin, end), weight in zip(fmt, _TIME_KEY_WEIGHT):
+                for i in range(begin, end):
+                    res += digits[:, i] * (weight * 10 ** (end - 1 - i))
+            return res
+    res_lst = []
+    for t in time_lst:
+        ctime = parse_time_column(t.decode())
+        year, month, day, hour, minute, _ = ctime.get_fields()
+        res_lst.append(year * 10**8 + month * 10**6 + day * 10**4 + hour * 100 + minute)
+    return np.array(res_lst, dtype=np.int64)
+
+
+def parse_float_chunk(value_lst: List[bytes]) -> np.ndarray:
+    try:
+        return np.array(value_lst).astype(np.float64)
+    except ValueError:  # 有空值或非法值，逐个转换，非法值为0
+        return np.array([str2float(v.decode()) for v in value_lst], dtype=np.float64)
+
+
+def iter_file_chunk(file_path, chunk_size=CHUNK_SIZE):
+    # 按块读取，每块在最后一个换行处截断，剩下的拼到下一块
+    rest = b""
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            block = rest + block
+            pos = block.rfind(b"\n")
+            if pos < 0:
+                rest = block
+                continue
+            rest = block[pos+1:]
+            yield block[:pos]
+    if rest:
+        yield rest
+
+
+def check_column_cnt(chunk: bytes, col_cnt: int) -> bool:
+    # 每一行的逗号个数都必须是col_cnt-1
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    comma_cnt = np.cumsum(buf == ord(","))
+    line_end = np.append(np.flatnonzero(buf == ord("\n")), len(buf) - 1)
+    return bool((np.diff(comma_cnt[line_end], prepend=0) == col_cnt - 1).all())
+
+
+def get_columns_dtype(columns: List[DATA_FIELD]) -> np.dtype:
+    return np.dtype([(col, np.int64 if col == DATA_FIELD.FIELD_TIME else np.float64) for col in columns])
+
+
+def load_csv_columns(file_path, columns: List[DATA_FIELD], headers_exist=True, chunk_size=CHUNK_SIZE) -> np.ndarray:
+    # 读取整个csv，返回结构化数组，时间列为time_key，其他列为float64
+    chunk_res = []
+    col_cnt = len(columns)
+    for chunk in iter_file_chunk(file_path, chunk_size):
+        chunk = chunk.replace(b"\r", b"")
+        if headers_exist and len(chunk_res) == 0:
+            chunk = chunk[chunk.find(b"\n")+1:] if chunk.find(b"\n") >= 0 else b""
+            if len(chunk) == 0:
+                chunk_res.append(np.zeros(0, dtype=get_columns_dtype(columns)))
+                continue
+        if not check_column_cnt(chunk, col_cnt):
+            raise CChanException(f"file format error: {file_path}", ErrCode.SRC_DATA_FORMAT_ERROR)
+        tokens = chunk.replace(b"\n", b",").split(b",")
+        arr = np.zeros(len(tokens) // col_cnt, dtype=get_columns_dtype(columns))
+        for col_idx, col in enumerate(columns):
+            value_lst = tokens[col_idx::col_cnt]
+            arr[col] = parse_time_key_chunk(value_lst) if col == DATA_FIELD.FIELD_TIME else parse_float_chunk(value_lst)
+        chunk_res.append(arr)
+    if len(chunk_res) == 0:
+        return np.zeros(0, dtype=get_columns_dtype(columns))
+    return np.concatenate(chunk_res)
+
+
+def get_binary_cache_path(file_path) -> str:
+    return f"{os.path.splitext(file_path)[0]}.npy"
+
+
+def load_binary_cache(file_path, columns: List[DATA_FIELD]) -> Optional[np.ndarray]:
+    # csv修改时间晚于缓存，或列不一致时视为失效
+    cache_path = get_binary_cache_path(file_path)
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(file_path):
+        return None
+    data = np.load(cache_path, mmap_mode='r')
+    if data.dtype != get_columns_dtype(columns):
+        return None
+    return data
+
+
+def save_binary_cache(file_path, data: np.ndarray):
+    cache_path = get_binary_cache_path(file_path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, data)
+    os.replace(tmp_path, cache_path)
+
+
 class CSV_API(CCommonStockApi):
+    use_binary_cache = False  # 为True时第一次读取csv后在同目录下生成同名.npy，之后直接mmap加载，csv更新后自动重新生成
+
     def __init__(self, code, k_type=KL_TYPE.K_DAY, begin_date=None, end_date=None, autype=None):
         self.headers_exist = True  # 第一行是否是标题，如果是数据，设置为False
         self.columns = [
@@ -80,26 +239,46 @@ class CSV_API(CCommonStockApi):
         self.time_column_idx = self.columns.index(DATA_FIELD.FIELD_TIME)
         super(CSV_API, self).__init__(code, k_type, begin_date, end_date, autype)
 
-    def get_kl_data(self):
+    def get_file_path(self):
         cur_path = os.path.dirname(os.path.realpath(__file__))
         k_type = self.k_type.name[2:].lower()
-        file_path = f"{cur_path}/../{self.code}_{k_type}.csv"
+        return f"{cur_path}/../{self.code}_{k_type}.csv"
+
+    def load_data(self) -> np.ndarray:
+        file_path = self.get_file_path()
         if not os.path.exists(file_path):
             raise CChanException(f"file not exist: {file_path}", ErrCode.SRC_DATA_NOT_FOUND)
+        if self.use_binary_cache:
+            data = load_binary_cache(file_path, self.columns)
+            if data is not None:
+                return data
+        data = load_csv_columns(file_path, self.columns, self.headers_exist)
+        if self.use_binary_cache:
+            save_binary_cache(file_path, data)
+        return data
 
-        for line_number, line in enumerate(open(file_path, 'r')):
-            if line_number > 50000:  # <--- 添加这行：超过3000行
-                break               # <--- 添加这行：停止读取
-            if self.headers_exist and line_number == 0:
-                continue
-            data = line.strip("\n").split(",")
-            if len(data) != len(self.columns):
-                raise CChanException(f"file format error: {file_path}", ErrCode.SRC_DATA_FORMAT_ERROR)
-            if self.begin_date is not None and data[self.time_column_idx] < self.begin_date:
-                continue
-            if self.end_date is not None and data[self.time_column_idx] > self.end_date:
-                continue
-            yield CKLine_Unit(create_item_dict(data, self.columns))
+    def get_kl_data(self):
+        data = self.load_data()
+        time_key = data[DATA_FIELD.FIELD_TIME]
+        begin, end = 0, len(data)
+        if len(time_key) > 1 and not (time_key[1:] >= time_key[:-1]).all():  # 时间无序，不能二分，逐行过滤
+            mask = np.ones(len(data), dtype=bool)
+            if self.begin_date is not None:
+                mask &= time_key >= parse_time_key(self.begin_date)
+            if self.end_date is not None:
+                mask &= time_key <= parse_time_key(self.end_date, is_end=True)
+            data = data[mask]
+        else:
+            if self.begin_date is not None:
+                begin = int(np.searchsorted(time_key, parse_time_key(self.begin_date), side='left'))
+            if self.end_date is not None:
+                end = int(np.searchsorted(time_key, parse_time_key(self.end_date, is_end=True), side='right'))
+            data = data[begin:end]
+        value_columns = [col for col in self.columns if col != DATA_FIELD.FIELD_TIME]
+        for ts, *values in zip(time_key_to_ts(np.asarray(data[DATA_FIELD.FIELD_TIME])).tolist(), *[data[col].tolist() for col in value_columns]):
+            item = dict(zip(value_columns, values))
+            item[DATA_FIELD.FIELD_TIME] = CTime.from_ts(ts, auto=False)
+            yield CKLine_Unit(item)
 
     def SetBasciInfo(self):
         pass
@@ -1,4 +1,3 @@
-import copy
 from typing import List
 
 from Chan import CChan
@@ -34,8 +33,7 @@ if __name__ == "__main__":
         "trigger_step": True,
     })
 
-    # 快照
-    chan_snapshot = CChan(
+    chan = CChan(
         code=code,
         data_src=data_src_type,
         lv_list=lv_list,
@@ -45,16 +43,17 @@ if __name__ == "__main__":
     data_src = CBaoStock(code, k_type=KL_TYPE.K_15M, begin_date=begin_time, end_date=end_time, autype=AUTYPE.QFQ)  # 获取最小级别
 
     klu_15m_lst_tmp: List[CKLine_Unit] = []  # 存储用于合成当前60M K线的15M k线
+    checkpoint = chan.checkpoint()  # 快照，只记录之后可能被修改的尾部，比deepcopy整个chan快得多
 
     for klu_15m in data_src.get_kl_data():  # 获取单根15分钟K线
         klu_15m_lst_tmp.append(klu_15m)
         klu_60m = combine_60m_klu_form_15m(klu_15m_lst_tmp)  # 合成60分钟K线
 
         """
-        拷贝一份chan_snapshot
-        如果是用序列化方式，这里可以采用pickle.load()
+        回滚到快照，撤销上一次未完成的60分钟K线
+        也可以像以前一样用copy.deepcopy(chan_snapshot)或者pickle.load()，只是更慢
         """
-        chan: CChan = copy.deepcopy(chan_snapshot)
+        chan.rollback(checkpoint)
         chan.trigger_load({KL_TYPE.K_60M: [klu_60m], KL_TYPE.K_15M: klu_15m_lst_tmp})
 
         """
@@ -68,10 +67,10 @@ if __name__ == "__main__":
 
         if len(klu_15m_lst_tmp) == 4:  # 已经完成4根15分钟K线了，说明这个最新的60分钟K线和里面的4根15分钟K线在将来不会再变化
             """
-            把当前完整chan重新保存成chan_snapshot
+            把当前完整chan重新保存成快照
             如果是序列化方式，这里可以采用pickle.dump()
             """
-            chan_snapshot = chan
+            checkpoint = chan.checkpoint()
             klu_15m_lst_tmp = []  # 清空1分钟K线，用于下一个五分钟周期的合成
 
     CBaoStock.do_close()
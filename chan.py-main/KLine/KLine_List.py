@@ -1,18 +1,21 @@
 import copy
-from typing import List, Union, overload
+from typing import List, Optional, Union, overload
 
 from Bi.Bi import CBi
 from Bi.BiList import CBiList
 from BuySellPoint.BSPointList import CBSPointList
 from ChanConfig import CChanConfig
-from Common.CEnum import KLINE_DIR, SEG_TYPE
+from Common.CEnum import CAL_STAGE, KLINE_DIR, SEG_TYPE
 from Common.ChanException import CChanException, ErrCode
+from Common.TrimmedList import CTrimmedList, first_index, trim_list
 from Seg.Seg import CSeg
 from Seg.SegConfig import CSegConfig
 from Seg.SegListComm import CSegListComm
 from ZS.ZSList import CZSList
 
 from .KLine import CKLine
+from .KLine_MetricIndex import CKLine_MetricIndex
+from .KLine_Store import CKLine_Store
 from .KLine_Unit import CKLine_Unit
 
 
@@ -48,15 +51,26 @@ class CKLine_List:
         self.seg_bs_point_lst = CBSPointList[CSeg, CSegListComm](bs_point_config=conf.seg_bs_point_conf)
 
         self.metric_model_lst = conf.GetMetricModel()
+        self.kl_store: Optional[CKLine_Store] = CKLine_Store(self.metric_model_lst) if conf.kl_columnar else None
+        self.metric_index = CKLine_MetricIndex(self.metric_model_lst)  # 笔的macd/成交量等指标的区间查询
+        self.bi_list.metric_index = self.metric_index
 
         self.step_calculation = self.need_cal_step_by_step()
+        self.batch_metric = conf.batch_metric and not self.step_calculation
+        self.metric_pending_klu: List[CKLine_Unit] = []  # 批量计算模式下还没有计算指标的K线
 
         self.last_sure_seg_start_bi_idx = -1
         self.last_sure_segseg_start_bi_idx = -1
+        self.trim_cnt = 0  # 滚动窗口模式下已经删除过历史的次数，checkpoint不能跨越删除回滚
 
     def __deepcopy__(self, memo):
         new_obj = CKLine_List(self.kl_type, self.config)
         memo[id(self)] = new_obj
+        if isinstance(self.lst, CTrimmedList):
+            new_obj.lst = CTrimmedList(offset=self.lst.offset)
+        new_obj.trim_cnt = self.trim_cnt
+        new_obj.kl_store = copy.deepcopy(self.kl_store, memo)
+        new_obj.metric_index = copy.deepcopy(self.metric_index, memo)
         for klc in self.lst:
             klus_new = []
             for klu in klc.lst:
@@ -86,6 +100,7 @@ class CKLine_List:
         new_obj.bs_point_lst = copy.deepcopy(self.bs_point_lst, memo)
         new_obj.metric_model_lst = copy.deepcopy(self.metric_model_lst, memo)
         new_obj.step_calculation = copy.deepcopy(self.step_calculation, memo)
+        new_obj.metric_pending_klu = [memo[id(klu)] for klu in self.metric_pending_klu]
         new_obj.seg_bs_point_lst = copy.deepcopy(self.seg_bs_point_lst, memo)
         return new_obj
 
@@ -102,25 +117,62 @@ class CKLine_List:
         return len(self.lst)
 
     def cal_seg_and_zs(self):
+        if self.batch_metric:
+            self.cal_metric_batch()
         if not self.step_calculation:
             self.bi_list.try_add_virtual_bi(self.lst[-1])
         self.last_sure_seg_start_bi_idx = cal_seg(self.bi_list, self.seg_list, self.last_sure_seg_start_bi_idx)
         self.zs_list.cal_bi_zs(self.bi_list, self.seg_list)
         update_zs_in_seg(self.bi_list, self.seg_list, self.zs_list)  # 计算seg的zs_lst，以及中枢的bi_in, bi_out
 
-        self.last_sure_segseg_start_bi_idx = cal_seg(self.seg_list, self.segseg_list, self.last_sure_segseg_start_bi_idx)
-        self.segzs_list.cal_bi_zs(self.seg_list, self.segseg_list)
-        update_zs_in_seg(self.seg_list, self.segseg_list, self.segzs_list)  # 计算segseg的zs_lst，以及中枢的bi_in, bi_out
+        # 线段没有变化（同样的线段对象，且包含的笔都没变）时，线段的线段、线段中枢和线段买卖点都不会变，直接跳过
+        if self.seg_list.has_change():
+            self.last_sure_segseg_start_bi_idx = cal_seg(self.seg_list, self.segseg_list, self.last_sure_segseg_start_bi_idx)
+            self.segzs_list.cal_bi_zs(self.seg_list, self.segseg_list)
+            update_zs_in_seg(self.seg_list, self.segseg_list, self.segzs_list)  # 计算segseg的zs_lst，以及中枢的bi_in, bi_out
+            self.seg_bs_point_lst.cal(self.seg_list, self.segseg_list)  # 线段线段买卖点
 
         # 计算买卖点
-        self.seg_bs_point_lst.cal(self.seg_list, self.segseg_list)  # 线段线段买卖点
         self.bs_point_lst.cal(self.bi_list, self.seg_list)  # 再算笔买卖点
 
+    def recal_from_stage(self, conf: CChanConfig, stage: CAL_STAGE):
+        # 参数扫描用：K线和笔不变，用conf中stage及之后阶段的参数从头重算，只能在非逐步模式计算完成之后调用
+        # 中间的调用顺序和cal_seg_and_zs一致
+        if stage == CAL_STAGE.KL:
+            raise CChanException("K line stage can not be recalculated in place", ErrCode.PARA_ERROR)
+        if stage == CAL_STAGE.SEG:
+            self.seg_list = get_seglist_instance(seg_config=conf.seg_conf, lv=SEG_TYPE.BI)
+            self.segseg_list = get_seglist_instance(seg_config=conf.seg_conf, lv=SEG_TYPE.SEG)
+            self.last_sure_seg_start_bi_idx = cal_seg(self.bi_list, self.seg_list, -1)
+        if stage in (CAL_STAGE.SEG, CAL_STAGE.ZS):
+            self.zs_list = CZSList(zs_config=conf.zs_conf)
+            self.segzs_list = CZSList(zs_config=conf.zs_conf)
+            reset_zs_in_seg(self.seg_list)
+            self.zs_list.cal_bi_zs(self.bi_list, self.seg_list)
+            update_zs_in_seg(self.bi_list, self.seg_list, self.zs_list)
+        if stage == CAL_STAGE.SEG:
+            self.last_sure_segseg_start_bi_idx = cal_seg(self.seg_list, self.segseg_list, -1)
+        if stage in (CAL_STAGE.SEG, CAL_STAGE.ZS):
+            reset_zs_in_seg(self.segseg_list)
+            self.segzs_list.cal_bi_zs(self.seg_list, self.segseg_list)
+            update_zs_in_seg(self.seg_list, self.segseg_list, self.segzs_list)
+        self.bs_point_lst = CBSPointList[CBi, CBiList](bs_point_config=conf.bs_point_conf)
+        self.seg_bs_point_lst = CBSPointList[CSeg, CSegListComm](bs_point_config=conf.seg_bs_point_conf)
+        self.seg_bs_point_lst.cal(self.seg_list, self.segseg_list)
+        self.bs_point_lst.cal(self.bi_list, self.seg_list)
+
     def need_cal_step_by_step(self):
         return self.config.trigger_step
 
     def add_single_klu(self, klu: CKLine_Unit):
-        klu.set_metric(self.metric_model_lst)
+        if self.kl_store is not None:
+            self.kl_store.add(klu, self.metric_model_lst, cal_metric=not self.batch_metric)
+        elif not self.batch_metric:
+            klu.set_metric(self.metric_model_lst)
+        if not self.batch_metric:
+            self.metric_index.add_klu(klu)
+        else:
+            self.metric_pending_klu.append(klu)
         if len(self.lst) == 0:
             self.lst.append(CKLine(klu, idx=0))
         else:
@@ -134,6 +186,76 @@ class CKLine_List:
             elif self.step_calculation and self.bi_list.try_add_virtual_bi(self.lst[-1], need_del_end=True):  # 这里的必要性参见issue#175
                 self.cal_seg_and_zs()
 
+    def cal_metric_batch(self):
+        # 非回放模式下指标只在计算中枢线段买卖点之前用到，所以攒到这里一次性向量化计算
+        if not self.metric_pending_klu:
+            return
+        import numpy as np
+
+        from Math.MetricBatch import cal_metric_batch, metric_items
+        klu_lst = self.metric_pending_klu
+        if self.kl_store is not None:
+            begin = self.kl_store.row(klu_lst[0].idx)
+            high = np.frombuffer(self.kl_store.high[begin:], dtype=np.float64)
+            low = np.frombuffer(self.kl_store.low[begin:], dtype=np.float64)
+            close = np.frombuffer(self.kl_store.close[begin:], dtype=np.float64)
+        else:
+            high = np.fromiter((klu.high for klu in klu_lst), dtype=np.float64, count=len(klu_lst))
+            low = np.fromiter((klu.low for klu in klu_lst), dtype=np.float64, count=len(klu_lst))
+            close = np.fromiter((klu.close for klu in klu_lst), dtype=np.float64, count=len(klu_lst))
+        metric_res = cal_metric_batch(self.metric_model_lst, [klu.idx for klu in klu_lst], high, low, close)
+        if self.kl_store is not None:
+            self.kl_store.add_metric_batch(self.metric_model_lst, metric_res)
+        else:
+            for metric_model, metric_value in zip(self.metric_model_lst, metric_res):
+                for klu, item in zip(klu_lst, metric_items(metric_model, metric_value)):
+                    klu.set_metric_item(metric_model, item)
+        self.metric_index.add_batch(klu_lst, self.metric_model_lst, metric_res)
+        self.metric_pending_klu = []
+
+    def trim_history(self, keep_seg_cnt: int) -> List[CKLine_Unit]:
+        # 滚动窗口模式：只保留最近keep_seg_cnt个确定线段和keep_seg_cnt个确定的线段的线段覆盖的部分，返回被删除的K线
+        # 笔/线段/中枢/买卖点只会从最后一个确定线段附近开始重算，更早的部分不会再被修改，删除之后结果不变
+        # 可删除的K线不少于保留的K线时才删除，摊还到每根K线是常数开销
+        if self.metric_pending_klu:
+            return []
+        seg_begin = self.seg_list.get_keep_begin(keep_seg_cnt)
+        segseg_begin = self.segseg_list.get_keep_begin(keep_seg_cnt)
+        if seg_begin is None or segseg_begin is None:
+            return []
+        seg_begin = min(seg_begin, self.segseg_list[segseg_begin].start_bi.idx - 1)
+        if seg_begin <= first_index(self.seg_list.lst):
+            return []
+        bi_begin = self.seg_list[seg_begin].start_bi.idx - 1  # 多留一笔，保留的中枢的进入笔还在
+        klc_begin = self.bi_list[bi_begin].begin_klc.idx
+        klu_begin = self.lst[klc_begin].lst[0].idx
+        if klu_begin - self.lst[first_index(self.lst)].lst[0].idx < self.lst[-1].lst[-1].idx + 1 - klu_begin:
+            return []
+
+        self.lst, removed_klc = trim_list(self.lst, klc_begin)
+        for klc in removed_klc:
+            klc.set_pre(None)
+            klc.set_next(None)
+        self.lst[klc_begin].set_pre(None)
+        removed_klu = [klu for klc in removed_klc for klu in klc.lst]
+        for klu in removed_klu:
+            klu.release_store()
+            klu.pre = klu.next = None
+        self.lst[klc_begin].lst[0].pre = None
+        if self.kl_store is not None:
+            self.kl_store.trim_before(klu_begin)
+        self.metric_index.trim_before(klu_begin)
+
+        self.bi_list.trim_before(bi_begin)
+        self.seg_list.trim_before(seg_begin)
+        self.segseg_list.trim_before(segseg_begin)
+        self.zs_list.trim_before(bi_begin)
+        self.segzs_list.trim_before(seg_begin)
+        self.bs_point_lst.trim_before(bi_begin)
+        self.seg_bs_point_lst.trim_before(seg_begin)
+        self.trim_cnt += 1
+        return removed_klu
+
     def klu_iter(self, klc_begin_idx=0):
         for klc in self.lst[klc_begin_idx:]:
             yield from klc.lst
@@ -174,6 +296,13 @@ def cal_seg(bi_list, seg_list: CSegListComm, last_sure_seg_start_bi_idx):
     return last_sure_seg_start_bi_idx
 
 
+def reset_zs_in_seg(seg_list):
+    # 换一组中枢参数重算之前，清掉线段里上一组参数的中枢，否则update_zs_in_seg遇到ele_inside_is_sure的线段就停了
+    for seg in seg_list:
+        seg.clear_zs_lst()
+        seg.ele_inside_is_sure = False
+
+
 def update_zs_in_seg(bi_list, seg_list, zs_list):
     sure_seg_cnt = 0
     seg_idx = len(seg_list) - 1
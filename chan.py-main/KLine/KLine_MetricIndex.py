@@ -0,0 +1,213 @@
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+from Common.CEnum import TRADE_INFO_LST
+from Common.ChanException import CChanException, ErrCode
+from Math.MACD import CMACD
+from Math.RSI import RSI
+
+BLOCK_SIZE = 32
+
+
+class CRangeExtremum:
+    # 支持追加的区间最大/最小值：不满一块的头尾直接对切片求max/min，中间的整块用块极值上的稀疏表，单次查询O(1)
+    def __init__(self):
+        self.values = array('d')
+        self.block_max: List[array] = [array('d')]  # block_max[k][b]: 第max(0, b-2^k+1)~b块的最大值
+        self.block_min: List[array] = [array('d')]
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value: float):
+        self.values.append(value)
+        if len(self.values) % BLOCK_SIZE == 0:
+            block = self.values[-BLOCK_SIZE:]
+            add_block(self.block_max, max(block), max)
+            add_block(self.block_min, min(block), min)
+
+    def truncate(self, length: int):
+        del self.values[length:]
+        block_cnt = length // BLOCK_SIZE
+        level_cnt = max(1, block_cnt.bit_length())  # 块数不到2^k的层删掉，之后由add_block重建
+        for table in (self.block_max, self.block_min):
+            del table[level_cnt:]
+            for level in table:
+                del level[block_cnt:]
+
+    def trim(self, cnt: int):
+        # 删除前cnt个值，块的划分变了，稀疏表整体重建
+        values = self.values[cnt:]
+        self.values = array('d')
+        self.block_max, self.block_min = [array('d')], [array('d')]
+        for value in values:
+            self.append(value)
+
+    def query(self, begin: int, end: int, is_max: bool) -> float:
+        # [begin, end]行的最大/最小值
+        func = max if is_max else min
+        first_block = (begin + BLOCK_SIZE - 1) // BLOCK_SIZE  # 第一个完整块
+        last_block = (end + 1) // BLOCK_SIZE - 1  # 最后一个完整块
+        if first_block > last_block:
+            return func(self.values[begin:end+1])
+        table = self.block_max if is_max else self.block_min
+        k = (last_block - first_block + 1).bit_length() - 1
+        res = func(table[k][last_block], table[k][first_block + (1 << k) - 1])
+        if begin < first_block * BLOCK_SIZE:
+            res = func(res, func(self.values[begin:first_block * BLOCK_SIZE]))
+        if end >= (last_block + 1) * BLOCK_SIZE:
+            res = func(res, func(self.values[(last_block + 1) * BLOCK_SIZE:end+1]))
+        return res
+
+
+def add_block(table: List[array], value: float, func):
+    table[0].append(value)
+    block_idx = len(table[0]) - 1
+    k = 1
+    while (1 << k) <= block_idx + 1:
+        half = 1 << (k - 1)
+        pre_level = table[k-1]
+        if k == len(table):  # 块数第一次达到2^k，补齐这一层之前的值
+            table.append(array('d', (func(pre_level[b], pre_level[b-half]) if b >= half else pre_level[b] for b in range(block_idx + 1))))
+        else:
+            table[k].append(func(pre_level[block_idx], pre_level[block_idx-half]))
+        k += 1
+
+
+class CKLine_MetricIndex:
+    # 按klu.idx索引的前缀和/稀疏表，笔的macd面积、峰值、成交量等指标都变成区间查询，不用再逐根K线扫描
+    # 行号为klu.idx-begin_idx，只追加，回滚时按长度截断
+    def __init__(self, metric_model_lst: list):
+        self.begin_idx = 0  # 第0行对应的klu.idx
+        self.macd: Optional[CRangeExtremum] = None
+        self.macd_pos_sum = array('d', [0.0])  # 前缀和：第i项为前i行macd>0部分之和
+        self.macd_neg_sum = array('d', [0.0])  # 前缀和：前i行macd<0部分的绝对值之和
+        self.macd_run_begin = array('q')  # 所在连续同号（严格同号，0单独成段）区间的起始行，单调不减
+        self.rsi: Optional[CRangeExtremum] = None
+        for metric_model in metric_model_lst:
+            if isinstance(metric_model, CMACD):
+                self.macd = CRangeExtremum()
+            elif isinstance(metric_model, RSI):
+                self.rsi = CRangeExtremum()
+        self.size = 0
+        self.trade_sum: Dict[str, array] = {metric: array('d', [0.0]) for metric in TRADE_INFO_LST}  # 前缀和，None按0算
+        self.trade_none_cnt: Dict[str, array] = {metric: array('q', [0]) for metric in TRADE_INFO_LST}  # 前缀中None的个数
+
+    def __len__(self):
+        return self.size
+
+    def row(self, idx: int) -> int:
+        return idx - self.begin_idx
+
+    def contains(self, idx: int) -> bool:
+        return 0 <= idx - self.begin_idx < self.size
+
+    def add(self, klu_idx: int, macd: Optional[float], rsi: Optional[float], trade_metric: Dict[str, Optional[float]]):
+        if self.size == 0:
+            self.begin_idx = klu_idx
+        elif klu_idx != self.begin_idx + self.size:
+            raise CChanException(f"metric index requires continuous klu idx, expect {self.begin_idx + self.size}, got {klu_idx}", ErrCode.COMMON_ERROR)
+        if self.macd is not None:
+            r = self.size
+            self.macd_pos_sum.append(self.macd_pos_sum[-1] + macd if macd > 0 else self.macd_pos_sum[-1])
+            self.macd_neg_sum.append(self.macd_neg_sum[-1] - macd if macd < 0 else self.macd_neg_sum[-1])
+            self.macd_run_begin.append(self.macd_run_begin[-1] if r > 0 and macd * self.macd.values[-1] > 0 else r)
+            self.macd.append(macd)
+        if self.rsi is not None:
+            self.rsi.append(rsi)
+        for metric in TRADE_INFO_LST:
+            value = trade_metric.get(metric)
+            if value is None:
+                self.trade_sum[metric].append(self.trade_sum[metric][-1])
+                self.trade_none_cnt[metric].append(self.trade_none_cnt[metric][-1] + 1)
+            else:
+                self.trade_sum[metric].append(self.trade_sum[metric][-1] + value)
+                self.trade_none_cnt[metric].append(self.trade_none_cnt[metric][-1])
+        self.size += 1
+
+    def add_klu(self, klu):
+        store = klu.store
+        if store is not None:  # 列式存储直接读列，不逐根构造指标/交易信息对象
+            r = store.row(klu.idx)
+            self.add(klu.idx, store.macd[r] if self.macd is not None else None, store.rsi[r] if self.rsi is not None else None, store.get_trade_metric(klu.idx))
+            return
+        self.add(klu.idx, klu.macd.macd if self.macd is not None else None, klu.rsi if self.rsi is not None else None, klu.trade_info.metric)
+
+    def add_batch(self, klu_lst: list, metric_model_lst: list, metric_res: list):
+        # metric_res为MetricBatch.cal_metric_batch的返回值
+        macd_lst: List[Optional[float]] = [None] * len(klu_lst)
+        rsi_lst: List[Optional[float]] = [None] * len(klu_lst)
+        for metric_model, value in zip(metric_model_lst, metric_res):
+            if isinstance(metric_model, CMACD):
+                macd_lst = (2 * (value[2] - value[3])).tolist()  # 同CMACD_item.macd
+            elif isinstance(metric_model, RSI):
+                rsi_lst = value.tolist()
+        for klu, macd, rsi in zip(klu_lst, macd_lst, rsi_lst):
+            self.add(klu.idx, macd, rsi, klu.store.get_trade_metric(klu.idx) if klu.store is not None else klu.trade_info.metric)
+
+    def truncate(self, length: int):
+        self.size = length
+        if self.macd is not None:
+            self.macd.truncate(length)
+            del self.macd_pos_sum[length+1:]
+            del self.macd_neg_sum[length+1:]
+            del self.macd_run_begin[length:]
+        if self.rsi is not None:
+            self.rsi.truncate(length)
+        for metric in TRADE_INFO_LST:
+            del self.trade_sum[metric][length+1:]
+            del self.trade_none_cnt[metric][length+1:]
+
+    def trim_before(self, idx: int):
+        # 滚动窗口模式：删除klu.idx<idx的行，前缀和的起点不再是0，区间查询都是差值所以不受影响
+        cnt = idx - self.begin_idx
+        if cnt <= 0:
+            return
+        if self.macd is not None:
+            self.macd.trim(cnt)
+            del self.macd_pos_sum[:cnt]
+            del self.macd_neg_sum[:cnt]
+            self.macd_run_begin = array('q', (max(r - cnt, 0) for r in self.macd_run_begin[cnt:]))
+        if self.rsi is not None:
+            self.rsi.trim(cnt)
+        for metric in TRADE_INFO_LST:
+            del self.trade_sum[metric][:cnt]
+            del self.trade_none_cnt[metric][:cnt]
+        self.size -= cnt
+        self.begin_idx = idx
+
+    def macd_area(self, begin_idx: int, end_idx: int, is_positive: bool) -> float:
+        # [begin_idx, end_idx]内macd>0（或<0）部分的绝对值之和
+        prefix = self.macd_pos_sum if is_positive else self.macd_neg_sum
+        return prefix[self.row(end_idx)+1] - prefix[self.row(begin_idx)]
+
+    def macd_half_area(self, idx: int, bound_idx: int) -> float:
+        # 从idx开始往bound_idx方向，和idx处macd同号的连续区间的macd绝对值之和（idx处为0时返回0）
+        assert self.macd is not None
+        r, bound = self.row(idx), self.row(bound_idx)
+        macd = self.macd.values[r]
+        if macd == 0:
+            return 0.0
+        run_begin = self.macd_run_begin[r]
+        if bound >= r:
+            begin, end = r, bisect_right(self.macd_run_begin, run_begin, r, bound+1) - 1
+        else:
+            begin, end = max(bound, run_begin), r
+        prefix = self.macd_pos_sum if macd > 0 else self.macd_neg_sum
+        return prefix[end+1] - prefix[begin]
+
+    def macd_extremum(self, begin_idx: int, end_idx: int, is_max: bool) -> float:
+        assert self.macd is not None
+        return self.macd.query(self.row(begin_idx), self.row(end_idx), is_max)
+
+    def rsi_extremum(self, begin_idx: int, end_idx: int, is_max: bool) -> float:
+        assert self.rsi is not None
+        return self.rsi.query(self.row(begin_idx), self.row(end_idx), is_max)
+
+    def trade_metric_sum(self, metric: str, begin_idx: int, end_idx: int) -> Optional[float]:
+        # 区间内有None时返回None
+        begin, end = self.row(begin_idx), self.row(end_idx) + 1
+        if self.trade_none_cnt[metric][end] != self.trade_none_cnt[metric][begin]:
+            return None
+        return self.trade_sum[metric][end] - self.trade_sum[metric][begin]
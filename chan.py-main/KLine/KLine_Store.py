@@ -0,0 +1,216 @@
+import math
+from array import array
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
+
+from Common.CEnum import TRADE_INFO_LST, TREND_TYPE
+from Common.ChanException import CChanException, ErrCode
+from Math.BOLL import BOLL_Metric, BollModel
+from Math.Demark import CDemarkEngine, CDemarkIndex
+from Math.KDJ import KDJ, KDJ_Item
+from Math.MACD import CMACD, CMACD_item
+from Math.RSI import RSI
+from Math.TrendModel import CTrendModel
+
+from .TradeInfo import CTradeInfo
+
+
+class CKLine_Store:
+    # 列式存储：OHLCV、时间以及指标值都放在连续的array里面，按klu.idx-begin_idx索引
+    # CKLine_Unit绑定store之后不再持有trade_info/macd/boll等对象，访问时从列里面现场构造
+    # 现场构造的对象只是当前值的拷贝，其中trade_info和trend是只读视图，按K线遍历的计算应直接读列
+    def __init__(self, metric_model_lst: list):
+        self.begin_idx = 0  # 第0行对应的klu.idx
+
+        self.time = array('d')  # CTime.ts
+        self.open = array('d')
+        self.high = array('d')
+        self.low = array('d')
+        self.close = array('d')
+        self.trade_info: Dict[str, array] = {metric: array('d') for metric in TRADE_INFO_LST}  # nan表示None
+
+        self.macd: Optional[array] = None  # 2*(DIF-DEA)，单独存一列方便笔的macd指标扫描
+        self.macd_fast_ema: Optional[array] = None
+        self.macd_slow_ema: Optional[array] = None
+        self.macd_dif: Optional[array] = None
+        self.macd_dea: Optional[array] = None
+        self.boll_ma: Optional[array] = None
+        self.boll_theta: Optional[array] = None
+        self.rsi: Optional[array] = None
+        self.kdj_k: Optional[array] = None
+        self.kdj_d: Optional[array] = None
+        self.kdj_j: Optional[array] = None
+        self.trend: Dict[Tuple[TREND_TYPE, int], array] = {}
+        self.demark: Optional[List[CDemarkIndex]] = None
+        for metric_model in metric_model_lst:
+            if isinstance(metric_model, CMACD):
+                self.macd, self.macd_fast_ema, self.macd_slow_ema, self.macd_dif, self.macd_dea = (array('d') for _ in range(5))
+            elif isinstance(metric_model, CTrendModel):
+                self.trend[(metric_model.type, metric_model.T)] = array('d')
+            elif isinstance(metric_model, BollModel):
+                self.boll_ma, self.boll_theta = array('d'), array('d')
+            elif isinstance(metric_model, CDemarkEngine):
+                self.demark = []
+            elif isinstance(metric_model, RSI):
+                self.rsi = array('d')
+            elif isinstance(metric_model, KDJ):
+                self.kdj_k, self.kdj_d, self.kdj_j = array('d'), array('d'), array('d')
+
+    def __len__(self):
+        return len(self.close)
+
+    def row(self, idx: int) -> int:
+        return idx - self.begin_idx
+
+    def add(self, klu, metric_model_lst: list, cal_metric=True):
+        if len(self) == 0:
+            self.begin_idx = klu.idx
+        elif klu.idx != self.begin_idx + len(self):
+            raise CChanException(f"columnar store requires continuous klu idx, expect {self.begin_idx + len(self)}, got {klu.idx}", ErrCode.COMMON_ERROR)
+        self.time.append(klu.time.ts)
+        self.open.append(klu.open)
+        self.high.append(klu.high)
+        self.low.append(klu.low)
+        self.close.append(klu.close)
+        for metric_name, value in klu.trade_info.metric.items():
+            self.trade_info[metric_name].append(math.nan if value is None else value)
+        if cal_metric:
+            self.add_metric(klu, metric_model_lst)
+        klu.set_store(self)
+
+    def add_metric(self, klu, metric_model_lst: list):
+        for metric_model in metric_model_lst:
+            if isinstance(metric_model, CMACD):
+                macd_item = metric_model.add(klu.close)
+                self.macd.append(macd_item.macd)  # type: ignore
+                self.macd_fast_ema.append(macd_item.fast_ema)  # type: ignore
+                self.macd_slow_ema.append(macd_item.slow_ema)  # type: ignore
+                self.macd_dif.append(macd_item.DIF)  # type: ignore
+                self.macd_dea.append(macd_item.DEA)  # type: ignore
+            elif isinstance(metric_model, CTrendModel):
+                self.trend[(metric_model.type, metric_model.T)].append(metric_model.add(klu.close))
+            elif isinstance(metric_model, BollModel):
+                ma, theta = metric_model.cal(klu.close)
+                self.boll_ma.append(ma)  # type: ignore
+                self.boll_theta.append(theta)  # type: ignore
+            elif isinstance(metric_model, CDemarkEngine):
+                self.demark.append(metric_model.update(idx=klu.idx, close=klu.close, high=klu.high, low=klu.low))  # type: ignore
+            elif isinstance(metric_model, RSI):
+                self.rsi.append(metric_model.add(klu.close))  # type: ignore
+            elif isinstance(metric_model, KDJ):
+                kdj_item = metric_model.add(klu.high, klu.low, klu.close)
+                self.kdj_k.append(kdj_item.k)  # type: ignore
+                self.kdj_d.append(kdj_item.d)  # type: ignore
+                self.kdj_j.append(kdj_item.j)  # type: ignore
+
+    def add_metric_batch(self, metric_model_lst: list, metric_res: list):
+        # metric_res为MetricBatch.cal_metric_batch的返回值，直接追加到各列末尾
+        for metric_model, value in zip(metric_model_lst, metric_res):
+            if isinstance(metric_model, CMACD):
+                fast_ema, slow_ema, dif, dea = value
+                extend_column(self.macd, 2 * (dif - dea))  # type: ignore
+                extend_column(self.macd_fast_ema, fast_ema)  # type: ignore
+                extend_column(self.macd_slow_ema, slow_ema)  # type: ignore
+                extend_column(self.macd_dif, dif)  # type: ignore
+                extend_column(self.macd_dea, dea)  # type: ignore
+            elif isinstance(metric_model, CTrendModel):
+                extend_column(self.trend[(metric_model.type, metric_model.T)], value)
+            elif isinstance(metric_model, BollModel):
+                extend_column(self.boll_ma, value[0])  # type: ignore
+                extend_column(self.boll_theta, value[1])  # type: ignore
+            elif isinstance(metric_model, CDemarkEngine):
+                self.demark.extend(value)  # type: ignore
+            elif isinstance(metric_model, RSI):
+                extend_column(self.rsi, value)  # type: ignore
+            elif isinstance(metric_model, KDJ):
+                for column, v in zip((self.kdj_k, self.kdj_d, self.kdj_j), value):
+                    extend_column(column, v)  # type: ignore
+
+    def column_lengths(self) -> List[int]:
+        # 批量计算指标时，指标列可能比OHLC列短，所以每一列的长度要单独记录
+        res = [len(column) for column in self.all_columns()]
+        if self.demark is not None:
+            res.append(len(self.demark))
+        return res
+
+    def truncate(self, column_lengths: List[int]):
+        # 每一列截断到column_lengths中记录的长度，用于回滚到checkpoint
+        columns: list = self.all_columns()
+        if self.demark is not None:
+            columns.append(self.demark)
+        for column, length in zip(columns, column_lengths):
+            del column[length:]
+
+    def trim_before(self, idx: int):
+        # 滚动窗口模式：删除klu.idx<idx的行
+        cnt = idx - self.begin_idx
+        if cnt <= 0:
+            return
+        columns: list = self.all_columns()
+        if self.demark is not None:
+            columns.append(self.demark)
+        for column in columns:
+            del column[:cnt]
+        self.begin_idx = idx
+
+    def all_columns(self) -> List[array]:
+        res = [self.time, self.open, self.high, self.low, self.close, *self.trade_info.values(), *self.trend.values()]
+        for column in [self.macd, self.macd_fast_ema, self.macd_slow_ema, self.macd_dif, self.macd_dea, self.boll_ma, self.boll_theta, self.rsi, self.kdj_k, self.kdj_d, self.kdj_j]:
+            if column is not None:
+                res.append(column)
+        return res
+
+    def get_trade_metric(self, idx: int) -> Dict[str, Optional[float]]:
+        r = self.row(idx)
+        res: Dict[str, Optional[float]] = {}
+        for metric_name, column in self.trade_info.items():
+            value = column[r]
+            res[metric_name] = None if math.isnan(value) else value
+        return res
+
+    def get_trade_info(self, idx: int) -> CTradeInfo:
+        # 现场构造的只读视图，修改会抛TypeError（写回不到列里）
+        res = CTradeInfo({})
+        res.metric = MappingProxyType(self.get_trade_metric(idx))  # type: ignore
+        return res
+
+    def get_macd(self, idx: int) -> CMACD_item:
+        if self.macd is None:
+            raise AttributeError("macd")
+        r = self.row(idx)
+        return CMACD_item(fast_ema=self.macd_fast_ema[r], slow_ema=self.macd_slow_ema[r], DIF=self.macd_dif[r], DEA=self.macd_dea[r])  # type: ignore
+
+    def get_boll(self, idx: int) -> BOLL_Metric:
+        if self.boll_ma is None:
+            raise AttributeError("boll")
+        r = self.row(idx)
+        return BOLL_Metric(self.boll_ma[r], self.boll_theta[r])  # type: ignore
+
+    def get_rsi(self, idx: int) -> float:
+        if self.rsi is None:
+            raise AttributeError("rsi")
+        return self.rsi[self.row(idx)]
+
+    def get_kdj(self, idx: int) -> KDJ_Item:
+        if self.kdj_k is None:
+            raise AttributeError("kdj")
+        r = self.row(idx)
+        return KDJ_Item(self.kdj_k[r], self.kdj_d[r], self.kdj_j[r])  # type: ignore
+
+    def get_trend(self, idx: int) -> Dict[TREND_TYPE, Dict[int, float]]:
+        # 只读视图，同get_trade_info
+        r = self.row(idx)
+        res: Dict[TREND_TYPE, Dict[int, float]] = {}
+        for (trend_type, T), column in self.trend.items():
+            res.setdefault(trend_type, {})[T] = column[r]
+        return MappingProxyType({trend_type: MappingProxyType(value) for trend_type, value in res.items()})  # type: ignore
+
+    def get_demark(self, idx: int) -> CDemarkIndex:
+        if self.demark is None:
+            return CDemarkIndex()
+        return self.demark[self.row(idx)]
+
+
+def extend_column(column: array, value):
+    # value为float64的numpy数组
+    column.frombytes(value.astype('float64').tobytes())
@@ -1,5 +1,5 @@
 import copy
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, Optional
 
 from Common.CEnum import DATA_FIELD, TRADE_INFO_LST, TREND_TYPE
 from Common.ChanException import CChanException, ErrCode
@@ -11,10 +11,18 @@ from Math.MACD import CMACD, CMACD_item
 from Math.RSI import RSI
 from Math.TrendModel import CTrendModel
 
+from .KLine_Store import CKLine_Store
 from .TradeInfo import CTradeInfo
 
+if TYPE_CHECKING:
+    from KLine.KLine import CKLine
+
 
 class CKLine_Unit:
+    # 指标字段固定为slot，没有算过的指标（如未开启rsi/kdj）保持未赋值，hasattr判断不变
+    __slots__ = ('kl_type', 'time', 'close', 'open', 'high', 'low', 'sub_kl_list', 'sup_kl', 'limit_flag', 'pre', 'next',
+                 '__idx', '__klc', '__store', '__trade_info', '__demark', '__trend', '__macd', '__boll', '__rsi', '__kdj')
+
     def __init__(self, kl_dict, autofix=False):
         # _time, _close, _open, _high, _low, _extra_info={}
         self.kl_type = None
@@ -26,19 +34,36 @@ class CKLine_Unit:
 
         self.check(autofix)
 
-        self.trade_info = CTradeInfo(kl_dict)
+        self.__init_relation(CTradeInfo(kl_dict))
+
+    @classmethod
+    def from_value(cls, time: CTime, _open: float, high: float, low: float, close: float, trade_info: CTradeInfo) -> 'CKLine_Unit':
+        # 批量导入（见DataAPI/BulkAPI.py）时价格已经整体检查过，不再构造kl_dict、逐根check
+        obj = cls.__new__(cls)
+        obj.kl_type = None
+        obj.time = time
+        obj.close = close
+        obj.open = _open
+        obj.high = high
+        obj.low = low
+        obj.__init_relation(trade_info)
+        return obj
 
-        self.demark: CDemarkIndex = CDemarkIndex()
+    def __init_relation(self, trade_info: CTradeInfo):
+        self.__trade_info: Optional[CTradeInfo] = trade_info
+
+        self.__demark: Optional[CDemarkIndex] = CDemarkIndex()
 
         self.sub_kl_list = []  # 次级别KLU列表
         self.sup_kl: Optional[CKLine_Unit] = None  # 指向更高级别KLU
 
-        from KLine.KLine import CKLine
-        self.__klc: Optional[CKLine] = None  # 指向KLine
+        self.__klc: Optional['CKLine'] = None  # 指向KLine
+
+        # self.__macd: Optional[CMACD_item] = None
+        # self.__boll: Optional[BOLL_Metric] = None
+        self.__trend: Optional[Dict[TREND_TYPE, Dict[int, float]]] = {}  # int -> float
 
-        # self.macd: Optional[CMACD_item] = None
-        # self.boll: Optional[BOLL_Metric] = None
-        self.trend: Dict[TREND_TYPE, Dict[int, float]] = {}  # int -> float
+        self.__store: Optional[CKLine_Store] = None  # 列式存储模式下指标都存在store里面
 
         self.limit_flag = 0  # 0:普通 -1:跌停，1:涨停
         self.pre: Optional[CKLine_Unit] = None
@@ -58,16 +83,20 @@ class CKLine_Unit:
             if metric in self.trade_info.metric:
                 _dict[metric] = self.trade_info.metric[metric]
         obj = CKLine_Unit(_dict)
-        obj.demark = copy.deepcopy(self.demark, memo)
-        obj.trend = copy.deepcopy(self.trend, memo)
         obj.limit_flag = self.limit_flag
-        obj.macd = copy.deepcopy(self.macd, memo)
-        obj.boll = copy.deepcopy(self.boll, memo)
+        obj.set_idx(self.idx)
+        if self.__store is not None:
+            obj.set_store(copy.deepcopy(self.__store, memo))
+            memo[id(self)] = obj
+            return obj
+        obj.__demark = copy.deepcopy(self.__demark, memo)
+        obj.__trend = copy.deepcopy(self.__trend, memo)
+        obj.__macd = copy.deepcopy(self.macd, memo)
+        obj.__boll = copy.deepcopy(self.boll, memo)
         if hasattr(self, "rsi"):
-            obj.rsi = copy.deepcopy(self.rsi, memo)
+            obj.__rsi = copy.deepcopy(self.rsi, memo)
         if hasattr(self, "kdj"):
-            obj.kdj = copy.deepcopy(self.kdj, memo)
-        obj.set_idx(self.idx)
+            obj.__kdj = copy.deepcopy(self.kdj, memo)
         memo[id(self)] = obj
         return obj
 
@@ -83,6 +112,71 @@ class CKLine_Unit:
     def idx(self):
         return self.__idx
 
+    @property
+    def store(self):
+        return self.__store
+
+    def set_store(self, store: CKLine_Store):
+        # 绑定之后由store提供指标和交易信息，释放本身持有的对象
+        self.__store = store
+        self.__trade_info = None
+        self.__demark = None
+        self.__trend = None
+
+    def release_store(self):
+        # 和store解绑，重新持有交易信息，用于同一个klu对象回滚后需要再次加入的情况
+        if self.__store is None:
+            return
+        self.__trade_info = CTradeInfo(self.__store.get_trade_metric(self.__idx))  # store返回的是只读视图
+        self.__demark = CDemarkIndex()
+        self.__trend = {}
+        self.__store = None
+
+    @property
+    def trade_info(self) -> CTradeInfo:
+        if self.__store is not None:
+            return self.__store.get_trade_info(self.__idx)
+        assert self.__trade_info is not None
+        return self.__trade_info
+
+    @property
+    def demark(self) -> CDemarkIndex:
+        if self.__store is not None:
+            return self.__store.get_demark(self.__idx)
+        assert self.__demark is not None
+        return self.__demark
+
+    @property
+    def trend(self) -> Dict[TREND_TYPE, Dict[int, float]]:
+        if self.__store is not None:
+            return self.__store.get_trend(self.__idx)
+        assert self.__trend is not None
+        return self.__trend
+
+    @property
+    def macd(self) -> CMACD_item:
+        if self.__store is not None:
+            return self.__store.get_macd(self.__idx)
+        return self.__macd
+
+    @property
+    def boll(self) -> BOLL_Metric:
+        if self.__store is not None:
+            return self.__store.get_boll(self.__idx)
+        return self.__boll
+
+    @property
+    def rsi(self) -> float:
+        if self.__store is not None:
+            return self.__store.get_rsi(self.__idx)
+        return self.__rsi
+
+    @property
+    def kdj(self):
+        if self.__store is not None:
+            return self.__store.get_kdj(self.__idx)
+        return self.__kdj
+
     def set_idx(self, idx):
         self.__idx: int = idx
 
@@ -119,19 +213,36 @@ class CKLine_Unit:
     def set_metric(self, metric_model_lst: list) -> None:
         for metric_model in metric_model_lst:
             if isinstance(metric_model, CMACD):
-                self.macd: CMACD_item = metric_model.add(self.close)
+                self.__macd: CMACD_item = metric_model.add(self.close)
             elif isinstance(metric_model, CTrendModel):
                 if metric_model.type not in self.trend:
                     self.trend[metric_model.type] = {}
                 self.trend[metric_model.type][metric_model.T] = metric_model.add(self.close)
             elif isinstance(metric_model, BollModel):
-                self.boll: BOLL_Metric = metric_model.add(self.close)
+                self.__boll: BOLL_Metric = metric_model.add(self.close)
             elif isinstance(metric_model, CDemarkEngine):
-                self.demark = metric_model.update(idx=self.idx, close=self.close, high=self.high, low=self.low)
+                self.__demark = metric_model.update(idx=self.idx, close=self.close, high=self.high, low=self.low)
             elif isinstance(metric_model, RSI):
-                self.rsi = metric_model.add(self.close)
+                self.__rsi: float = metric_model.add(self.close)
             elif isinstance(metric_model, KDJ):
-                self.kdj = metric_model.add(self.high, self.low, self.close)
+                self.__kdj = metric_model.add(self.high, self.low, self.close)
+
+    def set_metric_item(self, metric_model, item) -> None:
+        # 批量计算模式下，指标已经由metric_model算好，这里只负责挂到K线上
+        if isinstance(metric_model, CMACD):
+            self.__macd = item
+        elif isinstance(metric_model, CTrendModel):
+            if metric_model.type not in self.trend:
+                self.trend[metric_model.type] = {}
+            self.trend[metric_model.type][metric_model.T] = item
+        elif isinstance(metric_model, BollModel):
+            self.__boll = item
+        elif isinstance(metric_model, CDemarkEngine):
+            self.__demark = item
+        elif isinstance(metric_model, RSI):
+            self.__rsi = item
+        elif isinstance(metric_model, KDJ):
+            self.__kdj = item
 
     def get_parent_klc(self):
         assert self.sup_kl is not None
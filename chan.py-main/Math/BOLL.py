@@ -1,4 +1,7 @@
 import math
+import sys
+from collections import deque
+from typing import Deque, Iterable, Tuple
 
 
 def _truncate(x):
@@ -6,6 +9,8 @@ def _truncate(x):
 
 
 class BOLL_Metric:
+    __slots__ = ('theta', 'UP', 'DOWN', 'MID')
+
     def __init__(self, ma, theta):
         self.theta = _truncate(theta)
         self.UP = ma + 2*theta
@@ -14,15 +19,47 @@ class BOLL_Metric:
 
 
 class BollModel:
+    RECAL_TOLERANCE = 1e-9  # 增量更新累计的误差上界超过 m2*RECAL_TOLERANCE 时按窗口重算
+
     def __init__(self, N=20):
         assert N > 1
         self.N = N
-        self.arr = []
+        self.arr: Deque[float] = deque(maxlen=N)
+        self.sum = 0.0
+        self.m2 = 0.0  # 窗口内离差平方和
+        self.err = 0.0  # 上次重算以来m2的浮点误差上界
 
     def add(self, value) -> BOLL_Metric:
-        self.arr.append(value)
-        if len(self.arr) > self.N:
-            self.arr = self.arr[-self.N:]
-        ma = sum(self.arr)/len(self.arr)
-        theta = math.sqrt(sum((x-ma)**2 for x in self.arr) / len(self.arr))
-        return BOLL_Metric(ma, theta)
+        return BOLL_Metric(*self.cal(value))
+
+    def cal(self, value) -> Tuple[float, float]:
+        # 返回(ma, theta)，列式存储模式下只保存这两个值
+        if len(self.arr) < self.N:
+            # 窗口未满时直接重算，和逐根求和的结果完全一致
+            self.arr.append(value)
+            self.recal()
+        else:
+            # 滑动窗口的Welford更新: M2' = M2 + (x_new-x_old)*(x_new-ma'+x_old-ma)
+            old_value = self.arr[0]
+            old_ma = self.sum / self.N
+            self.arr.append(value)
+            self.sum += value - old_value
+            ma = self.sum / self.N
+            self.m2 += (value - old_value) * (value - ma + old_value - old_ma)
+            self.err += 4 * sys.float_info.epsilon * abs(value - old_value) * (abs(value) + abs(old_value) + abs(ma) + abs(old_ma))
+            if self.err > self.m2 * self.RECAL_TOLERANCE:
+                # 方差很小（比如横盘一字线）时增量误差相对不可忽略，退回按窗口重算
+                self.recal()
+        ma = self.sum / len(self.arr)
+        return ma, math.sqrt(self.m2 / len(self.arr))
+
+    def recal(self):
+        self.sum = sum(self.arr)
+        ma = self.sum / len(self.arr)
+        self.m2 = sum((x-ma)**2 for x in self.arr)
+        self.err = 0.0
+
+    def reset_window(self, values: Iterable[float]):
+        # 用外部算好的最近N个值重置状态（批量计算之后调用）
+        self.arr = deque(values, maxlen=self.N)
+        self.recal()
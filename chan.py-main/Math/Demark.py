@@ -160,6 +160,9 @@ class CDemarkEngine:
         self.kl_lst.append(C_KL(idx, close, high, low))
         if len(self.kl_lst) <= CDemarkEngine.SETUP_BIAS+1:
             return CDemarkIndex()
+        if len(self.kl_lst) > 4*(CDemarkEngine.SETUP_BIAS+2):
+            # 只会用到最后SETUP_BIAS+2根，series持有的是自己的切片，这里定期截断防止无限增长
+            del self.kl_lst[:-CDemarkEngine.SETUP_BIAS-2]
 
         if self.kl_lst[-1].close < self.kl_lst[-1-self.SETUP_BIAS].close:
             if not any(series.dir == BI_DIR.DOWN and not series.setup_finished for series in self.series):
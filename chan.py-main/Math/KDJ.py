@@ -1,4 +1,6 @@
 class KDJ_Item:
+    __slots__ = ('k', 'd', 'j')
+
     def __init__(self, k, d, j):
         self.k = k
         self.d = d
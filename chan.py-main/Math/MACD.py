@@ -1,7 +1,10 @@
-from typing import List
+from collections import deque
+from typing import Deque, Optional
 
 
 class CMACD_item:
+    __slots__ = ('fast_ema', 'slow_ema', 'DIF', 'DEA', 'macd')
+
     def __init__(self, fast_ema, slow_ema, DIF, DEA):
         self.fast_ema = fast_ema
         self.slow_ema = slow_ema
@@ -11,8 +14,10 @@ class CMACD_item:
 
 
 class CMACD:
-    def __init__(self, fastperiod=12, slowperiod=26, signalperiod=9):
-        self.macd_info: List[CMACD_item] = []
+    def __init__(self, fastperiod=12, slowperiod=26, signalperiod=9, history_len: Optional[int] = 1):
+        # history_len: macd_info保留的历史长度，递推只依赖上一个值，None表示全部保留
+        assert history_len is None or history_len >= 1
+        self.macd_info: Deque[CMACD_item] = deque(maxlen=history_len)
         self.fastperiod = fastperiod
         self.slowperiod = slowperiod
         self.signalperiod = signalperiod
@@ -0,0 +1,190 @@
+from typing import List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from Common.CEnum import TREND_TYPE
+from Common.ChanException import CChanException, ErrCode
+
+from .BOLL import BOLL_Metric, BollModel
+from .Demark import CDemarkEngine
+from .KDJ import KDJ, KDJ_Item
+from .MACD import CMACD, CMACD_item
+from .RSI import RSI
+from .TrendModel import CTrendModel
+
+# 非回放模式下一次性计算一整段K线的指标
+# 计算完成后会把各个model的内部状态推进到最后一根K线，之后既可以继续批量算，也可以回到逐根add
+
+CHUNK_SIZE = 1 << 16  # 需要展开窗口的计算按块进行，避免临时矩阵过大
+
+
+def linear_scan(x: np.ndarray, a: float, b: float, y0: float) -> np.ndarray:
+    # 计算 y[t] = a*y[t-1] + b*x[t], y[-1] = y0
+    # 倍增前缀扫描：第k轮之后B[t]已经累计了x[t-2^k+1..t]的贡献，log2(n)轮numpy操作完成
+    n = len(x)
+    B = b * x
+    shift = 1
+    while shift < n:
+        B[shift:] = B[shift:] + a ** shift * B[:-shift]
+        shift <<= 1
+    return np.power(a, np.arange(1, n+1, dtype=np.float64)) * y0 + B
+
+
+def rolling_window(hist: list, values: np.ndarray, T: int, pad_value: float) -> np.ndarray:
+    # 返回每根K线对应的长度为T的窗口视图（包含之前model中的历史值），不足T的部分用pad_value填充在前面
+    pad = max(0, T - 1 - len(hist))
+    full = np.concatenate([np.full(pad, pad_value), np.asarray(hist, dtype=np.float64), values])
+    return sliding_window_view(full, T)[-len(values):]
+
+
+def cal_macd(model: CMACD, close: np.ndarray):
+    if model.macd_info:
+        last = model.macd_info[-1]
+        fast0, slow0, dea0 = last.fast_ema, last.slow_ema, last.DEA
+    else:
+        fast0, slow0, dea0 = close[0], close[0], 0.0
+    fast_ema = linear_scan(close, (model.fastperiod-1)/(model.fastperiod+1), 2/(model.fastperiod+1), fast0)
+    slow_ema = linear_scan(close, (model.slowperiod-1)/(model.slowperiod+1), 2/(model.slowperiod+1), slow0)
+    dif = fast_ema - slow_ema
+    dea = linear_scan(dif, (model.signalperiod-1)/(model.signalperiod+1), 2/(model.signalperiod+1), dea0)
+    # 同逐根add，macd_info保留最后history_len个（None为全部），默认只保留1个时仍是O(1)
+    keep = len(close) if model.macd_info.maxlen is None else min(len(close), model.macd_info.maxlen)
+    for item in zip(fast_ema[-keep:].tolist(), slow_ema[-keep:].tolist(), dif[-keep:].tolist(), dea[-keep:].tolist()):
+        model.macd_info.append(CMACD_item(*item))
+    return fast_ema, slow_ema, dif, dea
+
+
+def cal_trend(model: CTrendModel, close: np.ndarray) -> np.ndarray:
+    res = np.empty(len(close))
+    for begin in range(0, len(close), CHUNK_SIZE):
+        hist = list(model.arr)[-model.T+1:] if begin == 0 else close[max(0, begin-model.T+1):begin]
+        chunk = close[begin:begin+CHUNK_SIZE]
+        if model.type == TREND_TYPE.MEAN:
+            window = rolling_window(hist, chunk, model.T, 0.0)
+            cnt = np.minimum(np.arange(len(model.arr)+begin+1, len(model.arr)+begin+len(chunk)+1), model.T)
+            res[begin:begin+len(chunk)] = window.sum(axis=1) / cnt
+        elif model.type == TREND_TYPE.MAX:
+            res[begin:begin+len(chunk)] = rolling_window(hist, chunk, model.T, -np.inf).max(axis=1)
+        elif model.type == TREND_TYPE.MIN:
+            res[begin:begin+len(chunk)] = rolling_window(hist, chunk, model.T, np.inf).min(axis=1)
+        else:
+            raise CChanException(f"Unknown trendModel Type = {model.type}", ErrCode.PARA_ERROR)
+    model.reset_window(list(model.arr) + close[-model.T:].tolist())
+    return res
+
+
+def cal_boll(model: BollModel, close: np.ndarray):
+    ma = np.empty(len(close))
+    theta = np.empty(len(close))
+    for begin in range(0, len(close), CHUNK_SIZE):
+        hist = list(model.arr)[-model.N+1:] if begin == 0 else close[max(0, begin-model.N+1):begin]
+        chunk = close[begin:begin+CHUNK_SIZE]
+        window = rolling_window(hist, chunk, model.N, 0.0)
+        _ma = window.sum(axis=1) / model.N
+        ma[begin:begin+len(chunk)] = _ma
+        theta[begin:begin+len(chunk)] = np.sqrt(((window - _ma[:, None])**2).sum(axis=1) / model.N)
+    # 窗口未满的前几根K线按原逻辑逐根修正
+    arr = list(model.arr)
+    for i in range(min(len(close), model.N-1-len(model.arr))):
+        ma[i], theta[i] = model.cal(close[i])
+    model.reset_window(arr + close[-model.N:].tolist())
+    return ma, theta
+
+
+def cal_rsi(model: RSI, close: np.ndarray) -> np.ndarray:
+    res = np.empty(len(close))
+    if model.close_arr:
+        diff = np.diff(close, prepend=model.close_arr[-1])
+        out = res
+    else:
+        res[0] = 50.0
+        diff = np.diff(close)
+        out = res[1:]
+    if len(diff):
+        upval = np.where(diff > 0, diff, 0.0)
+        downval = np.where(diff < 0, -diff, 0.0)
+        up = np.empty(len(diff))
+        down = np.empty(len(diff))
+        # 前period-1个diff取算术平均
+        prev_cnt = model.diff_cnt
+        avg_cnt = max(0, min(len(diff), model.period-1-prev_cnt))
+        if avg_cnt:
+            cnt = np.arange(prev_cnt+1, prev_cnt+avg_cnt+1)
+            up_sum = np.cumsum(np.concatenate([[model.up_sum], upval[:avg_cnt]]))[1:]
+            down_sum = np.cumsum(np.concatenate([[model.down_sum], downval[:avg_cnt]]))[1:]
+            up[:avg_cnt] = up_sum / cnt
+            down[:avg_cnt] = down_sum / cnt
+            model.up_sum, model.down_sum = float(up_sum[-1]), float(down_sum[-1])
+        # 之后按wilder平滑
+        if avg_cnt < len(diff):
+            up0 = up[avg_cnt-1] if avg_cnt else model.up[-1]
+            down0 = down[avg_cnt-1] if avg_cnt else model.down[-1]
+            up[avg_cnt:] = linear_scan(upval[avg_cnt:], (model.period-1)/model.period, 1/model.period, up0)
+            down[avg_cnt:] = linear_scan(downval[avg_cnt:], (model.period-1)/model.period, 1/model.period, down0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[:] = np.where(down == 0, np.where(up > 0, 100.0, 0.0), 100.0 - 100.0 / (1.0 + up / down))
+        model.diff.extend(diff.tolist())
+        model.diff_cnt += len(diff)
+        model.up.extend(up.tolist())
+        model.down.extend(down.tolist())
+    model.close_arr.extend(close.tolist())
+    return res
+
+
+def cal_kdj(model: KDJ, high: np.ndarray, low: np.ndarray, close: np.ndarray):
+    hn = np.empty(len(close))
+    ln = np.empty(len(close))
+    for begin in range(0, len(close), CHUNK_SIZE):
+        if begin == 0:
+            hist_high = [x['high'] for x in model.arr][-model.period+1:]
+            hist_low = [x['low'] for x in model.arr][-model.period+1:]
+        else:
+            hist_high = high[max(0, begin-model.period+1):begin]
+            hist_low = low[max(0, begin-model.period+1):begin]
+        end = begin + CHUNK_SIZE
+        hn[begin:end] = rolling_window(hist_high, high[begin:end], model.period, -np.inf).max(axis=1)
+        ln[begin:end] = rolling_window(hist_low, low[begin:end], model.period, np.inf).min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsv = np.where(hn != ln, 100 * (close - ln) / (hn - ln), 0.0)
+    k = linear_scan(rsv, 2 / 3, 1 / 3, model.pre_kdj.k)
+    d = linear_scan(k, 2 / 3, 1 / 3, model.pre_kdj.d)
+    j = 3 * k - 2 * d
+    model.arr = (model.arr + [{'high': h, 'low': lo} for h, lo in zip(high[-model.period:].tolist(), low[-model.period:].tolist())])[-model.period:]
+    model.pre_kdj = KDJ_Item(k[-1], d[-1], j[-1])
+    return k, d, j
+
+
+def cal_metric_batch(metric_model_lst: list, idx_lst: List[int], high: np.ndarray, low: np.ndarray, close: np.ndarray) -> list:
+    # 返回值与metric_model_lst一一对应，每一项是该指标的列（或多列组成的tuple）
+    res = []
+    for metric_model in metric_model_lst:
+        if isinstance(metric_model, CMACD):
+            res.append(cal_macd(metric_model, close))
+        elif isinstance(metric_model, CTrendModel):
+            res.append(cal_trend(metric_model, close))
+        elif isinstance(metric_model, BollModel):
+            res.append(cal_boll(metric_model, close))
+        elif isinstance(metric_model, CDemarkEngine):
+            # demark是状态机，无法向量化，仍逐根计算
+            res.append([metric_model.update(idx=idx, close=c, high=h, low=lo) for idx, c, h, lo in zip(idx_lst, close.tolist(), high.tolist(), low.tolist())])
+        elif isinstance(metric_model, RSI):
+            res.append(cal_rsi(metric_model, close))
+        elif isinstance(metric_model, KDJ):
+            res.append(cal_kdj(metric_model, high, low, close))
+        else:
+            res.append(None)
+    return res
+
+
+def metric_items(metric_model, metric_value) -> list:
+    # 把批量计算出来的列转成逐根K线的指标对象，供非列式存储模式使用
+    if isinstance(metric_model, CMACD):
+        return [CMACD_item(fast_ema=f, slow_ema=s, DIF=dif, DEA=dea) for f, s, dif, dea in zip(*(col.tolist() for col in metric_value))]
+    elif isinstance(metric_model, BollModel):
+        return [BOLL_Metric(ma, theta) for ma, theta in zip(*(col.tolist() for col in metric_value))]
+    elif isinstance(metric_model, KDJ):
+        return [KDJ_Item(k, d, j) for k, d, j in zip(*(col.tolist() for col in metric_value))]
+    elif isinstance(metric_model, CDemarkEngine):
+        return metric_value
+    return metric_value.tolist()
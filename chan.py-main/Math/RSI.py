@@ -1,24 +1,37 @@
+from collections import deque
+from typing import Deque, Optional
+
+
 class RSI:
-    def __init__(self, period: int = 14):
+    def __init__(self, period: int = 14, history_len: Optional[int] = 1):
+        # history_len: close_arr/diff/up/down保留的历史长度，递推只依赖上一个值，None表示全部保留
         super(RSI, self).__init__()
-        self.close_arr = []
+        assert history_len is None or history_len >= 1
+        self.close_arr: Deque[float] = deque(maxlen=history_len)
         self.period = period
-        self.diff = []
-        self.up = []
-        self.down = []
+        self.diff: Deque[float] = deque(maxlen=history_len)
+        self.up: Deque[float] = deque(maxlen=history_len)
+        self.down: Deque[float] = deque(maxlen=history_len)
+        self.diff_cnt = 0  # diff总个数
+        self.up_sum = 0.0  # 前period-1个diff中上涨部分之和
+        self.down_sum = 0.0
 
     def add(self, close):
+        pre_close = self.close_arr[-1] if self.close_arr else None
         self.close_arr.append(close)
-        if len(self.close_arr) == 1:
+        if pre_close is None:
             return 50.0
 
-        self.diff.append(self.close_arr[-1] - self.close_arr[-2])
+        self.diff.append(close - pre_close)
+        self.diff_cnt += 1
 
-        if len(self.diff) < self.period:
-            up_sum = sum(x for x in self.diff if x > 0)
-            down_sum = sum(-x for x in self.diff if x < 0)
-            self.up.append(up_sum / len(self.diff))
-            self.down.append(down_sum / len(self.diff))
+        if self.diff_cnt < self.period:
+            if self.diff[-1] > 0:
+                self.up_sum += self.diff[-1]
+            elif self.diff[-1] < 0:
+                self.down_sum += -self.diff[-1]
+            self.up.append(self.up_sum / self.diff_cnt)
+            self.down.append(self.down_sum / self.diff_cnt)
         else:
             if self.diff[-1] > 0:
                 upval = self.diff[-1]
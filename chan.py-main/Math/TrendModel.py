@@ -1,22 +1,60 @@
+from collections import deque
+from typing import Deque, Iterable, Tuple
+
 from Common.CEnum import TREND_TYPE
 from Common.ChanException import CChanException, ErrCode
 
 
 class CTrendModel:
+    RECAL_PERIOD = 1024  # MEAN累计和每隔多少根K线按窗口重算一次，消除浮点误差累积
+
     def __init__(self, trend_type: TREND_TYPE, T: int):
         self.T = T
-        self.arr = []
+        self.arr: Deque[float] = deque(maxlen=T)
         self.type = trend_type
+        if self.type not in [TREND_TYPE.MEAN, TREND_TYPE.MAX, TREND_TYPE.MIN]:
+            raise CChanException(f"Unknown trendModel Type = {self.type}", ErrCode.PARA_ERROR)
+        self.sum = 0.0
+        self.add_cnt = 0
+        self.cnt = 0  # 已经加入的总K线数
+        self.mono: Deque[Tuple[int, float]] = deque()  # 单调队列 (序号, 值)，队首即窗口最大/最小值
 
     def add(self, value) -> float:
-        self.arr.append(value)
-        if len(self.arr) > self.T:
-            self.arr = self.arr[-self.T:]
         if self.type == TREND_TYPE.MEAN:
-            return sum(self.arr)/len(self.arr)
-        elif self.type == TREND_TYPE.MAX:
-            return max(self.arr)
-        elif self.type == TREND_TYPE.MIN:
-            return min(self.arr)
+            if len(self.arr) < self.T:
+                self.arr.append(value)
+                self.sum = sum(self.arr)
+            else:
+                self.sum += value - self.arr[0]
+                self.arr.append(value)
+                self.add_cnt += 1
+                if self.add_cnt >= self.RECAL_PERIOD:
+                    self.sum = sum(self.arr)
+                    self.add_cnt = 0
+            return self.sum/len(self.arr)
+        self.arr.append(value)
+        self.push_mono(value)
+        return self.mono[0][1]
+
+    def push_mono(self, value):
+        if self.type == TREND_TYPE.MAX:
+            while self.mono and self.mono[-1][1] <= value:
+                self.mono.pop()
         else:
-            raise CChanException(f"Unknown trendModel Type = {self.type}", ErrCode.PARA_ERROR)
+            while self.mono and self.mono[-1][1] >= value:
+                self.mono.pop()
+        self.mono.append((self.cnt, value))
+        if self.mono[0][0] <= self.cnt - self.T:
+            self.mono.popleft()
+        self.cnt += 1
+
+    def reset_window(self, values: Iterable[float]):
+        # 用外部算好的最近T个值重置状态（批量计算之后调用）
+        self.arr = deque(values, maxlen=self.T)
+        self.sum = sum(self.arr)
+        self.add_cnt = 0
+        self.cnt = 0
+        self.mono = deque()
+        if self.type != TREND_TYPE.MEAN:
+            for value in self.arr:
+                self.push_mono(value)
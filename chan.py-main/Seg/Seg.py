@@ -12,6 +12,9 @@ LINE_TYPE = TypeVar('LINE_TYPE', CBi, "CSeg")
 
 
 class CSeg(Generic[LINE_TYPE]):
+    __slots__ = ('idx', 'start_bi', 'end_bi', 'is_sure', 'dir', 'zs_lst', 'eigen_fx', 'seg_idx', 'parent_seg', 'pre', 'next', 'bsp',
+                 'bi_list', 'reason', 'support_trend_line', 'resistance_trend_line', 'ele_inside_is_sure')
+
     def __init__(self, idx: int, start_bi: LINE_TYPE, end_bi: LINE_TYPE, is_sure=True, seg_dir=None, reason="normal"):
         assert start_bi.idx == 0 or start_bi.dir == end_bi.dir or not is_sure, f"{start_bi.idx} {end_bi.idx} {start_bi.dir} {end_bi.dir}"
         self.idx = idx
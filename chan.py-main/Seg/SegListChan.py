@@ -1,3 +1,5 @@
+from typing import Optional
+
 from Bi.BiList import CBiList
 from Common.CEnum import BI_DIR, SEG_TYPE
 
@@ -12,28 +14,40 @@ class CSegListChan(CSegListComm):
 
     def do_init(self):
         # 删除末尾不确定的线段
+        removed_seg_lst = []
         while len(self) and not self.lst[-1].is_sure:
             _seg = self[-1]
             for bi in _seg.bi_list:
                 bi.parent_seg = None
             if _seg.pre:
                 _seg.pre.next = None
-            self.lst.pop()
+            removed_seg_lst.append(self.lst.pop())
         if len(self):
             assert self.lst[-1].eigen_fx and self.lst[-1].eigen_fx.ele[-1]
             if not self.lst[-1].eigen_fx.ele[-1].lst[-1].is_sure:
                 # 如果确定线段的分形的第三元素包含不确定笔，也需要重新算，不然线段分形元素的高低点可能不对
-                self.lst.pop()
+                removed_seg_lst.append(self.lst.pop())
+        self.removed_seg_lst = removed_seg_lst[::-1]
 
     def update(self, bi_lst: CBiList):
+        # 只重算最后一个确定线段之后的部分；结果和之前一样的线段复用原对象，并记录变化的起点供下游判断
+        self.bi_change_begin = bi_lst.pop_change_begin()
         self.do_init()
+        keep_len = len(self)
         if len(self) == 0:
             self.cal_seg_sure(bi_lst, begin_idx=0)
         else:
             self.cal_seg_sure(bi_lst, begin_idx=self[-1].end_bi.idx+1)
         self.collect_left_seg(bi_lst)
+        self.record_change(keep_len)
 
     def cal_seg_sure(self, bi_lst: CBiList, begin_idx: int):
+        # 每处理完一个特征序列分形，从返回的位置继续找下一个；用循环而不是递归，长历史一次性计算时不会超过递归深度
+        next_begin_idx: Optional[int] = begin_idx
+        while next_begin_idx is not None:
+            next_begin_idx = self.find_fx_eigen(bi_lst, next_begin_idx)
+
+    def find_fx_eigen(self, bi_lst: CBiList, begin_idx: int) -> Optional[int]:
         up_eigen = CEigenFX(BI_DIR.UP, lv=self.lv)  # 上升线段下降笔
         down_eigen = CEigenFX(BI_DIR.DOWN, lv=self.lv)  # 下降线段上升笔
         last_seg_dir = None if len(self) == 0 else self[-1].dir
@@ -58,19 +72,20 @@ class CSegListChan(CSegListComm):
                     last_seg_dir = None
 
             if fx_eigen:
-                self.treat_fx_eigen(fx_eigen, bi_lst)
-                break
+                return self.treat_fx_eigen(fx_eigen, bi_lst)
+        return None
 
-    def treat_fx_eigen(self, fx_eigen, bi_lst: CBiList):
+    def treat_fx_eigen(self, fx_eigen, bi_lst: CBiList) -> Optional[int]:
+        # 返回下一次从哪一笔开始找，None表示不用再找了
         _test = fx_eigen.can_be_end(bi_lst)
         end_bi_idx = fx_eigen.GetPeakBiIdx()
         if _test in [True, None]:  # None表示反向分型找到尾部也没找到
             is_true = _test is not None  # 如果是正常结束
             if not self.add_new_seg(bi_lst, end_bi_idx, is_sure=is_true and fx_eigen.all_bi_is_sure()):  # 防止第一根线段的方向与首尾值异常
-                self.cal_seg_sure(bi_lst, end_bi_idx+1)
-                return
+                return end_bi_idx+1
             self.lst[-1].eigen_fx = fx_eigen
             if is_true:
-                self.cal_seg_sure(bi_lst, end_bi_idx + 1)
+                return end_bi_idx + 1
+            return None
         else:
-            self.cal_seg_sure(bi_lst, fx_eigen.lst[1].idx)
+            return fx_eigen.lst[1].idx
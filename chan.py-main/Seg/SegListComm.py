@@ -1,10 +1,11 @@
 import abc
-from typing import Generic, List, TypeVar, Union, overload
+from typing import Generic, List, Optional, TypeVar, Union, overload
 
 from Bi.Bi import CBi
 from Bi.BiList import CBiList
 from Common.CEnum import BI_DIR, LEFT_SEG_METHOD, SEG_TYPE
 from Common.ChanException import CChanException, ErrCode
+from Common.TrimmedList import trim_list
 
 from .Seg import CSeg
 from .SegConfig import CSegConfig
@@ -16,11 +17,60 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
     def __init__(self, seg_config=CSegConfig(), lv=SEG_TYPE.BI):
         self.lst: List[CSeg[SUB_LINE_TYPE]] = []
         self.lv = lv
+        self.change_begin_idx: Optional[int] = 0  # 上次被下游（线段的线段）使用之后第一个有变化的线段，None表示没有变化
+        self.bi_change_begin = 0  # 本次update时输入的笔从这里开始有变化
+        self.removed_seg_lst: List[CSeg[SUB_LINE_TYPE]] = []  # 本次update删掉的线段，重新算出同样的线段时直接复用
         self.do_init()
         self.config = seg_config
 
     def do_init(self):
         self.lst = []
+        self.change_begin_idx = 0
+
+    def pop_change_begin(self) -> int:
+        # 和CBiList.pop_change_begin一致，供线段的线段使用
+        res = len(self) if self.change_begin_idx is None else self.change_begin_idx
+        self.change_begin_idx = None
+        return res
+
+    def has_change(self) -> bool:
+        return self.change_begin_idx is not None
+
+    def get_reusable_seg(self, bi1, bi2, is_sure, seg_dir, reason) -> Optional[CSeg[SUB_LINE_TYPE]]:
+        # 同一位置被删掉的线段，首尾笔相同、属性相同，且这些笔之后没有变化，可以直接复用（不用重建bi_list和趋势线）
+        if len(self.removed_seg_lst) == 0:
+            return None
+        pos = len(self.lst) - self.removed_seg_lst[0].idx
+        if pos < 0 or pos >= len(self.removed_seg_lst):
+            return None
+        seg = self.removed_seg_lst[pos]
+        if seg.start_bi is not bi1 or seg.end_bi is not bi2 or bi2.idx >= self.bi_change_begin or seg.reason != reason:
+            return None
+        if seg.dir != (bi2.dir if seg_dir is None else seg_dir) or seg.is_sure != (is_sure and bi2.idx - bi1.idx >= 2):
+            return None
+        seg.eigen_fx = None
+        for bi in seg.bi_list:
+            bi.parent_seg = seg
+        return seg
+
+    def record_change(self, keep_len: int):
+        # 和删掉的线段逐个比较，第一个不是原对象的位置就是变化的起点；没有变化时下游可以跳过计算
+        removed = self.removed_seg_lst
+        change_idx = None
+        for idx in range(keep_len, max(len(self), keep_len + len(removed))):
+            if idx >= len(self) or idx - keep_len >= len(removed) or self.lst[idx] is not removed[idx - keep_len]:
+                change_idx = idx
+                break
+        if change_idx is not None:
+            self.change_begin_idx = change_idx if self.change_begin_idx is None else min(self.change_begin_idx, change_idx)
+            # 下游要重新计算，复用的线段当作新建的，清掉下游写入的信息
+            removed_ids = {id(seg) for seg in removed}
+            for seg in self.lst[keep_len:]:
+                if id(seg) in removed_ids:
+                    seg.seg_idx = None
+                    seg.parent_seg = None
+                    seg.bsp = None
+        self.removed_seg_lst = []
 
     def __iter__(self):
         yield from self.lst
@@ -37,6 +87,24 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
     def __len__(self):
         return len(self.lst)
 
+    def get_keep_begin(self, keep_cnt: int) -> Optional[int]:
+        # 倒数第keep_cnt个确定线段的下标，确定线段不够时返回None
+        sure_cnt = 0
+        for seg in reversed(self.lst):
+            if seg.is_sure:
+                sure_cnt += 1
+                if sure_cnt >= keep_cnt:
+                    return seg.idx
+        return None
+
+    def trim_before(self, seg_idx: int):
+        # 滚动窗口模式：删除idx<seg_idx的线段，下标保持不变
+        self.lst, removed = trim_list(self.lst, seg_idx)
+        for seg in removed:
+            seg.pre = seg.next = None
+        if len(self.lst) > seg_idx:
+            self.lst[seg_idx].pre = None
+
     def left_bi_break(self, bi_lst: CBiList):
         # 最后一个确定线段之后的笔有突破该线段最后一笔的
         if len(self) == 0:
@@ -136,12 +204,14 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
         bi1_idx = 0 if len(self) == 0 else self[-1].end_bi.idx+1
         bi1 = bi_lst[bi1_idx]
         bi2 = bi_lst[end_bi_idx]
-        self.lst.append(CSeg(len(self.lst), bi1, bi2, is_sure=is_sure, seg_dir=seg_dir, reason=reason))
+        reuse_seg = self.get_reusable_seg(bi1, bi2, is_sure, seg_dir, reason)
+        self.lst.append(reuse_seg or CSeg(len(self.lst), bi1, bi2, is_sure=is_sure, seg_dir=seg_dir, reason=reason))
 
         if len(self.lst) >= 2:
             self.lst[-2].next = self.lst[-1]
             self.lst[-1].pre = self.lst[-2]
-        self.lst[-1].update_bi_list(bi_lst, bi1_idx, end_bi_idx)
+        if reuse_seg is None:
+            self.lst[-1].update_bi_list(bi_lst, bi1_idx, end_bi_idx)
 
     def add_new_seg(self, bi_lst: CBiList, end_bi_idx: int, is_sure=True, seg_dir=None, split_first_seg=True, reason="normal"):
         try:
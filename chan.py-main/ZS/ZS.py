@@ -11,6 +11,9 @@ LINE_TYPE = TypeVar('LINE_TYPE', CBi, "CSeg")
 
 
 class CZS(Generic[LINE_TYPE]):
+    __slots__ = ('__is_sure', '__sub_zs_lst', '__begin', '__begin_bi', '__end', '__end_bi', '__low', '__high', '__mid',
+                 '__peak_high', '__peak_low', '__bi_in', '__bi_out', '__bi_lst', '_memoize_cache')
+
     def __init__(self, lst: Optional[List[LINE_TYPE]], is_sure=True):
         # begin/end：永远指向 klu
         # low/high: 中枢的范围
@@ -159,3 +159,10 @@ class CZSList:
             return
         while len(self.zs_lst) >= 2 and self.zs_lst[-2].combine(self.zs_lst[-1], combine_mode=self.config.zs_combine_mode):
             self.zs_lst = self.zs_lst[:-1]  # 合并后删除最后一个
+
+    def trim_before(self, line_idx: int):
+        # 滚动窗口模式：删除起点笔idx<=line_idx的中枢，保留的中枢的进入笔bi_in也在保留范围内
+        # 中枢没有按位置访问的下标，直接从列表头部删除
+        cnt = next((i for i, zs in enumerate(self.zs_lst) if zs.begin_bi.idx > line_idx), len(self.zs_lst))
+        del self.zs_lst[:cnt]
+        self.free_item_lst = [item for item in self.free_item_lst if item.idx >= line_idx]
@@ -0,0 +1,254 @@
+import argparse
+import copy
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from Chan import CChan
+from ChanConfig import CChanConfig
+from ChanSerializer import dumps_chan, loads_chan
+from Bi.BiList import CBiList
+from BuySellPoint.BSPointList import CBSPointList
+from Common.CEnum import DATA_SRC, KL_TYPE, KLINE_DIR, SEG_TYPE
+from DataAPI.BulkAPI import CBulkAPI
+from DataAPI.csvAPI import CSV_API
+from KLine.KLine import CKLine
+from KLine.KLine_List import get_seglist_instance
+from ZS.ZSList import CZSList
+
+from .synthetic import gen_ohlc, to_csv, to_klu_list
+
+# 各计算阶段的吞吐量和峰值内存，结果输出为JSON，方便不同版本之间对比
+# 在仓库根目录运行：python -m benchmarks.run --bars 50000 --output bench.json
+# - 每个阶段的准备工作（生成K线、算好上游阶段）不计时，计时取repeat次中最快的一次
+# - 峰值内存是单独一次tracemalloc下运行的Python内存分配峰值（不含准备阶段已经占用的内存）
+# - 笔在K线合并过程中逐根更新，只计update_bi的时间；线段/中枢/买卖点在一次完整计算的笔/线段上重算，只计这一个阶段的时间
+
+BENCH_CODE = "BENCH"
+
+
+class CBenchCSV(CSV_API):
+    csv_dir = ""
+
+    def get_file_path(self):
+        return os.path.join(self.csv_dir, f"{self.code}_{self.k_type.name[2:].lower()}.csv")
+
+
+class CBenchContext:
+    def __init__(self, args):
+        self.k_type = KL_TYPE.K_5M
+        self.data = gen_ohlc(args.bars, seed=args.seed, volatility=args.volatility, gap_prob=args.gap_prob, flat_prob=args.flat_prob, k_type=self.k_type)
+        self.step_data = {col: value[:args.step_bars] for col, value in self.data.items()}
+        self.config_dict = {"print_warning": False}
+        self.tmp_dir = tempfile.mkdtemp(prefix="chan_bench_")
+        self._chan: Optional[CChan] = None
+
+    def config(self, **kwargs) -> CChanConfig:
+        return CChanConfig({**self.config_dict, **kwargs})
+
+    def new_chan(self, data=None, **kwargs) -> CChan:
+        CBulkAPI.set_data(BENCH_CODE, self.k_type, self.data if data is None else data)
+        try:
+            chan = CChan(code=BENCH_CODE, data_src=DATA_SRC.BULK, lv_list=[self.k_type], config=self.config(**kwargs))
+        finally:
+            CBulkAPI.clear_data(BENCH_CODE)
+        return chan
+
+    def step_chan(self, data):
+        # 逐步模式在迭代时才读取数据，迭代完才能清掉
+        CBulkAPI.set_data(BENCH_CODE, self.k_type, data)
+        try:
+            chan = CChan(code=BENCH_CODE, data_src=DATA_SRC.BULK, lv_list=[self.k_type], config=self.config(trigger_step=True))
+            for _ in chan.step_load():
+                pass
+        finally:
+            CBulkAPI.clear_data(BENCH_CODE)
+
+    @property
+    def chan(self) -> CChan:
+        # 上游阶段都算好的CChan，各阶段重放用
+        if self._chan is None:
+            self._chan = self.new_chan()
+        return self._chan
+
+
+def combine_klu(klu_lst, bi_list: Optional[CBiList] = None) -> float:
+    # 同非逐步模式下CKLine_List.add_single_klu的K线合并和笔计算（不算指标）
+    # 笔要在K线合并过程中逐根更新，返回update_bi本身的耗时
+    lst: List[CKLine] = []
+    bi_cost = 0.0
+    for klu in klu_lst:
+        if len(lst) == 0:
+            lst.append(CKLine(klu, idx=0))
+            continue
+        _dir = lst[-1].try_add(klu)
+        if _dir != KLINE_DIR.COMBINE:
+            lst.append(CKLine(klu, idx=len(lst), _dir=_dir))
+            if len(lst) >= 3:
+                lst[-2].update_fx(lst[-3], lst[-1])
+            if bi_list is not None:
+                begin = time.perf_counter()
+                bi_list.update_bi(lst[-2], lst[-1], False)
+                bi_cost += time.perf_counter() - begin
+    return bi_cost
+
+
+def get_stage_lst(ctx: CBenchContext) -> Dict[str, Tuple[Callable, Callable, int]]:
+    # 阶段名: (准备函数, 计时函数, 处理的K线数)，准备函数的返回值作为计时函数的参数
+    # 计时函数返回float时表示只计其中一部分的耗时（如bi_update），以返回值为准
+    bars = len(ctx.data[next(iter(ctx.data))])
+    step_bars = len(ctx.step_data[next(iter(ctx.step_data))])
+    conf = ctx.config()
+
+    def setup_csv():
+        CBenchCSV.csv_dir = ctx.tmp_dir
+        api = CBenchCSV(BENCH_CODE, k_type=ctx.k_type)
+        if not os.path.exists(api.get_file_path()):
+            to_csv(ctx.data, api.get_file_path())
+        return (api,)
+
+    def run_csv(api):
+        for _ in api.get_kl_data():
+            pass
+
+    def run_combine(klu_lst):
+        combine_klu(klu_lst)
+
+    def setup_plot():
+        import matplotlib
+        matplotlib.use("Agg")
+        from Plot.PlotDriver import CPlotDriver
+        return CPlotDriver, ctx.chan, os.path.join(ctx.tmp_dir, "plot.png")
+
+    def run_plot(plot_driver_cls, chan, path):
+        plot_config = {"plot_kline": True, "plot_bi": True, "plot_seg": True, "plot_zs": True, "plot_bsp": True, "plot_macd": True}
+        plot_driver_cls(chan, plot_config=plot_config, plot_para={"figure": {"x_range": 500}}).save2img(path)
+
+    def setup_pickle():
+        return ctx.chan, os.path.join(ctx.tmp_dir, "chan.pkl")
+
+    def run_pickle(chan, path):
+        chan.chan_dump_pickle(path)
+        CChan.chan_load_pickle(path)
+
+    def setup_seg():
+        return get_seglist_instance(conf.seg_conf, SEG_TYPE.BI), ctx.chan[0].bi_list
+
+    def setup_zs():
+        kl_list = ctx.chan[0]
+        return CZSList(conf.zs_conf), kl_list.bi_list, kl_list.seg_list
+
+    def setup_bsp():
+        kl_list = ctx.chan[0]
+        return CBSPointList(conf.bs_point_conf), kl_list.bi_list, kl_list.seg_list
+
+    return {
+        "csv_api": (setup_csv, run_csv, bars),
+        "kline_combine": (lambda: (to_klu_list(ctx.data, ctx.k_type),), run_combine, bars),
+        "bi_update": (lambda: (to_klu_list(ctx.data, ctx.k_type), CBiList(conf.bi_conf)), combine_klu, bars),
+        "seg_update": (setup_seg, lambda seg_list, bi_list: seg_list.update(bi_list), bars),
+        "zs_cal": (setup_zs, lambda zs_list, bi_list, seg_list: zs_list.cal_bi_zs(bi_list, seg_list), bars),
+        "bsp_cal": (setup_bsp, lambda bsp_list, bi_list, seg_list: bsp_list.cal(bi_list, seg_list), bars),
+        "chan_non_step": (lambda: (), ctx.new_chan, bars),
+        "chan_step": (lambda: (), lambda: ctx.step_chan(ctx.step_data), step_bars),
+        "deepcopy": (lambda: (ctx.chan,), copy.deepcopy, bars),
+        "pickle": (setup_pickle, run_pickle, bars),
+        "serialize": (lambda: (ctx.chan,), lambda chan: loads_chan(dumps_chan(chan)), bars),
+        "plot": (setup_plot, run_plot, bars),
+    }
+
+
+def bench_stage(setup: Callable, func: Callable, bars: int, repeat: int, trace_memory: bool) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        begin = time.perf_counter()
+        cost = func(*args)
+        best = min(best, cost if isinstance(cost, float) else time.perf_counter() - begin)
+        del args
+    res = {"bars": bars, "seconds": best, "bars_per_sec": bars / best if best > 0 else None}
+    if trace_memory:
+        args = setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            res["peak_mem_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return res
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=root, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="chan.py benchmark")
+    parser.add_argument("--bars", type=int, default=20000, help="number of synthetic 5m bars")
+    parser.add_argument("--step-bars", type=int, default=3000, help="number of bars for chan_step (step mode is much slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--volatility", type=float, default=0.004)
+    parser.add_argument("--gap-prob", type=float, default=0.01)
+    parser.add_argument("--flat-prob", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stage", action="append", help="stage to run (repeatable), default all")
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra tracemalloc run")
+    parser.add_argument("--output", help="write JSON to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 0x10000))  # deepcopy整个CChan
+    ctx = CBenchContext(args)
+    stage_dict = get_stage_lst(ctx)
+    stage_lst = args.stage or list(stage_dict.keys())
+    result: Dict[str, dict] = {}
+    try:
+        for stage in stage_lst:
+            setup, func, bars = stage_dict[stage]
+            try:
+                result[stage] = bench_stage(setup, func, bars, args.repeat, not args.no_memory)
+            except ImportError as e:  # 画图等可选依赖没有安装
+                result[stage] = {"skipped": str(e)}
+            print(f"{stage}: {result[stage]}", file=sys.stderr)
+    finally:
+        shutil.rmtree(ctx.tmp_dir, ignore_errors=True)
+    report = {
+        "meta": {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_commit": get_git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "params": vars(args),
+        },
+        "results": result,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
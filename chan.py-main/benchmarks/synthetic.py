@@ -0,0 +1,80 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from Common.CEnum import DATA_FIELD, KL_TYPE
+from DataAPI.BulkAPI import bulk_to_klu_list
+from KLine.KLine_Unit import CKLine_Unit
+
+# 确定性的合成K线：对数价格随机游走，同样的参数和seed每次生成完全相同的数据
+# - volatility: 每根K线收盘相对开盘的对数收益率标准差
+# - gap_prob/gap_size: 开盘相对上一根收盘跳空的概率和幅度（对数收益率标准差）
+# - flat_prob: 一字K线（开高低收相同，比如停牌、涨跌停）的概率
+# 返回{列名: numpy数组}，可以直接交给DATA_SRC.BULK（CBulkAPI.set_data）或者CChan.load_bulk
+
+KL_MINUTES = {
+    KL_TYPE.K_1M: 1, KL_TYPE.K_3M: 3, KL_TYPE.K_5M: 5, KL_TYPE.K_15M: 15,
+    KL_TYPE.K_30M: 30, KL_TYPE.K_60M: 60, KL_TYPE.K_DAY: 24 * 60,
+}
+
+
+def gen_ohlc(
+    n: int,
+    seed: int = 0,
+    volatility: float = 0.004,
+    gap_prob: float = 0.0,
+    gap_size: float = 0.01,
+    flat_prob: float = 0.0,
+    init_price: float = 100.0,
+    k_type: KL_TYPE = KL_TYPE.K_5M,
+    begin_time: str = "2020-01-01T00:00",
+) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    ret = rng.normal(0.0, volatility, n)
+    gap = np.where(rng.random(n) < gap_prob, rng.normal(0.0, gap_size, n), 0.0)
+    gap[0] = 0.0
+    flat = rng.random(n) < flat_prob
+    ret[flat] = 0.0
+
+    log_close = np.log(init_price) + np.cumsum(gap + ret)
+    _open = np.exp(log_close - ret)
+    close = np.exp(log_close)
+    shadow = volatility / 2
+    high = np.maximum(_open, close) * np.exp(np.abs(rng.normal(0.0, shadow, n)))
+    low = np.minimum(_open, close) * np.exp(-np.abs(rng.normal(0.0, shadow, n)))
+    high[flat] = low[flat] = close[flat] = _open[flat]
+    volume = rng.integers(100, 10000, n).astype(np.float64)
+    volume[flat] = 0.0
+
+    step = np.timedelta64(KL_MINUTES[k_type], 'm')
+    time_arr = np.datetime64(begin_time, 'm') + np.arange(n) * step
+    return {
+        DATA_FIELD.FIELD_TIME: time_arr,
+        DATA_FIELD.FIELD_OPEN: _open,
+        DATA_FIELD.FIELD_HIGH: high,
+        DATA_FIELD.FIELD_LOW: low,
+        DATA_FIELD.FIELD_CLOSE: close,
+        DATA_FIELD.FIELD_VOLUME: volume,
+    }
+
+
+def to_klu_list(data: Dict[str, np.ndarray], k_type: KL_TYPE = KL_TYPE.K_5M) -> List[CKLine_Unit]:
+    # 同CChan.load_stock_data，编好idx并连好pre/next，可以直接喂给CKLine_List.add_single_klu
+    res = bulk_to_klu_list(data, k_type)
+    for idx, klu in enumerate(res):
+        klu.set_idx(idx)
+        if idx > 0:
+            klu.set_pre_klu(res[idx-1])
+    return res
+
+
+def to_csv(data: Dict[str, np.ndarray], path: str):
+    # 格式同DataAPI/csvAPI.py默认的列：time_key,open,high,low,close,volume，时间为YYYY/MM/DD HH:MM
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    time_str = np.datetime_as_string(data[DATA_FIELD.FIELD_TIME], unit='m')
+    columns = [DATA_FIELD.FIELD_OPEN, DATA_FIELD.FIELD_HIGH, DATA_FIELD.FIELD_LOW, DATA_FIELD.FIELD_CLOSE, DATA_FIELD.FIELD_VOLUME]
+    with open(path, "w") as f:
+        f.write(",".join([DATA_FIELD.FIELD_TIME] + columns) + "\n")
+        for t, *values in zip(time_str.tolist(), *[data[col].tolist() for col in columns]):
+            f.write(f"{t[:10].replace('-', '/')} {t[11:16]}," + ",".join(repr(v) for v in values) + "\n")